@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers
+
+
+class SubRequestSerializer(serializers.Serializer):
+    """serializer for one request inside a batch"""
+    method = serializers.ChoiceField(choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'))
+    # path on this site including the query string, eg /recipe/recipes/?tags=1
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """serializer for the batch request payload"""
+    requests = SubRequestSerializer(many=True)
+    # run the sub-requests concurrently, only honoured when all of them are GETs
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        if not value:
+            raise serializers.ValidationError(_('At least one request is required.'))
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                _('At most %(max)d requests per batch.') % {'max': settings.BATCH_MAX_REQUESTS}
+            )
+        return value
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase, TransactionTestCase
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Tag
+
+BATCH_URL = reverse('batch:batch')
+
+
+class PublicBatchApiTests(TestCase):
+    """Test the batch API without authentication"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        """Test that authentication is required for batches"""
+        payload = {'requests': [{'method': 'GET', 'path': '/user/me/'}]}
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(TestCase):
+    """Test the batch API for an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='test@gmail.com',
+            password='testpass',
+            name='name'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_batch_runs_sub_requests_in_order(self):
+        """Test reads and writes of a batch each get their own response"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        payload = {'requests': [
+            {'method': 'GET', 'path': '/user/me/'},
+            {'method': 'POST', 'path': '/recipe/tags/', 'body': {'name': 'Dessert'}},
+            {'method': 'GET', 'path': '/recipe/tags/?ordering=name'},
+            {'method': 'GET', 'path': '/recipe/missing/'},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        responses = res.data['responses']
+        self.assertEqual([r['status'] for r in responses], [200, 201, 200, 404])
+        self.assertEqual(responses[0]['body']['email'], self.user.email)
+        self.assertEqual([tag['name'] for tag in responses[2]['body']], ['Dessert', 'Vegan'])
+
+    def test_batch_sub_request_errors(self):
+        """Test a failing sub-request does not fail the other ones"""
+        payload = {'requests': [
+            {'method': 'POST', 'path': '/recipe/tags/', 'body': {'name': ''}},
+            {'method': 'GET', 'path': '/recipe/tags/'},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual([r['status'] for r in res.data['responses']], [400, 200])
+
+    def test_batch_non_api_paths_rejected(self):
+        """Test admin pages, media files and metrics cannot be batched"""
+        payload = {'requests': [
+            {'method': 'GET', 'path': '/admin/'},
+            {'method': 'GET', 'path': '/media/uploads/images/ab/abc.jpg'},
+            {'method': 'GET', 'path': '/metrics/'},
+            {'method': 'GET', 'path': '/user/me/'},
+        ]}
+
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual([r['status'] for r in res.data['responses']], [400, 400, 400, 200])
+
+    def test_batch_request_limit(self):
+        """Test batches over BATCH_MAX_REQUESTS are rejected"""
+        payload = {'requests': [{'method': 'GET', 'path': '/user/me/'}] * 3}
+
+        with self.settings(BATCH_MAX_REQUESTS=2):
+            res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ParallelBatchApiTests(TransactionTestCase):
+    """Test parallel batches - their reads run on other threads, with connections of their own
+    that only see committed rows"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_parallel_reads(self):
+        """Test reads of a parallel batch each get their response, in the order given"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        payload = {'parallel': True, 'requests': [
+            {'method': 'GET', 'path': '/user/me/'},
+            {'method': 'GET', 'path': '/recipe/tags/'},
+            {'method': 'GET', 'path': '/recipe/missing/'},
+            {'method': 'GET', 'path': '/admin/'},
+        ]}
+
+        with mock.patch('batch.views.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as executor:
+            res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertTrue(executor.called)
+        responses = res.data['responses']
+        self.assertEqual([r['status'] for r in responses], [200, 200, 404, 400])
+        self.assertEqual(responses[0]['body']['email'], self.user.email)
+        self.assertEqual([tag['name'] for tag in responses[1]['body']], ['Vegan'])
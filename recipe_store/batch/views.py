@@ -0,0 +1,112 @@
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import resolve, Resolver404
+from rest_framework import status
+from user.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from batch.serializers import BatchSerializer
+
+logger = logging.getLogger(__name__)
+
+# WSGI environ keys copied from the batch request to every sub-request,
+# along with the HTTP_* headers (except the ones describing the batch body itself)
+INHERITED_ENVIRON = (
+    'SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL', 'SCRIPT_NAME', 'REMOTE_ADDR',
+    'wsgi.url_scheme', 'wsgi.errors', 'wsgi.version', 'wsgi.multithread', 'wsgi.multiprocess',
+    'wsgi.run_once',
+)
+EXCLUDED_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_CONTENT_LENGTH', 'HTTP_CONTENT_TYPE')
+
+
+class BatchView(APIView):
+    """Run several API requests in one HTTP call
+    POST {"requests": [{"method": "GET", "path": "/user/me/"}, ...], "parallel": false}
+    The token is checked once for the whole batch, every sub-request is routed through
+    the URLconf and answered with its own status code."""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    # URL namespaces of the API views a batch may call: no admin pages, media files or metrics
+    namespaces = ('user', 'recipe_app')
+
+    def _build_request(self, request, method, path, body):
+        """Create the WSGI request of one sub-request, authenticated as the batch user"""
+        url = urlsplit(path)
+        content = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            key: value for key, value in request.META.items()
+            if key in INHERITED_ENVIRON or (key.startswith('HTTP_') and key not in EXCLUDED_HEADERS)
+        }
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': io.BytesIO(content),
+        })
+        sub_request = WSGIRequest(environ)
+        # DRF uses these instead of running the authentication classes again
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+        return sub_request
+
+    def _run(self, sub_request):
+        """Dispatch one sub-request, returning {"status": ..., "body": ...}"""
+        try:
+            match = resolve(sub_request.path_info)
+        except Resolver404:
+            return {'status': status.HTTP_404_NOT_FOUND, 'body': {'detail': 'Not found.'}}
+        if getattr(match.func, 'cls', None) is BatchView:
+            return {'status': status.HTTP_400_BAD_REQUEST, 'body': {'detail': 'Batches cannot be nested.'}}
+        if not match.namespaces or match.namespaces[0] not in self.namespaces:
+            detail = 'Only API paths can be batched.'
+            return {'status': status.HTTP_400_BAD_REQUEST, 'body': {'detail': detail}}
+        sub_request.resolver_match = match
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            # DRF views turn API errors into responses, anything else must not sink the batch
+            logger.exception('Batch sub-request %s %s failed', sub_request.method, sub_request.path)
+            return {'status': status.HTTP_500_INTERNAL_SERVER_ERROR, 'body': {'detail': 'Server error.'}}
+        if hasattr(response, 'data'):
+            # DRF response: hand over the data, it is rendered once with the batch response
+            body = response.data
+        elif response.streaming:
+            body = None
+        else:
+            body = response.content.decode(response.charset)
+        return {'status': response.status_code, 'body': body}
+
+    def _run_in_thread(self, sub_request):
+        try:
+            return self._run(sub_request)
+        finally:
+            # each worker thread opened its own database connection
+            connections.close_all()
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sub_requests = [
+            self._build_request(request, item['method'], item['path'], item.get('body'))
+            for item in serializer.validated_data['requests']
+        ]
+        reads_only = all(sub_request.method == 'GET' for sub_request in sub_requests)
+        if serializer.validated_data['parallel'] and reads_only and len(sub_requests) > 1:
+            # reads do not depend on each other, run them side by side
+            with ThreadPoolExecutor(max_workers=settings.BATCH_MAX_WORKERS) as executor:
+                responses = list(executor.map(self._run_in_thread, sub_requests))
+        else:
+            # writes run one after the other in the order given
+            responses = [self._run(sub_request) for sub_request in sub_requests]
+        return Response({'responses': responses})
@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelectMultiple
 # Here import the built-in userAdmin as BaseUserAdmin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from core import models
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from core import bulk, jobs, models
 from django.utils.translation import gettext as _
 # Register your models here.
 
@@ -24,9 +29,150 @@ class UserAdmin(BaseUserAdmin):
             'fields': ('email', 'password1', 'password2'),
         }),
     )
+    actions = ['purge_users']
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # delete_selected collects every recipe, tag and link of the users in this request
+        actions.pop('delete_selected', None)
+        return actions
+
+    def purge_users(self, request, queryset):
+        """Lock the selected users out now, delete them with their data in the background"""
+        user_ids = list(queryset.values_list('pk', flat=True))
+        bulk.lock_out(user_ids)
+        for user_id in user_ids:
+            # see core.bulk.purge_user
+            jobs.enqueue('users.purge', user_id=user_id)
+        self.message_user(request, _('%d users deactivated, their data is being deleted.') % len(user_ids))
+    purge_users.short_description = _('Purge selected users and their data')
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that does not count huge tables row by row
+    The count stops at ADMIN_COUNT_LIMIT rows, for an unfiltered PostgreSQL table the
+    planner's row estimate is used past that. A page past the count is looked up when asked
+    for: the count then grows to that page, plus a next page when there are more rows."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_COUNT_LIMIT
+        # COUNT(*) over a LIMIT subquery: reads at most limit index entries
+        count = queryset.values('pk')[:limit].count()
+        if count < limit:
+            return count
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > limit:
+                return int(row[0])
+        return count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # super() got past the integer check
+            number = int(number)
+            if number < 1 or self.count < settings.ADMIN_COUNT_LIMIT:
+                raise
+            # the count stopped short: the page exists if it has rows
+            bottom = (number - 1) * self.per_page
+            found = self.object_list.values('pk')[bottom:bottom + self.per_page + 1].count()
+            if not found:
+                raise
+            self.count = bottom + found
+            self.__dict__.pop('num_pages', None)
+            return number
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Changelists whose cost does not grow with the table"""
+    paginator = EstimatedCountPaginator
+    # no second COUNT(*) of the whole table next to the filtered one
+    show_full_result_count = False
+    # newest first, straight off the primary key
+    ordering = ('-id',)
+    list_select_related = ('user',)
+    # a text box for the owner instead of a <select> of every user
+    raw_id_fields = ('user',)
+
+
+class RecipeAttrAdmin(ScalableAdmin):
+    """Tags and ingredients, searched through the folded name prefix index"""
+    list_display = ('name', 'user', 'recipe_count')
+    # required by autocomplete_fields, the search itself is get_search_results()
+    search_fields = ('name',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # autocomplete requests of a recipe form only see the recipe owner's objects
+        owner = request.GET.get('owner', '')
+        if owner.isdigit():
+            queryset = queryset.filter(user_id=owner)
+        if search_term:
+            # search_name range: (user, search_name) index when the owner is known
+            queryset = queryset.prefix(search_term)
+        return queryset, False
+
+
+class OwnerAutocompleteSelectMultiple(AutocompleteSelectMultiple):
+    """Autocomplete widget asking for the objects of one owner only"""
+
+    def __init__(self, rel, admin_site, owner_id=None, **kwargs):
+        super().__init__(rel, admin_site, **kwargs)
+        self.owner_id = owner_id
+
+    def get_url(self):
+        url = super().get_url()
+        return f'{url}?owner={self.owner_id}' if self.owner_id else url
+
+
+class RecipeAdmin(ScalableAdmin):
+    list_display = ('title', 'user', 'time_minutes', 'price')
+    search_fields = ('title',)
+    # select2 widgets loading matches on demand instead of every tag/ingredient in the database
+    autocomplete_fields = ('tags', 'ingredients')
+    exclude = ('minhash',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # a recipe id, or a (case sensitive) title prefix - both indexed
+        if search_term.isdigit():
+            return queryset.filter(pk=search_term), False
+        if search_term:
+            queryset = queryset.filter(title__gte=search_term, title__lt=search_term + '\U0010ffff')
+        return queryset, False
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        owner_id = None
+        if db_field.name in self.autocomplete_fields:
+            # the owner entered in the form, or given to the add page as ?user=<id>,
+            # else the owner of the recipe being changed
+            owner = request.POST.get('user') or request.GET.get('user') or ''
+            object_id = request.resolver_match.kwargs.get('object_id', '')
+            if owner.isdigit():
+                owner_id = int(owner)
+            elif object_id.isdigit():
+                recipes = models.Recipe.objects.filter(pk=object_id)
+                owner_id = recipes.values_list('user_id', flat=True).first()
+        if owner_id:
+            # only the owner's objects are offered, and accepted
+            kwargs['queryset'] = db_field.remote_field.model.objects.filter(user_id=owner_id)
+        form_field = super().formfield_for_manytomany(db_field, request, **kwargs)
+        if owner_id:
+            # the stock autocomplete widget is always set by super(), swap it
+            form_field.widget = OwnerAutocompleteSelectMultiple(
+                db_field.remote_field, self.admin_site, owner_id=owner_id, using=kwargs.get('using'),
+            )
+            form_field.widget.choices = form_field.choices
+        return form_field
 
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
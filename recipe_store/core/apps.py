@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # register the signal receivers maintaining denormalized recipe data
+        from core import signals  # noqa: F401
+        # register the background tasks defined outside the modules signals imports
+        from core import bulk, dedupe  # noqa: F401
@@ -0,0 +1,247 @@
+import time
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core import changes, images, jobs, minhash, pantry
+from core.models import Recipe, RecipeBand, Tag, Ingredient, Change
+from user import tokens
+
+# Set-based writes for large amounts of recipe data.
+# Model.delete() and QuerySet.delete() go through the collector, which loads every related
+# row into Python and sends per-object signals, related managers send m2m_changed per call.
+# The helpers here run one DELETE ... WHERE id IN (...) or one multi-row INSERT per table
+# and chunk, and do the work of the core.signals receivers for the whole chunk at once.
+
+CHUNK_SIZE = 500
+
+
+def _raw_delete(queryset):
+    """DELETE the rows of queryset without collecting them or sending signals"""
+    # QuerySet._raw_delete is what the collector itself runs for fast deletes
+    return queryset._raw_delete(queryset.db)
+
+
+def chunks(queryset, size):
+    """Yield lists of at most size primary keys of queryset, keyset paginated"""
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last_pk = 0
+    while True:
+        chunk = list(pks.filter(pk__gt=last_pk)[:size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1]
+
+
+def delete_recipe_rows(recipe_ids):
+    """Delete recipes with their link and LSH band rows, return their image names
+    Derived data of other objects (recipe counts, change feed) is left to the caller"""
+    recipes = Recipe.objects.filter(pk__in=recipe_ids)
+    image_names = set(recipes.exclude(Q(image='') | Q(image=None)).values_list('image', flat=True))
+    _raw_delete(Recipe.tags.through.objects.filter(recipe_id__in=recipe_ids))
+    _raw_delete(Recipe.ingredients.through.objects.filter(recipe_id__in=recipe_ids))
+    _raw_delete(RecipeBand.objects.filter(recipe_id__in=recipe_ids))
+    _raw_delete(recipes)
+    return image_names
+
+
+def _add_counts(model, counts, delta):
+    """Add delta * count to recipe_count of each tag/ingredient id in counts"""
+    by_count = defaultdict(list)
+    for attr_id, count in counts.items():
+        by_count[count].append(attr_id)
+    # one UPDATE per distinct count, usually a handful
+    for count, attr_ids in by_count.items():
+        model.objects.filter(pk__in=attr_ids).update(recipe_count=F('recipe_count') + delta * count)
+
+
+def _release_links(model, links):
+    """Decrement the counters of the tags/ingredients of links about to be deleted, return their ids"""
+    column = f'{model._meta.model_name}_id'
+    counts = dict(links.values_list(column).annotate(count=Count('pk')).order_by())
+    _add_counts(model, counts, -1)
+    return list(counts)
+
+
+def delete_recipes(user_id, recipe_ids, chunk_size=CHUNK_SIZE):
+    """Delete recipes of a user in one transaction, returns the number deleted
+    Counters, change feed, pantry index and image files are kept in sync like core.signals does"""
+    recipe_ids = list(recipe_ids)
+    deleted = 0
+    with transaction.atomic():
+        for start in range(0, len(recipe_ids), chunk_size):
+            chunk = list(
+                Recipe.objects.filter(user_id=user_id, pk__in=recipe_ids[start:start + chunk_size])
+                .values_list('pk', flat=True)
+            )
+            if not chunk:
+                continue
+            for model, through in ((Tag, Recipe.tags.through), (Ingredient, Recipe.ingredients.through)):
+                attr_ids = _release_links(model, through.objects.filter(recipe_id__in=chunk))
+                changes.record(user_id, changes.kind_of(model), attr_ids)
+            for name in delete_recipe_rows(chunk):
+                images.release(name)
+            changes.record(user_id, changes.kind_of(Recipe), chunk, deleted=True)
+            pantry.invalidate(user_id, chunk)
+            deleted += len(chunk)
+    return deleted
+
+
+def retag_recipes(user_id, recipe_ids, add=(), remove=(), chunk_size=CHUNK_SIZE):
+    """Add and remove tags on recipes of a user in one transaction, the tags must be the user's
+    Returns (links added, links removed, ids of the recipes changed)"""
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    # a tag given twice would be inserted twice
+    add, remove = sorted(set(add)), sorted(set(remove))
+    through = Recipe.tags.through
+    added = removed = 0
+    changed = set()
+    # the tags whose recipe_count moved
+    changed_tags = set()
+    with transaction.atomic():
+        for start in range(0, len(recipe_ids), chunk_size):
+            chunk = list(
+                Recipe.objects.filter(user_id=user_id, pk__in=recipe_ids[start:start + chunk_size])
+                .values_list('pk', flat=True)
+            )
+            if remove:
+                links = through.objects.filter(recipe_id__in=chunk, tag_id__in=remove)
+                changed.update(links.values_list('recipe_id', flat=True))
+                changed_tags.update(_release_links(Tag, links))
+                removed += _raw_delete(links)
+            if add:
+                linked = through.objects.filter(recipe_id__in=chunk, tag_id__in=add)
+                existing = set(linked.values_list('recipe_id', 'tag_id'))
+                new_links = [
+                    through(recipe_id=recipe_id, tag_id=tag_id)
+                    for recipe_id in chunk for tag_id in add if (recipe_id, tag_id) not in existing
+                ]
+                through.objects.bulk_create(new_links, batch_size=chunk_size)
+                counts = Counter(link.tag_id for link in new_links)
+                _add_counts(Tag, counts, 1)
+                changed_tags.update(counts)
+                changed.update(link.recipe_id for link in new_links)
+                added += len(new_links)
+
+        changed = sorted(changed)
+        for start in range(0, len(changed), chunk_size):
+            Recipe.objects.filter(pk__in=changed[start:start + chunk_size]).update(updated_at=timezone.now())
+        changes.record(user_id, changes.kind_of(Recipe), changed)
+        changes.record(user_id, changes.kind_of(Tag), sorted(changed_tags))
+        # signatures catch up in the background, the response does not wait for them
+        minhash.refresh_signatures_later(changed)
+    return added, removed, changed
+
+
+def merge_recipes(user_id, keep_id, recipe_ids):
+    """Merge recipes of a user into the recipe keep_id in one transaction: their tags and
+    ingredients are linked to it (their image too, if it has none), then they are deleted
+    Returns (recipes merged, tags added, ingredients added), raises Recipe.DoesNotExist"""
+    with transaction.atomic():
+        keep = Recipe.objects.select_for_update().get(user_id=user_id, pk=keep_id)
+        recipe_ids = list(
+            Recipe.objects.filter(user_id=user_id, pk__in=recipe_ids).exclude(pk=keep_id)
+            .values_list('pk', flat=True)
+        )
+        added = []
+        for model, through in ((Tag, Recipe.tags.through), (Ingredient, Recipe.ingredients.through)):
+            column = f'{model._meta.model_name}_id'
+            linked = through.objects.filter(recipe_id=keep_id).values_list(column, flat=True)
+            moved = set(
+                through.objects.filter(recipe_id__in=recipe_ids).exclude(**{f'{column}__in': linked})
+                .values_list(column, flat=True)
+            )
+            # one INSERT for the new links; the links of the merged recipes go with them below
+            through.objects.bulk_create([through(recipe_id=keep_id, **{column: pk}) for pk in moved])
+            _add_counts(model, dict.fromkeys(moved, 1), 1)
+            changes.record(user_id, changes.kind_of(model), moved)
+            added.append(len(moved))
+
+        fields = {'updated_at': timezone.now()}
+        if not keep.image:
+            # shared files are reference counted by name, see core.images: nothing to copy
+            image = Recipe.objects.filter(pk__in=recipe_ids).exclude(Q(image='') | Q(image=None)) \
+                .values_list('image', flat=True).first()
+            if image:
+                fields['image'] = image
+        Recipe.objects.filter(pk=keep_id).update(**fields)
+
+        merged = delete_recipes(user_id, recipe_ids)
+        changes.record(user_id, changes.kind_of(Recipe), [keep_id])
+        pantry.invalidate(user_id, [keep_id])
+        minhash.refresh_signatures_later([keep_id])
+    return merged, added[0], added[1]
+
+
+def lock_out(user_ids):
+    """Deactivate users and invalidate every token they hold"""
+    get_user_model().objects.filter(pk__in=user_ids).update(is_active=False)
+    Token.objects.filter(user_id__in=user_ids).delete()
+    # signed tokens are not looked up, they have to be revoked
+    for user_id in user_ids:
+        tokens.revoke_user(user_id)
+
+
+def _unlink_from_others(model, through, attr_ids, chunk_size=CHUNK_SIZE):
+    """Delete the links of other users' recipes to tags/ingredients about to be deleted
+    The API never links another user's tags, the admin or a shell may have"""
+    links = through.objects.filter(**{f'{model._meta.model_name}_id__in': attr_ids})
+    recipes = defaultdict(set)
+    for recipe_id, user_id in links.values_list('recipe_id', 'recipe__user_id'):
+        recipes[user_id].add(recipe_id)
+    if not recipes:
+        return
+    # recipe_count of the tags/ingredients does not matter, they are deleted next
+    _raw_delete(links)
+    for user_id, recipe_ids in recipes.items():
+        recipe_ids = sorted(recipe_ids)
+        for start in range(0, len(recipe_ids), chunk_size):
+            chunk = recipe_ids[start:start + chunk_size]
+            Recipe.objects.filter(pk__in=chunk).update(updated_at=timezone.now())
+        changes.record(user_id, changes.kind_of(Recipe), recipe_ids)
+        if model is Ingredient:
+            pantry.invalidate(user_id, recipe_ids)
+        minhash.refresh_signatures_later(recipe_ids)
+
+
+def purge_user(user, chunk_size=CHUNK_SIZE, pause=0):
+    """Delete a user and everything they own, chunk by chunk
+    Every chunk is one short transaction, so other requests wait at most one chunk;
+    pause (seconds) between chunks leaves the database to them under load."""
+    # locked out first: nothing new gets created meanwhile
+    lock_out([user.pk])
+
+    for recipe_ids in chunks(Recipe.objects.filter(user=user), chunk_size):
+        with transaction.atomic():
+            image_names = delete_recipe_rows(recipe_ids)
+            # files go in the background, once no other recipe shares them
+            for name in image_names:
+                images.release(name)
+        pantry.invalidate(user.pk, recipe_ids)
+        time.sleep(pause)
+
+    # their recipes are gone, so are all the links from them
+    for model, through in ((Tag, Recipe.tags.through), (Ingredient, Recipe.ingredients.through)):
+        for pks in chunks(model.objects.filter(user=user), chunk_size):
+            with transaction.atomic():
+                _unlink_from_others(model, through, pks, chunk_size)
+                _raw_delete(model.objects.filter(pk__in=pks))
+            time.sleep(pause)
+    for pks in chunks(Change.objects.filter(user=user), chunk_size):
+        _raw_delete(Change.objects.filter(pk__in=pks))
+        time.sleep(pause)
+
+    # what is left (admin log, groups, permissions) is small, the collector can have it
+    user.delete()
+
+
+@jobs.task('users.purge')
+def purge_user_task(user_id):
+    user = get_user_model().objects.filter(pk=user_id).first()
+    if user is not None:
+        purge_user(user)
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Change
+
+# Per-user change feed for delta sync.
+# Every write bumps User.change_seq and stores (seq, kind, object_id, deleted) in Change.
+# Only the latest entry per object is kept, so reading the feed since a sequence number
+# costs as much as the number of objects changed since, never the size of the recipe box.
+# The UPDATE of the user row also serializes concurrent writers of one user, so
+# sequence numbers become visible in increasing order.
+
+
+def record(user_id, kind, object_ids, deleted=False):
+    """Append the given objects of a user to the change feed"""
+    object_ids = list(dict.fromkeys(object_ids))
+    if not object_ids:
+        return
+    users = get_user_model().objects.filter(pk=user_id)
+    with transaction.atomic():
+        if not users.update(change_seq=F('change_seq') + len(object_ids)):
+            # the user itself is gone
+            return
+        last_seq = users.values_list('change_seq', flat=True).get()
+        entries = Change.objects.filter(user_id=user_id, kind=kind)
+        # bulk writes record many objects at once, stay below SQLite's parameter limit
+        for start in range(0, len(object_ids), 500):
+            entries.filter(object_id__in=object_ids[start:start + 500]).delete()
+        first_seq = last_seq - len(object_ids) + 1
+        Change.objects.bulk_create(
+            Change(user_id=user_id, seq=first_seq + i, kind=kind, object_id=object_id, deleted=deleted)
+            for i, object_id in enumerate(object_ids)
+        )
+
+
+def kind_of(model):
+    """Change.kind of a Recipe, Tag or Ingredient model"""
+    return model._meta.model_name
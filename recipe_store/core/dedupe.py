@@ -0,0 +1,74 @@
+import hashlib
+import re
+from collections import defaultdict
+
+from django.db.models import Case, CharField, Count, Value, When
+
+from core import jobs
+from core.models import Recipe
+
+# Near-duplicate recipes: same title up to case, whitespace and punctuation, same set of
+# ingredient names. Every recipe gets a fingerprint, the hash of both normalized, so the
+# duplicates of a recipe box are the recipes sharing a fingerprint: hashing is linear in the
+# number of recipes and links, grouping is one GROUP BY on the (user, fingerprint) index.
+# The scan runs as a background job and stores the fingerprints; they are checked again
+# when the groups are listed, a recipe edited since the scan drops out of its group.
+
+_NON_WORD = re.compile(r'[\W_]+')
+# a CASE update takes 3 parameters per recipe, SQLite allows 999
+CHUNK_SIZE = 300
+
+
+def normalize_title(title):
+    """Title without case, punctuation and extra whitespace"""
+    return ' '.join(_NON_WORD.sub(' ', title.casefold()).split())
+
+
+def fingerprint(title, ingredient_names):
+    """Fingerprint of a recipe from its title and (folded) ingredient names"""
+    names = '\x1e'.join(sorted(set(ingredient_names)))
+    return hashlib.sha1(f'{normalize_title(title)}\x1f{names}'.encode()).hexdigest()
+
+
+def fingerprints(recipes):
+    """{recipe id: fingerprint} of a Recipe queryset, with two queries"""
+    titles = dict(recipes.values_list('pk', 'title'))
+    names = defaultdict(list)
+    # Ingredient.search_name is the folded name: "Salt " and "salt" are one ingredient here
+    links = Recipe.ingredients.through.objects.filter(recipe__in=recipes)
+    for recipe_id, name in links.values_list('recipe_id', 'ingredient__search_name'):
+        names[recipe_id].append(name)
+    return {pk: fingerprint(title, names[pk]) for pk, title in titles.items()}
+
+
+@jobs.task('recipes.find_duplicates')
+def find_duplicates(user_id):
+    """Store the fingerprint of every recipe of a user"""
+    recipes = Recipe.objects.filter(user_id=user_id)
+    stored = dict(recipes.values_list('pk', 'fingerprint'))
+    changed = [(pk, value) for pk, value in fingerprints(recipes).items() if stored.get(pk) != value]
+    for start in range(0, len(changed), CHUNK_SIZE):
+        chunk = changed[start:start + CHUNK_SIZE]
+        # one UPDATE per chunk; update() leaves updated_at alone, nothing changed for clients
+        Recipe.objects.filter(pk__in=[pk for pk, _ in chunk]).update(fingerprint=Case(
+            *[When(pk=pk, then=Value(value)) for pk, value in chunk], output_field=CharField()
+        ))
+
+
+def duplicate_groups(user_id):
+    """Lists of ids of a user's recipes that are duplicates of each other, oldest first"""
+    recipes = Recipe.objects.filter(user_id=user_id).exclude(fingerprint='')
+    shared = recipes.values('fingerprint').annotate(count=Count('pk')).filter(count__gt=1)
+    candidates = list(
+        recipes.filter(fingerprint__in=shared.values('fingerprint')).values_list('pk', 'fingerprint')
+    )
+    # recipes edited since the scan: their fingerprint as of now
+    current = {}
+    for start in range(0, len(candidates), 500):
+        chunk = [pk for pk, _ in candidates[start:start + 500]]
+        current.update(fingerprints(Recipe.objects.filter(pk__in=chunk)))
+    groups = defaultdict(list)
+    for pk, value in sorted(candidates):
+        if current.get(pk) == value:
+            groups[value].append(pk)
+    return [ids for ids in groups.values() if len(ids) > 1]
@@ -0,0 +1,33 @@
+import os
+import time
+
+from core import jobs
+from core.models import Recipe
+
+# Recipe images are shared between recipes (see core.storage), a file is
+# referenced by every Recipe.image holding its name and deleted with the last one.
+# An upload of the same bytes only touches the existing file (see ContentAddressedStorage._save),
+# and its recipe may not be committed yet when the delete job looks for references: a file
+# touched after it was released is left to gc_images, which waits out a grace period.
+
+
+def release(name):
+    """Delete the image file in the background once no recipe refers to it any more"""
+    if name:
+        # the job is part of the caller's transaction: a rolled back change still has its file
+        jobs.enqueue('images.delete_unreferenced', priority=-10, name=name, released_at=time.time())
+
+
+@jobs.task('images.delete_unreferenced')
+def delete_unreferenced(name, released_at=None):
+    storage = Recipe._meta.get_field('image').storage
+    if released_at is not None:
+        try:
+            if os.path.getmtime(storage.path(name)) > released_at:
+                # saved again since, by an upload that may still be committing
+                return
+        except FileNotFoundError:
+            return
+    # Recipe.image is indexed, this is an index lookup
+    if not Recipe.objects.filter(image=name).exists():
+        storage.delete(name)
@@ -0,0 +1,117 @@
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs kept in the database, no broker needed.
+# enqueue() inserts a Job row in the caller's transaction, so the job exists exactly when the
+# change that asked for it was committed. Workers (manage.py run_worker, as many processes as
+# wanted) claim a job with a conditional UPDATE - only one of them can flip it to running - and
+# hold it for a lease. A worker that dies loses the lease and the job is claimed again, so
+# tasks run at least once and must be idempotent. Failed attempts are retried with exponential
+# backoff, the job is kept as failed after max_attempts. Finished jobs are deleted.
+
+_tasks = {}
+
+
+def task(name):
+    """Register the decorated function as the task called `name`"""
+    def register(func):
+        _tasks[name] = func
+        return func
+    return register
+
+
+def enqueue(task_name, priority=0, delay=0, max_attempts=5, **payload):
+    """Queue a call of a registered task with the given keyword arguments"""
+    if task_name not in _tasks:
+        raise ValueError(f'Unknown task {task_name}')
+    return Job.objects.create(
+        task=task_name,
+        payload=json.dumps(payload, cls=DjangoJSONEncoder),
+        priority=priority,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt"""
+    return min(settings.JOBS_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX_DELAY)
+
+
+def claim(worker_id, lease=None):
+    """Take the next ready job for this worker, or return None"""
+    lease = lease or settings.JOBS_LEASE_SECONDS
+    now = timezone.now()
+    ready = (
+        Q(status=Job.STATUS_QUEUED, run_at__lte=now)
+        # the worker holding it is gone, or stuck past its lease
+        | Q(status=Job.STATUS_RUNNING, locked_until__lt=now)
+    )
+    candidates = Job.objects.filter(ready).order_by('-priority', 'run_at', 'pk')
+    # a few candidates, in case other workers win the first ones
+    for job in candidates[:10]:
+        claimed = Job.objects.filter(
+            ready, pk=job.pk, status=job.status, attempts=job.attempts
+        ).update(
+            status=Job.STATUS_RUNNING,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=lease),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run(job):
+    """Run a claimed job, then delete it or schedule its retry. Returns True on success"""
+    # only the lease holder may settle the job, a worker that lost it leaves it alone
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status=Job.STATUS_RUNNING)
+    try:
+        if job.attempts > job.max_attempts:
+            # leases expired over and over, the task keeps killing its worker
+            raise RuntimeError('Lease expired too many times')
+        func = _tasks.get(job.task)
+        if func is None:
+            raise LookupError(f'Unknown task {job.task}')
+        func(**json.loads(job.payload))
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Job %s failed for good:\n%s', job, error)
+            mine.update(status=Job.STATUS_FAILED, locked_until=None, last_error=error)
+        else:
+            logger.warning('Job %s failed, retrying:\n%s', job, error)
+            mine.update(
+                status=Job.STATUS_QUEUED,
+                locked_until=None,
+                run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+                last_error=error,
+            )
+        return False
+    mine.delete()
+    return True
+
+
+def run_pending(worker_id='inline', max_jobs=None):
+    """Run ready jobs until the queue is drained, returns the number of jobs run"""
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = claim(worker_id)
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
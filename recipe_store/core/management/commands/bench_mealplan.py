@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core import mealplan
+from core.pantry import popcount_rows
+
+
+class Command(BaseCommand):
+    """Django command timing the meal plan search on a synthetic recipe box
+    Runs on arrays in memory, the database is not touched"""
+    help = 'Benchmark the meal plan branch and bound against the greedy plan it starts from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--count', type=int, default=7)
+        parser.add_argument('--budget', type=float, default=70, help='Total price')
+        parser.add_argument('--max-time', type=int, default=300, help='Total minutes')
+        parser.add_argument(
+            '--time-limits', default='50,200,1000', help='Comma separated search time limits, in ms'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.RandomState(options['seed'])
+        n = options['recipes']
+        price = rng.randint(200, 3000, n).astype(np.int64)
+        minutes = rng.randint(5, 180, n).astype(np.int64)
+        # 0 to 5 tags a recipe, the popular ones more often
+        tags_per_recipe = rng.randint(0, 6, n)
+        rows = np.repeat(np.arange(n), tags_per_recipe)
+        columns = (rng.zipf(1.5, len(rows)) - 1) % options['tags']
+        bits = mealplan._tag_bits(rows, columns, n)
+        preference = rng.randint(0, 4, n).astype(np.int64)
+        budget = int(round(options['budget'] * 100))
+        count, max_time = options['count'], options['max_time']
+
+        tag_counts = popcount_rows(bits)
+
+        for name, objective_bits in (('diversity', bits), ('preference', None)):
+            weight = tag_counts if objective_bits is not None else preference
+            greedy = mealplan._greedy(price, minutes, weight, objective_bits, count, budget, max_time)
+            if greedy is None:
+                greedy_score = None
+            elif objective_bits is not None:
+                greedy_score = int(popcount_rows(np.bitwise_or.reduce(bits[greedy])[None, :])[0])
+            else:
+                greedy_score = int(preference[greedy].sum())
+            self.stdout.write(f'{name}: {n} recipes, pick {count}, greedy score {greedy_score}')
+            for limit in options['time_limits'].split(','):
+                start = time.perf_counter()
+                rows, score, optimal = mealplan.solve(
+                    price, minutes, preference, objective_bits, count, budget, max_time, int(limit) / 1000
+                )
+                elapsed = (time.perf_counter() - start) * 1000
+                self.stdout.write(
+                    f'  limit {limit} ms: score {score}, {"optimal" if optimal else "best so far"}, '
+                    f'{elapsed:.0f} ms, price {price[rows].sum() / 100:.2f}, {minutes[rows].sum()} min'
+                )
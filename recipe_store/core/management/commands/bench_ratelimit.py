@@ -0,0 +1,49 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from core import ratelimit
+
+
+class Command(BaseCommand):
+    """Django command measuring what the rate limiter adds to a request
+    Runs the bucket updates alone, no request is made"""
+    help = 'Benchmark the token bucket rate limiter, per check and with concurrent threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=100000, help='Checks per thread')
+        parser.add_argument('--clients', type=int, default=10000)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--backend', choices=('local', 'cache'), default='local')
+
+    def _run(self, checks, clients, offset):
+        take = ratelimit.backend().take
+        for i in range(checks):
+            take(f'recipe_app:recipe-list|user:{(i + offset) % clients}', 20, 100)
+
+    def handle(self, *args, **options):
+        checks, clients, threads = options['checks'], options['clients'], options['threads']
+        with override_settings(RATELIMIT_BACKEND=options['backend']):
+            ratelimit.reset()
+            start = time.perf_counter()
+            self._run(checks, clients, 0)
+            single = time.perf_counter() - start
+
+            workers = [
+                threading.Thread(target=self._run, args=(checks, clients, n * 7919)) for n in range(threads)
+            ]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            concurrent = time.perf_counter() - start
+            ratelimit.reset()
+
+        self.stdout.write(f'{options["backend"]} backend, {clients} clients')
+        self.stdout.write(f'1 thread: {single / checks * 1e6:.2f} us per check')
+        self.stdout.write(
+            f'{threads} threads: {concurrent / (checks * threads) * 1e6:.2f} us per check (wall clock)'
+        )
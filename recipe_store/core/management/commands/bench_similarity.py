@@ -0,0 +1,85 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core import minhash
+
+
+class Command(BaseCommand):
+    """Django command comparing MinHash/LSH lookups with exact brute-force Jaccard
+    Runs on synthetic token sets in memory, the database is not touched"""
+    help = 'Benchmark the similar recipes index against brute-force Jaccard similarity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--vocabulary', type=int, default=5000)
+        parser.add_argument('--set-size', type=int, default=12)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _token_sets(self, rng, count, vocabulary, set_size):
+        """Families of recipes derived from a shared base, so similar sets actually exist"""
+        bases = [rng.choice(vocabulary, set_size, replace=False) for _ in range(max(count // 20, 1))]
+        token_sets = []
+        for i in range(count):
+            tokens = set(bases[i % len(bases)].tolist())
+            # swap a few ingredients to make near (not exact) duplicates
+            for _ in range(rng.randint(0, set_size // 2)):
+                tokens.discard(rng.randint(vocabulary))
+                tokens.add(int(rng.randint(vocabulary)))
+            token_sets.append(sorted(tokens))
+        return token_sets
+
+    def handle(self, *args, **options):
+        rng = np.random.RandomState(options['seed'])
+        top = options['top']
+        token_sets = self._token_sets(rng, options['recipes'], options['vocabulary'], options['set_size'])
+        queries = rng.choice(len(token_sets), min(options['queries'], len(token_sets)), replace=False)
+
+        start = time.perf_counter()
+        sigs = minhash.signatures(token_sets)
+        buckets = minhash.band_buckets(sigs)
+        index = defaultdict(list)
+        for row, recipe_buckets in enumerate(buckets.tolist()):
+            for band, bucket in enumerate(recipe_buckets):
+                index[(band, bucket)].append(row)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        lsh_results = []
+        candidates_seen = 0
+        for query in queries:
+            candidates = set()
+            for band, bucket in enumerate(buckets[query].tolist()):
+                candidates.update(index[(band, bucket)])
+            candidates.discard(query)
+            candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            candidates_seen += len(candidates)
+            scores = minhash.estimate_similarity(sigs[query], sigs[candidates])
+            lsh_results.append(set(candidates[np.argsort(-scores, kind='stable')[:top]].tolist()))
+        lsh_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sets = [set(tokens) for tokens in token_sets]
+        exact_results = []
+        for query in queries:
+            query_set = sets[query]
+            scores = [
+                len(query_set & other) / len(query_set | other) if row != query else -1.0
+                for row, other in enumerate(sets)
+            ]
+            exact_results.append(set(np.argsort(-np.array(scores), kind='stable')[:top].tolist()))
+        exact_time = time.perf_counter() - start
+
+        recall = np.mean([len(lsh & exact) / top for lsh, exact in zip(lsh_results, exact_results)])
+        self.stdout.write(f'recipes: {len(token_sets)}, queries: {len(queries)}, top: {top}')
+        self.stdout.write(f'signatures + LSH index build: {build_time * 1000:.1f} ms')
+        self.stdout.write(
+            f'LSH lookups: {lsh_time / len(queries) * 1000:.3f} ms/query, '
+            f'{candidates_seen / len(queries):.0f} candidates/query'
+        )
+        self.stdout.write(f'brute-force Jaccard: {exact_time / len(queries) * 1000:.3f} ms/query')
+        self.stdout.write(f'recall@{top} vs brute force: {recall:.3f}')
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user.hashers import ScryptPasswordHasher, TunedPBKDF2PasswordHasher
+
+PASSWORD = 'calibration password'
+SALT = 'calibrationsalt'
+
+
+def hash_ms(algorithm, cost, rounds=3):
+    """Best of rounds milliseconds to hash one password at the given cost"""
+    if algorithm == 'pbkdf2':
+        hasher = TunedPBKDF2PasswordHasher()
+
+        def make():
+            return hasher.encode(PASSWORD, SALT, iterations=cost)
+    else:
+        hasher = ScryptPasswordHasher()
+
+        def make():
+            return hasher.encode(PASSWORD, SALT, n=cost)
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        make()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    """Django command to find the password hashing cost that takes a target time on this machine"""
+    help = 'Double the hasher cost until one hash takes --target-ms, print the settings to use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=('pbkdf2', 'scrypt'), default='pbkdf2')
+        parser.add_argument('--target-ms', type=float, default=100)
+
+    def handle(self, *args, **options):
+        algorithm, target = options['algorithm'], options['target_ms']
+        # pbkdf2: iterations, scrypt: n - a power of two
+        cost = 10000 if algorithm == 'pbkdf2' else 2 ** 10
+        elapsed = hash_ms(algorithm, cost)
+        while elapsed < target:
+            cost *= 2
+            elapsed = hash_ms(algorithm, cost)
+        if algorithm == 'pbkdf2':
+            # iterations need not be a power of two: scale to the target
+            cost = max(int(cost * target / elapsed), 1)
+            elapsed = hash_ms(algorithm, cost)
+            self.stdout.write(f"PASSWORD_HASHER = 'pbkdf2'\nPASSWORD_PBKDF2_ITERATIONS = {cost}")
+        else:
+            self.stdout.write(f"PASSWORD_HASHER = 'scrypt'\nPASSWORD_SCRYPT_N = 2 ** {cost.bit_length() - 1}")
+        self.stdout.write(f'# {elapsed:.1f} ms per hash')
@@ -0,0 +1,82 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+
+IMAGES_DIR = 'uploads/images'
+
+
+def iter_files(root):
+    """Yield a DirEntry for every file below root, one directory listing at a time"""
+    directories = [root]
+    while directories:
+        try:
+            entries = os.scandir(directories.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+class Command(BaseCommand):
+    """Django command to delete recipe image files no recipe refers to any more"""
+    help = 'Delete unreferenced files under MEDIA_ROOT/uploads/images older than the grace period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Keep files modified more recently than this, they may belong to an upload in progress',
+        )
+        # stays below the 999 query parameters SQLite allows
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted')
+
+    def handle(self, *args, **options):
+        self.storage = Recipe._meta.get_field('image').storage
+        self.dry_run = options['dry_run']
+        cutoff = time.time() - options['grace_hours'] * 3600
+        self.scanned = self.deleted = self.reclaimed = 0
+
+        # the directory tree and the referenced names are both walked in batches,
+        # memory stays bounded by --batch-size whatever the number of files
+        batch = []
+        for entry in iter_files(self.storage.path(IMAGES_DIR)):
+            self.scanned += 1
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime >= cutoff:
+                continue
+            name = os.path.relpath(entry.path, self.storage.location).replace(os.sep, '/')
+            batch.append((name, stat.st_size))
+            if len(batch) >= options['batch_size']:
+                self._collect(batch)
+                batch = []
+        if batch:
+            self._collect(batch)
+
+        action = 'Would delete' if self.dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {self.scanned} files. {action} {self.deleted} unreferenced files, '
+            f'{self.reclaimed} bytes reclaimed'
+        ))
+
+    def _collect(self, batch):
+        """Delete the files of the batch that no Recipe.image refers to"""
+        # Recipe.image is indexed: one index lookup per name
+        referenced = set(
+            Recipe.objects.filter(image__in=[name for name, _ in batch]).values_list('image', flat=True)
+        )
+        for name, size in batch:
+            if name in referenced:
+                continue
+            if self.dry_run:
+                self.stdout.write(f'Would delete {name}')
+            else:
+                self.storage.delete(name)
+            self.deleted += 1
+            self.reclaimed += size
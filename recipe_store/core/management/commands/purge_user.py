@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk, jobs
+
+
+class Command(BaseCommand):
+    """Django command deleting users and all their data with chunked set-based deletes"""
+    help = 'Delete users (by email or id) with their recipes, tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='+', help='Email addresses or ids')
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between chunks')
+        parser.add_argument('--background', action='store_true', help='Queue the purge for run_worker')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = []
+        for identifier in options['users']:
+            lookup = {'pk': identifier} if identifier.isdigit() else {'email': identifier}
+            user = User.objects.filter(**lookup).first()
+            if user is None:
+                raise CommandError(f'No user {identifier}')
+            users.append(user)
+
+        for user in users:
+            if options['background']:
+                bulk.lock_out([user.pk])
+                jobs.enqueue('users.purge', user_id=user.pk)
+                self.stdout.write(f'Queued purge of {user.email}')
+            else:
+                bulk.purge_user(user, chunk_size=options['chunk_size'], pause=options['pause'])
+                self.stdout.write(self.style.SUCCESS(f'Purged {user.email}'))
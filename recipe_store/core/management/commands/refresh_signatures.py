@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core import minhash
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Django command to (re)build the MinHash signatures used by the similar recipes endpoint"""
+    help = 'Recompute MinHash signatures and LSH bands for all recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipe_ids = Recipe.objects.order_by('pk').values_list('pk', flat=True)
+        total = 0
+        last_pk = 0
+        while True:
+            # keyset batches, ids are not all loaded at once
+            batch = list(recipe_ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            minhash.refresh_signatures(batch)
+            total += len(batch)
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f'Refreshed signatures for {total} recipes'))
@@ -0,0 +1,57 @@
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    """Django command running background jobs from the core.Job queue
+    Start as many as needed, each process claims its own jobs"""
+    help = 'Run queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}')
+        parser.add_argument(
+            '--lease', type=int, default=settings.JOBS_LEASE_SECONDS,
+            help='Seconds a claimed job is held before another worker may take it over',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0, help='Seconds to sleep on an empty queue'
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id']
+        self.stopping = False
+        # finish the job at hand on SIGTERM/SIGINT, then exit
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.stdout.write(f'Worker {worker_id} started')
+
+        done = failed = 0
+        while not self.stopping and (options['max_jobs'] is None or done + failed < options['max_jobs']):
+            # long running process: drop connections the database closed meanwhile
+            close_old_connections()
+            job = jobs.claim(worker_id, lease=options['lease'])
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            if jobs.run(job):
+                done += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Worker {worker_id} stopped: {done} jobs done, {failed} failed'
+        ))
+
+    def stop(self, signum, frame):
+        self.stopping = True
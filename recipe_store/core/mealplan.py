@@ -0,0 +1,224 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from core.models import Recipe
+from core.pantry import popcount_rows
+
+# Meal plans: pick `count` recipes of a user's box with a total price within budget and a total
+# time within max_time, maximizing either
+#  - tag diversity: the number of distinct tags the picked recipes cover, or
+#  - preference: the number of preferred tags each picked recipe has, summed up.
+# That is a knapsack with two capacities and a cardinality constraint, solved by branch and
+# bound: a depth first search over the candidates, best first, which drops a branch as soon
+# as its optimistic bound cannot beat the best plan found so far, or it cannot fit.
+#  - the bound of a branch is its score plus the k best remaining weights (a recipe's tag count
+#    for diversity, its preference score otherwise), a prefix sum difference since the
+#    candidates are sorted by weight
+#  - a branch cannot fit when k times the cheapest remaining price (or time) is over what is left
+# The search starts from a greedy plan and stops at the time limit, returning the best plan
+# so far: optimal is True only when the search ran to the end.
+
+Plan = namedtuple('Plan', 'recipe_ids score price_cents minutes optimal')
+
+# candidates looked at between two clock checks
+CLOCK_EVERY = 1024
+# rows whose greedy gain is computed at once
+GREEDY_BLOCK = 4096
+
+
+class _Deadline(Exception):
+    pass
+
+
+def _smallest_sum(values, k):
+    """Sum of the k smallest values, without sorting them all"""
+    if k <= 0:
+        return 0
+    return int(np.partition(values, k - 1)[:k].sum())
+
+
+def _greedy(price, minutes, weight, bits, count, budget, max_time):
+    """Rows of a plan built by adding the best scoring recipe that still fits, or None
+    weight: an upper bound of the gain of each row (its tag count for diversity)"""
+    chosen = []
+    available = np.ones(len(price), dtype=bool)
+    covered = np.zeros(bits.shape[1], dtype=np.uint64) if bits is not None else None
+    spent_price = spent_minutes = 0
+    # cheaper and quicker first among equal gains: a fraction below 1
+    cost = price / (2.0 * max(budget, 1)) + minutes / (2.0 * max(max_time, 1))
+    # gains are computed block by block in this order, until no row left can beat the best
+    by_weight = np.argsort(-weight, kind='stable')
+    for k in range(count, 0, -1):
+        # the k - 1 recipes left to pick cost at least the k - 1 smallest values
+        rest_price = _smallest_sum(price[available], k - 1)
+        rest_minutes = _smallest_sum(minutes[available], k - 1)
+        fits = (
+            available
+            & (spent_price + price + rest_price <= budget)
+            & (spent_minutes + minutes + rest_minutes <= max_time)
+        )
+        row, best = None, -np.inf
+        for start in range(0, len(by_weight), GREEDY_BLOCK):
+            block = by_weight[start:start + GREEDY_BLOCK]
+            if weight[block[0]] <= best:
+                break
+            block = block[fits[block]]
+            if not len(block):
+                continue
+            gain = popcount_rows(bits[block] & ~covered) if bits is not None else weight[block]
+            keys = gain - cost[block]
+            i = int(np.argmax(keys))
+            if keys[i] > best:
+                row, best = int(block[i]), keys[i]
+        if row is None:
+            return None
+        chosen.append(row)
+        available[row] = False
+        spent_price += int(price[row])
+        spent_minutes += int(minutes[row])
+        if bits is not None:
+            covered |= bits[row]
+    return chosen
+
+
+def solve(price, minutes, weight, bits, count, budget, max_time, time_limit):
+    """Best `count` rows within budget and max_time, as (rows, score, optimal)
+    price, minutes, weight: int arrays; bits: packed uint64 tag bits per row to maximize the
+    tags covered (weight is not used then), None to maximize the sum of weight. time_limit in seconds"""
+    deadline = time.perf_counter() + time_limit
+    n = len(price)
+    if count <= 0 or n < count:
+        return [], 0, True
+
+    # recipes that cannot be part of any plan, even with the cheapest and quickest others
+    keep = np.flatnonzero(
+        (price + (count - 1) * price.min() <= budget) & (minutes + (count - 1) * minutes.min() <= max_time)
+    )
+    if len(keep) < count:
+        return [], 0, True
+    price, minutes = price[keep], minutes[keep]
+    if bits is not None:
+        bits = bits[keep]
+        # the most a recipe can add to the diversity: its tag count
+        weight = popcount_rows(bits)
+    else:
+        weight = weight[keep]
+
+    best_rows, best_score = [], -1
+    greedy = _greedy(price, minutes, weight, bits, count, budget, max_time)
+    if greedy is not None:
+        best_rows = greedy
+        if bits is not None:
+            best_score = int(popcount_rows(np.bitwise_or.reduce(bits[greedy])[None, :])[0])
+        else:
+            best_score = int(weight[greedy].sum())
+
+    # best first, then cheapest: the search meets good plans early and the bound cuts early
+    order = np.lexsort((price / max(budget, 1) + minutes / max(max_time, 1), -weight))
+    price_s, minutes_s, weight_s = price[order], minutes[order], weight[order]
+    prefix = np.concatenate(([0], np.cumsum(weight_s))).tolist()
+    # cheapest price / time among the candidates from position j on
+    min_price = np.concatenate((np.minimum.accumulate(price_s[::-1])[::-1], [np.iinfo(np.int64).max]))
+    min_minutes = np.concatenate((np.minimum.accumulate(minutes_s[::-1])[::-1], [np.iinfo(np.int64).max]))
+    # plain Python values: indexing numpy scalars one by one is slower than the search itself
+    price_l, minutes_l, weight_l = price_s.tolist(), minutes_s.tolist(), weight_s.tolist()
+    min_price_l, min_minutes_l = min_price.tolist(), min_minutes.tolist()
+    if bits is not None:
+        bits_s = bits[order]
+        # tag bits as Python ints, converted when the search first gets to a candidate
+        masks = [None] * len(bits_s)
+        all_tags = int(popcount_rows(np.bitwise_or.reduce(bits, axis=0)[None, :])[0])
+    else:
+        masks, all_tags = None, None
+
+    nodes = 0
+    path = []
+
+    def search(start, k, spent_price, spent_minutes, mask, score):
+        nonlocal best_rows, best_score, nodes
+        if k == 0:
+            if score > best_score:
+                best_score, best_rows = score, [int(order[j]) for j in path]
+            return
+        for j in range(start, len(price_l) - k + 1):
+            # counted per candidate, not per node: most candidates may be skipped without a node
+            nodes += 1
+            if nodes % CLOCK_EVERY == 0 and time.perf_counter() > deadline:
+                raise _Deadline
+            bound = score + prefix[j + k] - prefix[j]
+            if all_tags is not None:
+                bound = min(bound, all_tags)
+            # weights only go down from here, and so do the bounds
+            if bound <= best_score:
+                break
+            # the cheapest candidates from j on only get more expensive
+            if spent_price + k * min_price_l[j] > budget or spent_minutes + k * min_minutes_l[j] > max_time:
+                break
+            new_price, new_minutes = spent_price + price_l[j], spent_minutes + minutes_l[j]
+            if (new_price + (k - 1) * min_price_l[j + 1] > budget
+                    or new_minutes + (k - 1) * min_minutes_l[j + 1] > max_time):
+                continue
+            path.append(j)
+            if masks is not None:
+                if masks[j] is None:
+                    masks[j] = int.from_bytes(bits_s[j].tobytes(), 'little')
+                new_mask = mask | masks[j]
+                search(j + 1, k - 1, new_price, new_minutes, new_mask, bin(new_mask).count('1'))
+            else:
+                search(j + 1, k - 1, new_price, new_minutes, 0, score + weight_l[j])
+            path.pop()
+
+    try:
+        search(0, count, 0, 0, 0, 0)
+        optimal = True
+    except _Deadline:
+        optimal = False
+    return [int(keep[row]) for row in best_rows], max(best_score, 0), optimal
+
+
+def _tag_bits(rows, columns, n):
+    """Packed (n, words) uint64 bit matrix with the bits (rows, columns) set"""
+    words = max((int(columns.max()) // 64 + 1) if len(columns) else 1, 1)
+    bits = np.zeros((n, words), dtype=np.uint64)
+    np.bitwise_or.at(
+        bits, (rows, columns // 64), np.left_shift(np.uint64(1), (columns % 64).astype(np.uint64))
+    )
+    return bits
+
+
+def plan(user_id, count, budget, max_time, prefer=None, time_limit=0.2):
+    """Best meal plan of a user's recipes, budget in currency units
+    prefer: tag ids to maximize, None for tag diversity"""
+    rows = list(
+        Recipe.objects.filter(user_id=user_id).order_by('pk').values_list('pk', 'price', 'time_minutes')
+    )
+    if not rows:
+        return Plan([], 0, 0, 0, True)
+    recipe_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    # whole cents: the sums are exact
+    price = np.fromiter((int(round(row[1] * 100)) for row in rows), dtype=np.int64, count=len(rows))
+    minutes = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+
+    links = Recipe.tags.through.objects.filter(recipe__user_id=user_id)
+    if prefer is not None:
+        links = links.filter(tag_id__in=prefer)
+    pairs = np.array(list(links.values_list('recipe_id', 'tag_id')), dtype=np.int64).reshape(-1, 2)
+    # recipe ids are sorted: row of each link by binary search
+    link_rows = np.searchsorted(recipe_ids, pairs[:, 0])
+    if prefer is None:
+        # tag id -> bit position
+        _, columns = np.unique(pairs[:, 1], return_inverse=True)
+        bits, weight = _tag_bits(link_rows, columns, len(rows)), None
+    else:
+        bits = None
+        weight = np.bincount(link_rows, minlength=len(rows)).astype(np.int64)
+
+    chosen, score, optimal = solve(
+        price, minutes, weight, bits, count, int(round(budget * 100)), max_time, time_limit
+    )
+    return Plan(
+        [int(recipe_ids[row]) for row in chosen], score,
+        int(price[chosen].sum()), int(minutes[chosen].sum()), optimal,
+    )
@@ -0,0 +1,91 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics: counters, gauges and latency histograms, exposed in the Prometheus
+# text format by /metrics/ (core.views.metrics). Each worker process reports its own values,
+# the scraper (or the dashboard) sums them up.
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+# name -> [count per bucket (+Inf last), sum, count]
+_histograms = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        buckets = histogram[0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+@contextmanager
+def timer(name):
+    """Observe the duration of the with block in the histogram name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def snapshot():
+    """Copy of all values: {'counters': {...}, 'gauges': {...}, 'histograms': {...}}"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'histograms': {
+                name: {'buckets': list(buckets), 'sum': total, 'count': count}
+                for name, (buckets, total, count) in _histograms.items()
+            },
+        }
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    values = snapshot()
+    lines = []
+    for name, value in sorted(values['counters'].items()):
+        lines += [f'# TYPE {name} counter', f'{name} {value}']
+    for name, value in sorted(values['gauges'].items()):
+        lines += [f'# TYPE {name} gauge', f'{name} {value}']
+    for name, histogram in sorted(values['histograms'].items()):
+        lines.append(f'# TYPE {name} histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'{name}_sum {histogram["sum"]}', f'{name}_count {histogram["count"]}']
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget every value - for tests"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -0,0 +1,37 @@
+import threading
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from core import metrics
+
+
+class InFlightLimitMiddleware:
+    """Answer 503 at once when this worker already handles MAX_IN_FLIGHT_REQUESTS requests
+    Queued requests would only time out behind the busy ones, a fast refusal lets the load
+    balancer or the client go elsewhere or retry. Comes first in MIDDLEWARE."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+    def __call__(self, request):
+        with self.lock:
+            if self.in_flight >= settings.MAX_IN_FLIGHT_REQUESTS:
+                shed = True
+            else:
+                shed = False
+                self.in_flight += 1
+                metrics.set_gauge('requests_in_flight', self.in_flight)
+        if shed:
+            metrics.incr('requests_shed_total')
+            response = JsonResponse({'detail': 'Server busy, retry shortly.'}, status=503)
+            response['Retry-After'] = '1'
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                metrics.set_gauge('requests_in_flight', self.in_flight)
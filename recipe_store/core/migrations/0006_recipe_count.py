@@ -0,0 +1,45 @@
+# Generated by Django 2.1.15 on 2026-10-19 15:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_recipe_counts(apps, schema_editor):
+    """Populate recipe_count for tags and ingredients created before the counters existed"""
+    Recipe = apps.get_model('core', 'Recipe')
+    for field_name, model_name in (('tags', 'Tag'), ('ingredients', 'Ingredient')):
+        through = getattr(Recipe, field_name).through
+        target = model_name.lower()
+        model = apps.get_model('core', model_name)
+        counts = through.objects.values(f'{target}_id').annotate(total=Count('recipe_id'))
+        for row in counts.iterator():
+            model.objects.filter(pk=row[f'{target}_id']).update(recipe_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', '-recipe_count'], name='core_ingr_user_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', '-recipe_count'], name='core_tag_user_count_idx'),
+        ),
+        migrations.RunPython(backfill_recipe_counts, migrations.RunPython.noop),
+    ]
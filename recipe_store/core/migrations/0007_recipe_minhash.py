@@ -0,0 +1,42 @@
+# Generated by Django 2.1.15 on 2026-10-19 15:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipe_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeBand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='minhash',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='recipeband',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='core.Recipe'),
+        ),
+        migrations.AddField(
+            model_name='recipeband',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='recipeband',
+            index=models.Index(fields=['user', 'band', 'bucket'], name='core_recipeband_lookup_idx'),
+        ),
+    ]
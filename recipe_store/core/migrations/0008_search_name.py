@@ -0,0 +1,42 @@
+# Generated by Django 2.1.15 on 2026-10-19 15:56
+
+from django.db import migrations, models
+
+import core.models
+
+
+def backfill_search_name(apps, schema_editor):
+    """Fill search_name for tags and ingredients saved before the column existed"""
+    for model_name in ('Tag', 'Ingredient'):
+        model = apps.get_model('core', model_name)
+        for obj in model.objects.only('pk', 'name').iterator():
+            model.objects.filter(pk=obj.pk).update(search_name=core.models.fold_name(obj.name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_minhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'search_name'], name='core_ingr_user_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'search_name'], name='core_tag_user_search_idx'),
+        ),
+        migrations.RunPython(backfill_search_name, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.1.15 on 2026-10-19 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_token_revocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'fingerprint'], name='core_recipe_user_fp_idx'),
+        ),
+    ]
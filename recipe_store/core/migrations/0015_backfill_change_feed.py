@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def backfill_change_feed(apps, schema_editor):
+    """Give every recipe, tag and ingredient saved before the change feed existed an entry,
+    so that a client syncing from since=0 gets the whole recipe box"""
+    User = apps.get_model('core', 'User')
+    Change = apps.get_model('core', 'Change')
+    # tags and ingredients first: the recipes of the feed refer to them
+    kinds = (('tag', 'Tag'), ('ingredient', 'Ingredient'), ('recipe', 'Recipe'))
+    for user_id, seq in User.objects.order_by('pk').values_list('pk', 'change_seq').iterator():
+        first_seq = seq
+        entries = []
+        for kind, model_name in kinds:
+            model = apps.get_model('core', model_name)
+            recorded = Change.objects.filter(user_id=user_id, kind=kind).values('object_id')
+            missing = model.objects.filter(user_id=user_id).exclude(pk__in=recorded).order_by('pk')
+            for object_id in missing.values_list('pk', flat=True).iterator():
+                seq += 1
+                entries.append(Change(user_id=user_id, seq=seq, kind=kind, object_id=object_id))
+                if len(entries) == 500:
+                    Change.objects.bulk_create(entries)
+                    entries = []
+        Change.objects.bulk_create(entries)
+        if seq != first_seq:
+            User.objects.filter(pk=user_id).update(change_seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_change_feed, migrations.RunPython.noop),
+    ]
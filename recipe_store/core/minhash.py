@@ -0,0 +1,141 @@
+import itertools
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from core import jobs
+from core.models import Recipe, RecipeBand
+
+# MinHash signatures over the set of ingredient and tag ids of a recipe
+# Jaccard(A, B) ~= fraction of signature positions where A and B agree
+# LSH banding: the signature is cut into BANDS bands of ROWS values, recipes sharing
+# any (band, bucket) pair become candidates - only those are compared, not the whole box
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+# universal hashing (a * x + b) mod p, p = 2**31 - 1 keeps a * x inside uint64
+_PRIME = (1 << 31) - 1
+# token sets hashed per numpy batch, bounds the (tokens x NUM_PERM) hash matrix
+_BATCH_SIZE = 2048
+
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+# odd multipliers to mix the ROWS values of a band into one bucket id
+_BAND_MULT = (_rng.randint(1, _PRIME, size=ROWS).astype(np.uint64) << np.uint64(32)) | np.uint64(1)
+
+
+def recipe_tokens(ingredient_ids, tag_ids):
+    """Map ingredient and tag ids into one token space (even: ingredient, odd: tag)"""
+    return [i * 2 for i in ingredient_ids] + [t * 2 + 1 for t in tag_ids]
+
+
+def signatures(token_sets):
+    """Return a (len(token_sets), NUM_PERM) uint32 array of MinHash signatures
+    Empty sets get a signature of all _PRIME, which never lands in a band bucket"""
+    sigs = np.full((len(token_sets), NUM_PERM), _PRIME, dtype=np.uint32)
+    for start in range(0, len(token_sets), _BATCH_SIZE):
+        batch = token_sets[start:start + _BATCH_SIZE]
+        sizes = np.fromiter((len(tokens) for tokens in batch), dtype=np.int64, count=len(batch))
+        nonempty = np.flatnonzero(sizes)
+        if not len(nonempty):
+            continue
+        tokens = np.fromiter(itertools.chain.from_iterable(batch), dtype=np.uint64)
+        # every token hashed by every permutation at once: (total_tokens, NUM_PERM)
+        hashed = (tokens[:, None] * _A + _B) % np.uint64(_PRIME)
+        # min per token set: reduceat over the start offset of each non-empty set
+        offsets = np.concatenate(([0], np.cumsum(sizes[nonempty])[:-1]))
+        sigs[start + nonempty] = np.minimum.reduceat(hashed, offsets, axis=0)
+    return sigs
+
+
+def band_buckets(sigs):
+    """Hash each band of a (n, NUM_PERM) signature array into (n, BANDS) int64 bucket ids"""
+    bands = sigs.astype(np.uint64).reshape(len(sigs), BANDS, ROWS)
+    # uint64 arithmetic wraps around, which is what we want for a hash
+    mixed = (bands * _BAND_MULT).sum(axis=2, dtype=np.uint64)
+    # drop the top bit so the value fits a signed BigIntegerField
+    return (mixed >> np.uint64(1)).astype(np.int64)
+
+
+def estimate_similarity(sig, others):
+    """Estimated Jaccard similarity of signature sig against each row of others"""
+    return (others == sig).mean(axis=1)
+
+
+def to_bytes(sig):
+    return sig.astype('<u4').tobytes()
+
+
+def from_bytes(data):
+    return np.frombuffer(data, dtype='<u4')
+
+
+@jobs.task('minhash.refresh_signatures')
+def refresh_signatures(recipe_ids):
+    """Recompute and store the signature and LSH bands of the given recipes"""
+    recipe_ids = list(recipe_ids)
+    recipes = list(Recipe.objects.filter(pk__in=recipe_ids).values_list('pk', 'user_id'))
+    if not recipes:
+        return
+    ingredients = {pk: [] for pk, _ in recipes}
+    tags = {pk: [] for pk, _ in recipes}
+    # two queries on the through tables for the whole batch
+    through_rows = Recipe.ingredients.through.objects.filter(recipe_id__in=recipe_ids)
+    for recipe_id, ingredient_id in through_rows.values_list('recipe_id', 'ingredient_id'):
+        ingredients[recipe_id].append(ingredient_id)
+    through_rows = Recipe.tags.through.objects.filter(recipe_id__in=recipe_ids)
+    for recipe_id, tag_id in through_rows.values_list('recipe_id', 'tag_id'):
+        tags[recipe_id].append(tag_id)
+
+    token_sets = [recipe_tokens(ingredients[pk], tags[pk]) for pk, _ in recipes]
+    sigs = signatures(token_sets)
+    buckets = band_buckets(sigs)
+
+    bands = []
+    with transaction.atomic():
+        RecipeBand.objects.filter(recipe_id__in=recipe_ids).delete()
+        for row, (pk, user_id) in enumerate(recipes):
+            if not token_sets[row]:
+                # nothing to compare against, an empty recipe is similar to nothing
+                Recipe.objects.filter(pk=pk).update(minhash=None)
+                continue
+            Recipe.objects.filter(pk=pk).update(minhash=to_bytes(sigs[row]))
+            bands.extend(
+                RecipeBand(recipe_id=pk, user_id=user_id, band=band, bucket=int(bucket))
+                for band, bucket in enumerate(buckets[row])
+            )
+        RecipeBand.objects.bulk_create(bands)
+
+
+def refresh_signatures_later(recipe_ids, batch_size=500):
+    """Queue the refresh of many recipes as background jobs of batch_size recipes"""
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        jobs.enqueue('minhash.refresh_signatures', priority=10, recipe_ids=batch)
+
+
+def similar_recipes(recipe, limit=10):
+    """Return [(recipe_id, similarity)] of the owner's recipes most similar to recipe"""
+    if recipe.minhash is None:
+        return []
+    lookup = Q()
+    for band, bucket in recipe.bands.values_list('band', 'bucket'):
+        lookup |= Q(band=band, bucket=bucket)
+    # index lookups on (user, band, bucket) - only recipes sharing a bucket are loaded
+    candidate_ids = RecipeBand.objects.filter(lookup, user_id=recipe.user_id).exclude(
+        recipe_id=recipe.pk
+    ).values_list('recipe_id', flat=True).distinct()
+    candidates = list(
+        Recipe.objects.filter(pk__in=candidate_ids, minhash__isnull=False).values_list('pk', 'minhash')
+    )
+    if not candidates:
+        return []
+    scores = estimate_similarity(
+        from_bytes(recipe.minhash), np.stack([from_bytes(sig) for _, sig in candidates])
+    )
+    # highest similarity first, ties broken by newest recipe like the list view
+    order = sorted(range(len(candidates)), key=lambda i: (-scores[i], -candidates[i][0]))
+    return [(candidates[i][0], float(scores[i])) for i in order[:limit]]
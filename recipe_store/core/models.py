@@ -7,11 +7,20 @@ from django.conf import settings
 import uuid
 import os
 
+from core.storage import ContentAddressedStorage, file_hash
+
 
 def recipe_image_file_path(instance, filename):
-    """Generate new file pathf or the recipe image"""
+    """Generate new file path for the recipe image"""
     # Splitting the extension into ext using split
-    ext = filename.split('.')[-1]
+    ext = filename.split('.')[-1].lower()
+    file = getattr(instance.image, '_file', None) if instance is not None else None
+    if file is not None:
+        # content addressed: the file is named by the sha256 of its bytes, so the same photo
+        # is stored once however many recipes use it (see core.storage)
+        # two hex digits of fan out keep the directories small
+        content_hash = file_hash(file)
+        return os.path.join('uploads/images/', content_hash[:2], f'{content_hash}.{ext}')
     # creating new file name for our db with uuid
     filename = f'{uuid.uuid4()}.{ext}'
     # join filename to the destination path where we want to store the image
@@ -60,12 +69,47 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # last sequence number handed out to this user's change feed, see core.changes
+    change_seq = models.BigIntegerField(default=0, editable=False)
 
     objects = UserManager()
     # add the USERNAME_FIELD to be email instead of username
     USERNAME_FIELD = 'email'
     # configure the User model in settings.py using AUTH_USER_MODEL
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # is_active as loaded, core.signals revokes the tokens of a user saved as deactivated
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        # users authenticated by a signed token start out with their pk only (see user.tokens),
+        # the first deferred field accessed loads all of them in one query instead of one each
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields)
+
+
+def fold_name(name):
+    """Case-folded form of a tag/ingredient name used for prefix lookups"""
+    return ' '.join(name.casefold().split())
+
+
+class RecipeAttrQuerySet(models.QuerySet):
+    """QuerySet for user owned recipe attributes: Tag and Ingredient"""
+
+    def prefix(self, prefix):
+        """Names starting with prefix, case-insensitively
+        Written as a range on search_name so the (user, search_name) index is used,
+        LIKE 'x%' cannot use a plain index on every backend"""
+        folded = fold_name(prefix)
+        if not folded:
+            return self
+        return self.filter(search_name__gte=folded, search_name__lt=folded + '\U0010ffff')
+
 
 class Tag(models.Model):
     """Tag to be used for a recipe - str give tag.name"""
@@ -73,10 +117,28 @@ class Tag(models.Model):
     # best practic: retrieve the authuser model settings from settings.py
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
+    # denormalized number of recipes using this tag, maintained by core.signals
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    # fold_name(name), kept in sync by save()
+    search_name = models.CharField(max_length=255, editable=False, default='')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RecipeAttrQuerySet.as_manager()
+
+    class Meta:
+        # backs ?ordering=-recipe_count and assigned_only (recipe_count > 0) per user
+        indexes = [
+            models.Index(fields=['user', '-recipe_count'], name='core_tag_user_count_idx'),
+            models.Index(fields=['user', 'search_name'], name='core_tag_user_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.search_name = fold_name(self.name)
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
     """Ingredient to be used in a recipe - str gives ingredient.name"""
@@ -84,10 +146,27 @@ class Ingredient(models.Model):
     # best practic: retrieve the authuser model settings from settings.py
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE,)
+    # denormalized number of recipes using this ingredient, maintained by core.signals
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    # fold_name(name), kept in sync by save()
+    search_name = models.CharField(max_length=255, editable=False, default='')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RecipeAttrQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count'], name='core_ingr_user_count_idx'),
+            models.Index(fields=['user', 'search_name'], name='core_ingr_user_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.search_name = fold_name(self.name)
+        super().save(*args, **kwargs)
+
 
 class Recipe(models.Model):
     """Recipe made by users with tags and ingredients"""
@@ -98,7 +177,121 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
     link = models.CharField(max_length=255, blank=True)
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # shared between recipes with the same picture, indexed to count the references
+    image = models.ImageField(
+        null=True, upload_to=recipe_image_file_path, storage=ContentAddressedStorage(), db_index=True
+    )
+    # MinHash signature of the ingredient and tag ids, maintained by core.minhash
+    minhash = models.BinaryField(null=True, editable=False)
+    # hash of the normalized title and ingredient names, set by the duplicate scan (core.dedupe)
+    fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # one index per ?ordering= field, (user, field, id) also serves the range filters
+        indexes = [
+            models.Index(fields=['user', 'time_minutes', 'id'], name='core_recipe_user_time_idx'),
+            models.Index(fields=['user', 'price', 'id'], name='core_recipe_user_price_idx'),
+            models.Index(fields=['user', 'title', 'id'], name='core_recipe_user_title_idx'),
+            models.Index(fields=['user', 'fingerprint'], name='core_recipe_user_fp_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # image as loaded, released by core.signals when it is replaced
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
+
+class RecipeBand(models.Model):
+    """One LSH band bucket of a recipe's MinHash signature - see core.minhash"""
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE, related_name='bands')
+    # copied from the recipe so candidate lookups never leave the owner's rows
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'band', 'bucket'], name='core_recipeband_lookup_idx'),
+        ]
+
+
+class Change(models.Model):
+    """One entry of a user's change feed - the latest change of one object
+    Written by core.changes, read by /recipe/changes/?since=<seq>"""
+    KIND_RECIPE = 'recipe'
+    KIND_TAG = 'tag'
+    KIND_INGREDIENT = 'ingredient'
+    KIND_CHOICES = (
+        (KIND_RECIPE, 'Recipe'),
+        (KIND_TAG, 'Tag'),
+        (KIND_INGREDIENT, 'Ingredient'),
+    )
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # per user, strictly increasing - taken from User.change_seq
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    # tombstone: the object was deleted
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('user', 'seq'),)
+        indexes = [
+            # older entries of the same object are replaced, found through this index
+            models.Index(fields=['user', 'kind', 'object_id'], name='core_change_object_idx'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work, claimed and run by `manage.py run_worker` - see core.jobs"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    # name under which the function is registered with core.jobs.task
+    task = models.CharField(max_length=100)
+    # JSON encoded keyword arguments of the task
+    payload = models.TextField(default='{}')
+    # higher runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # not before this time, pushed back after a failed attempt
+    run_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # worker holding the job, and until when - past that the job may be claimed again
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # claim query: ready jobs by priority and age
+            models.Index(fields=['status', 'priority', 'run_at'], name='core_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
+
+
+class TokenRevocation(models.Model):
+    """A revoked signed token (jti), or without jti every token of the user issued before revoked_at
+    Read by user.tokens into an in-process revocation list"""
+    # not a foreign key: the revocation has to outlive a deleted user
+    user_id = models.IntegerField()
+    jti = models.CharField(max_length=32, blank=True)
+    revoked_at = models.DateTimeField()
+    # the revoked tokens have expired by then, the row is useless past it
+    expires_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,178 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.models import Recipe
+
+# "What can I cook": every recipe of a user is one row of a packed bit matrix,
+# one bit per ingredient the user's recipes use. For a pantry bitset P the number of
+# missing ingredients of a recipe row R is popcount(R & ~P), computed for all rows at once.
+# Indexes live in this process, are built on first use and refreshed row by row:
+# core.signals marks recipes dirty when their ingredients change or they are deleted.
+# Every change also bumps a per-user version in the Django cache, when the version moved
+# by more than this process's own changes (another worker wrote) the index is rebuilt.
+# That takes a cache shared by the workers, see CACHES in the settings.
+
+# number of set bits for every byte value
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount_rows(bits):
+    """Number of set bits in each row of a 2D uint64 array"""
+    return _POPCOUNT[bits.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+class PantryIndex:
+    """Packed ingredient bitsets of one user's recipes"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.dirty = set()
+        self.built = False
+        # cache version the index reflects, plus the bumps made by this process since
+        self.version = None
+        self.local_bumps = 0
+        self._clear()
+
+    def _clear(self):
+        self.recipe_ids = np.zeros(0, dtype=np.int64)
+        self.bits = np.zeros((0, 1), dtype=np.uint64)
+        # recipe id -> row, ingredient id -> bit position
+        self.rows = {}
+        self.columns = {}
+
+    def _column(self, ingredient_id):
+        column = self.columns.get(ingredient_id)
+        if column is None:
+            column = self.columns[ingredient_id] = len(self.columns)
+            if column >= self.bits.shape[1] * 64:
+                # double the words per row, existing bits keep their position
+                self.bits = np.hstack([self.bits, np.zeros_like(self.bits)])
+        return column
+
+    def _row(self, recipe_id):
+        row = self.rows.get(recipe_id)
+        if row is None:
+            row = self.rows[recipe_id] = len(self.rows)
+            if row >= len(self.recipe_ids):
+                capacity = max(2 * len(self.recipe_ids), 64)
+                self.recipe_ids = np.resize(self.recipe_ids, capacity)
+                self.bits = np.vstack([self.bits, np.zeros(
+                    (capacity - len(self.bits), self.bits.shape[1]), dtype=np.uint64
+                )])
+            self.recipe_ids[row] = recipe_id
+        return row
+
+    def _load(self, recipe_ids=None):
+        """(Re)load the ingredient bits of the given recipes, or of all recipes"""
+        links = Recipe.ingredients.through.objects.filter(recipe__user_id=self.user_id)
+        if recipe_ids is not None:
+            links = links.filter(recipe_id__in=recipe_ids)
+            for recipe_id in recipe_ids:
+                # deleted recipes or recipes without ingredients keep an all-zero row
+                if recipe_id in self.rows:
+                    self.bits[self.rows[recipe_id]] = 0
+        pairs = list(links.values_list('recipe_id', 'ingredient_id'))
+        if not pairs:
+            return
+        rows = np.fromiter((self._row(recipe_id) for recipe_id, _ in pairs), dtype=np.int64, count=len(pairs))
+        columns = np.fromiter(
+            (self._column(ingredient_id) for _, ingredient_id in pairs), dtype=np.int64, count=len(pairs)
+        )
+        np.bitwise_or.at(
+            self.bits, (rows, columns // 64), np.left_shift(np.uint64(1), (columns % 64).astype(np.uint64))
+        )
+
+    def refresh(self):
+        version = cache.get(_version_key(self.user_id), 0)
+        if not self.built or version != self.version + self.local_bumps:
+            # first use, or changed by another process: rebuild with one query
+            self._clear()
+            self._load()
+            self.built = True
+            self.dirty.clear()
+        elif self.dirty:
+            recipe_ids, self.dirty = self.dirty, set()
+            self._load(recipe_ids)
+        self.version = version
+        self.local_bumps = 0
+
+    def pantry_bits(self, ingredient_ids):
+        """Bitset of the pantry, ingredients no recipe uses are irrelevant and dropped"""
+        pantry = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        for ingredient_id in ingredient_ids:
+            column = self.columns.get(ingredient_id)
+            if column is not None:
+                pantry[column // 64] |= np.uint64(1) << np.uint64(column % 64)
+        return pantry
+
+    def cookable(self, ingredient_ids, max_missing=0):
+        """Return [(recipe_id, missing)] of recipes missing at most max_missing ingredients"""
+        with self.lock:
+            self.refresh()
+            used = len(self.rows)
+            bits = self.bits[:used]
+            missing = popcount_rows(bits & ~self.pantry_bits(ingredient_ids))
+            # all-zero rows are recipes without ingredients (or deleted ones)
+            matches = np.flatnonzero((missing <= max_missing) & bits.any(axis=1))
+            recipe_ids = self.recipe_ids[matches]
+            missing = missing[matches]
+        # fewest missing first, newest recipe first within the same count
+        order = np.lexsort((-recipe_ids, missing))
+        return list(zip(recipe_ids[order].tolist(), missing[order].tolist()))
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _version_key(user_id):
+    return f'pantry-version:{user_id}'
+
+
+def get_index(user_id):
+    """Return the user's index, evicting the least recently used one past the limit"""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = PantryIndex(user_id)
+            while len(_indexes) > settings.PANTRY_INDEX_MAX_USERS:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(user_id)
+        return index
+
+
+def invalidate(user_id, recipe_ids):
+    """Mark recipes of a user for reload on the next query, if the user is indexed"""
+    recipe_ids = list(recipe_ids)
+    # once the change is committed: a refresh in between would load the old rows and
+    # consider them current, the index would stay stale until the next change
+    transaction.on_commit(lambda: _invalidate(user_id, recipe_ids))
+
+
+def _invalidate(user_id, recipe_ids):
+    key = _version_key(user_id)
+    # add() is a no-op when the key exists, incr() needs it to
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+    index = _indexes.get(user_id)
+    if index is not None:
+        with index.lock:
+            index.dirty.update(recipe_ids)
+            index.local_bumps += 1
+
+
+def reset():
+    """Forget the indexes of this process - for tests"""
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def cookable_recipes(user_id, ingredient_ids, max_missing=0):
+    return get_index(user_id).cookable(ingredient_ids, max_missing)
@@ -0,0 +1,128 @@
+import math
+import threading
+from collections import OrderedDict
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from core import metrics
+
+# Token bucket rate limits per client and endpoint, checked by DRF as a throttle class.
+# A bucket holds up to `burst` tokens and gains `rate` tokens a second, every request takes
+# one: a client may burst, but not go faster than rate on average.
+# The limits come from RATELIMIT_RULES: the view name ('recipe_app:recipe-list') is looked up,
+# then its namespace ('recipe_app'); views matching no rule are not limited. Every client gets
+# its own bucket per view: the user when authenticated, the address otherwise.
+# RATELIMIT_BACKEND = 'local' keeps the buckets in this process (each worker counts on its
+# own), 'cache' shares them between workers through the Django cache, when it is shared
+# itself (see CACHES in the settings).
+
+LOCK_STRIPES = 64
+
+
+class LocalBuckets:
+    """Token buckets in a dict per stripe of keys, each guarded by its own lock
+    Requests of different clients rarely wait for each other"""
+
+    def __init__(self):
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # key -> [tokens, monotonic time of the last update], least recently used first
+        self.buckets = [OrderedDict() for _ in range(LOCK_STRIPES)]
+
+    def take(self, key, rate, burst):
+        """Take a token, return 0 if there was one, else the seconds until there is"""
+        now = time.monotonic()
+        stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+        with self.locks[stripe]:
+            buckets = self.buckets[stripe]
+            bucket = buckets.get(key)
+            if bucket is None:
+                self.prune(buckets)
+                bucket = buckets[key] = [burst, now]
+            else:
+                buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def prune(self, buckets):
+        """Make room for a bucket in a stripe by dropping its least recently used ones
+        Every stripe holds its share of RATELIMIT_MAX_KEYS. The client idle the longest has
+        usually refilled its bucket: forgetting it changes nothing, otherwise it gets a full
+        burst again."""
+        while len(buckets) >= max(settings.RATELIMIT_MAX_KEYS // LOCK_STRIPES, 1):
+            buckets.popitem(last=False)
+
+    def reset(self):
+        for lock, buckets in zip(self.locks, self.buckets):
+            with lock:
+                buckets.clear()
+
+
+class CacheBuckets:
+    """Buckets shared through the Django cache
+    The cache has no compare-and-set, so a bucket is approximated by a counter per window of
+    burst / rate seconds allowing burst requests - incr() is atomic on memcached and redis."""
+
+    def take(self, key, rate, burst):
+        window = math.ceil(burst / rate)
+        now = time.time()
+        window_key = f'ratelimit:{key}:{int(now // window)}'
+        cache.add(window_key, 0, timeout=window + 1)
+        try:
+            count = cache.incr(window_key)
+        except ValueError:
+            # expired between add() and incr()
+            return 0
+        if count <= burst:
+            return 0
+        return window - now % window
+
+
+_local = LocalBuckets()
+_shared = CacheBuckets()
+
+
+def backend():
+    return _shared if settings.RATELIMIT_BACKEND == 'cache' else _local
+
+
+def reset():
+    """Forget the buckets of this process - for tests"""
+    _local.reset()
+
+
+def rule_for(view_name):
+    """(rate, burst) of a view name, or None when it is not limited"""
+    rules = settings.RATELIMIT_RULES
+    if view_name in rules:
+        return rules[view_name]
+    return rules.get(view_name.split(':', 1)[0]) if ':' in view_name else None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle applying RATELIMIT_RULES"""
+
+    def allow_request(self, request, view):
+        match = request.resolver_match
+        rule = rule_for(match.view_name) if match else None
+        if rule is None:
+            return True
+        user = request.user
+        client = f'user:{user.pk}' if user and user.is_authenticated else f'ip:{self.get_ident(request)}'
+        rate, burst = rule
+        self.delay = backend().take(f'{match.view_name}|{client}', rate, burst)
+        if self.delay:
+            metrics.incr('ratelimit_rejected_total')
+            return False
+        return True
+
+    def wait(self):
+        return self.delay
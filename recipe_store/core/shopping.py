@@ -0,0 +1,48 @@
+import heapq
+from itertools import groupby
+
+from django.db import connection
+from django.db.models import Count
+
+from core.models import Recipe
+
+# Shopping list of a set of recipes: every ingredient they use once, with the number of the
+# recipes using it. Counted by the database in one GROUP BY over the recipe/ingredient link
+# table (joined to core_recipe for the owner check), only the result rows reach Python.
+
+# ids per query, SQLite allows 999 parameters - other databases take all the ids in one query
+CHUNK_SIZE = 500
+
+
+def _grouped(user_id, recipe_ids):
+    """(ingredient id, name, recipe count) rows of recipes of a user, in name order"""
+    return (
+        Recipe.ingredients.through.objects
+        .filter(recipe_id__in=recipe_ids, recipe__user_id=user_id)
+        .values_list('ingredient_id', 'ingredient__name')
+        .annotate(recipes=Count('recipe_id'))
+        .order_by('ingredient__name', 'ingredient_id')
+    )
+
+
+def _name_order(row):
+    return row[1], row[0]
+
+
+def ingredient_counts(user_id, recipe_ids):
+    """Yield (ingredient id, name, recipe count) for the ingredients of recipes of a user,
+    in name order - ids of other users' recipes are ignored"""
+    recipe_ids = sorted(set(recipe_ids))
+    if len(recipe_ids) <= CHUNK_SIZE or not connection.features.max_query_params:
+        # rows come off the cursor as they are sent
+        yield from _grouped(user_id, recipe_ids).iterator()
+        return
+    # one query per chunk, their cursors read side by side: every recipe is in one chunk only,
+    # so the rows of an ingredient meet in the merge and their counts add up. SQLite compares
+    # names in code point order, like Python, so the merge agrees with the ORDER BY.
+    cursors = [
+        _grouped(user_id, recipe_ids[start:start + CHUNK_SIZE]).iterator()
+        for start in range(0, len(recipe_ids), CHUNK_SIZE)
+    ]
+    for (name, ingredient_id), rows in groupby(heapq.merge(*cursors, key=_name_order), key=_name_order):
+        yield ingredient_id, name, sum(count for _, _, count in rows)
@@ -0,0 +1,162 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_save
+from django.dispatch import receiver
+
+from core import changes, images, minhash, pantry
+from core.models import Recipe, Tag, Ingredient, Change
+from user import profile, tokens
+
+# Signal receivers that keep the denormalized recipe data in sync with the M2M tables
+# They are connected when the app registry is ready, see CoreConfig.ready()
+
+
+def adjust_recipe_counts(model, pks, delta):
+    """Atomically add delta to recipe_count of the given tags/ingredients"""
+    if pks:
+        # F() expression: the increment happens in the UPDATE itself, no read-modify-write race
+        model.objects.filter(pk__in=pks).update(recipe_count=F('recipe_count') + delta)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Propagate a change of recipe.tags / recipe.ingredients to the derived data:
+    recipe_count counters, MinHash signatures, pantry index and change feed"""
+    # reverse=True means the change came from the tag/ingredient side, eg tag.recipe_set.add(recipe)
+    if reverse:
+        source, target = f'{instance._meta.model_name}_id', 'recipe_id'
+    else:
+        source, target = 'recipe_id', f'{model._meta.model_name}_id'
+    linked = sender.objects.filter(**{source: instance.pk})
+    # rows removed by remove()/clear() are only known before the delete, stash them on the instance
+    pending = instance.__dict__.setdefault('_pending_links', {})
+
+    if action == 'pre_remove':
+        pending[sender] = list(linked.filter(**{f'{target}__in': pk_set}).values_list(target, flat=True))
+        return
+    if action == 'pre_clear':
+        pending[sender] = list(linked.values_list(target, flat=True))
+        return
+
+    if action == 'post_add':
+        # pk_set only contains the ids that were actually inserted
+        changed, delta = list(pk_set), 1
+    elif action in ('post_remove', 'post_clear'):
+        changed, delta = pending.pop(sender, []), -1
+    else:
+        return
+    if not changed:
+        return
+
+    if reverse:
+        attr_model, attr_ids, recipe_ids = type(instance), [instance.pk], changed
+        adjust_recipe_counts(attr_model, attr_ids, delta * len(changed))
+    else:
+        attr_model, attr_ids, recipe_ids = model, changed, [instance.pk]
+        adjust_recipe_counts(attr_model, attr_ids, delta)
+
+    minhash.refresh_signatures(recipe_ids)
+    if attr_model is Ingredient:
+        pantry.invalidate(instance.user_id, recipe_ids)
+    # both ends changed: the recipe's id lists and the tag/ingredient recipe_count
+    changes.record(instance.user_id, changes.kind_of(Recipe), recipe_ids)
+    changes.record(instance.user_id, changes.kind_of(attr_model), attr_ids)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def reset_pantry_row(sender, instance, created=True, **kwargs):
+    """New recipes start from an empty row, deleted ones end with one"""
+    if created:
+        pantry.invalidate(instance.user_id, [instance.pk])
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_recipe_counts(sender, instance, **kwargs):
+    """Decrement the counters of a recipe's tags and ingredients before it is deleted"""
+    # the through rows are removed by the delete collector without sending m2m_changed
+    for related in (instance.tags, instance.ingredients):
+        attr_ids = list(related.values_list('pk', flat=True))
+        adjust_recipe_counts(related.model, attr_ids, -1)
+        changes.record(instance.user_id, changes.kind_of(related.model), attr_ids)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_attr_recipes(sender, instance, **kwargs):
+    """Note the recipes of a tag/ingredient about to be deleted"""
+    instance._deleted_recipe_ids = list(instance.recipe_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def refresh_attr_recipes(sender, instance, **kwargs):
+    """Drop a deleted tag/ingredient from the signatures of the recipes that used it"""
+    recipe_ids = instance.__dict__.pop('_deleted_recipe_ids', ())
+    # a popular tag can be on thousands of recipes, keep that off the request
+    minhash.refresh_signatures_later(recipe_ids)
+    if sender is Ingredient:
+        pantry.invalidate(instance.user_id, recipe_ids)
+    changes.record(instance.user_id, changes.kind_of(Recipe), recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def record_saved(sender, instance, **kwargs):
+    """Created or updated objects go to the owner's change feed"""
+    changes.record(instance.user_id, changes.kind_of(sender), [instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def record_deleted(sender, instance, **kwargs):
+    """Deleted objects leave a tombstone in the owner's change feed"""
+    changes.record(instance.user_id, changes.kind_of(sender), [instance.pk], deleted=True)
+
+
+@receiver(post_delete, sender=get_user_model())
+def drop_user_changes(sender, instance, **kwargs):
+    """Remove feed entries recorded while the user's objects were being deleted"""
+    # the user row is deleted last, so this runs after every other delete of the cascade
+    Change.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=get_user_model())
+def revoke_user_tokens(sender, instance, **kwargs):
+    """Signed tokens are not looked up in the database, a deleted user's have to be revoked"""
+    tokens.revoke_user(instance.pk)
+
+
+@receiver(post_save, sender=get_user_model())
+def revoke_deactivated_user_tokens(sender, instance, created, **kwargs):
+    """Signed tokens are not looked up in the database, a deactivated user's have to be revoked"""
+    active = instance.__dict__.get('is_active')
+    # not loaded from the database (None): the flag may have changed too
+    if not created and active is False and instance.__dict__.get('_loaded_is_active') is not False:
+        tokens.revoke_user(instance.pk)
+    instance._loaded_is_active = active
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def drop_cached_profile(sender, instance, **kwargs):
+    """The cached /user/me/ response of a saved or deleted user is stale"""
+    profile.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    """Drop the file of a replaced image if no other recipe shares it"""
+    loaded, current = instance.__dict__.get('_loaded_image'), instance.image.name
+    if loaded and loaded != current:
+        images.release(loaded)
+    instance._loaded_image = current
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    """Drop the image file of a deleted recipe if no other recipe shares it"""
+    images.release(instance.image.name)
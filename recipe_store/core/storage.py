@@ -0,0 +1,51 @@
+import hashlib
+import os
+import time
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Content-addressed storage for recipe images: a file is named by the sha256 of its bytes
+# (see recipe_image_file_path), so a name that exists already holds exactly these bytes.
+# Saving it again writes nothing and keeps the name, instead of the usual "_abc123" suffix.
+
+
+def file_hash(file):
+    """sha256 hex digest of a file, reading it chunk by chunk"""
+    # uploads come with the hash computed while streaming, see core.uploadhandlers
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash:
+        return content_hash
+    hasher = hashlib.sha256()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(64 * 1024), b''):
+        hasher.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return hasher.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that stores every distinct content once"""
+
+    def get_available_name(self, name, max_length=None):
+        # same name means same content, never rename
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            # duplicate upload: nothing to write, just refresh the modification time
+            # so that gc_images leaves the file alone during its grace period, and a delete
+            # job queued before now keeps it (see core.images); the file system clock lags
+            # time.time() by up to a tick, hence the explicit time
+            now = time.time()
+            os.utime(self.path(name), (now, now))
+            return name
+        # write under a unique temporary name, then move into place atomically;
+        # a concurrent upload of the same bytes just replaces an identical file
+        tmp_name = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        os.replace(self.path(tmp_name), self.path(name))
+        return name
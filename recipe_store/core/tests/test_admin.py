@@ -1,7 +1,12 @@
+from unittest import mock
+
+from django.contrib import admin
 # Client: helps us to make test requests to our application during unit testing
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+
+from core.models import Recipe, Tag, Job
 # reverse - allows us to generate url for django admin page
 
 
@@ -52,3 +57,78 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_recipe_change_page_scoped_to_owner(self):
+        """Test tag choices of a recipe are loaded on demand from the owner's tags"""
+        recipe = Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=2)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+        Tag.objects.create(user=self.admin_user, name='Not yours')
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, f'/admin/core/tag/autocomplete/?owner={self.user.id}')
+        self.assertContains(res, 'Vegan')
+        self.assertNotContains(res, 'Not yours')
+
+    def test_recipe_add_page_scoped_to_owner(self):
+        """Test the add page offers and accepts only the tags of the owner entered"""
+        own_tag = Tag.objects.create(user=self.user, name='Vegan')
+        foreign_tag = Tag.objects.create(user=self.admin_user, name='Not yours')
+        url = reverse('admin:core_recipe_add')
+
+        res = self.client.get(url, {'user': self.user.id})
+        self.assertContains(res, f'/admin/core/tag/autocomplete/?owner={self.user.id}')
+
+        payload = {'user': self.user.id, 'title': 'Soup', 'time_minutes': 5, 'price': 2}
+        res = self.client.post(url, {**payload, 'tags': [own_tag.id, foreign_tag.id]})
+        self.assertIn('tags', res.context['adminform'].form.errors)
+        self.assertFalse(Recipe.objects.exists())
+
+        res = self.client.post(url, {**payload, 'tags': [own_tag.id]})
+        self.assertNotIn('tags', res.context['adminform'].form.errors)
+
+    def test_tag_autocomplete_by_owner_and_prefix(self):
+        """Test autocomplete matches the owner's tags by folded name prefix"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        Tag.objects.create(user=self.admin_user, name='Vegetarian')
+
+        res = self.client.get(reverse('admin:core_tag_autocomplete'), {'term': 'veg', 'owner': self.user.id})
+
+        self.assertEqual([item['id'] for item in res.json()['results']], [str(vegan.id)])
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_changelist_count_bounded(self):
+        """Test the changelist stops counting at ADMIN_COUNT_LIMIT, the pages past it still open"""
+        for i in range(5):
+            Recipe.objects.create(user=self.user, title=f'Recipe {i}', time_minutes=5, price=2)
+        url = reverse('admin:core_recipe_changelist')
+
+        with mock.patch.object(admin.site._registry[Recipe], 'list_per_page', 2):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            # the count shown is the bounded one
+            self.assertEqual(res.context['cl'].result_count, 3)
+            self.assertContains(res, 'Recipe 4')
+
+            # third page, past the 3 rows counted, newest first
+            res = self.client.get(url, {'p': 2})
+            self.assertEqual(res.status_code, 200)
+            self.assertContains(res, 'Recipe 0')
+            self.assertNotContains(res, 'Recipe 1')
+
+            # past the last row: the admin's "invalid page" redirect
+            res = self.client.get(url, {'p': 3})
+            self.assertEqual(res.status_code, 302)
+
+    def test_purge_users_action(self):
+        """Test the purge action deactivates users and queues their deletion"""
+        url = reverse('admin:core_user_changelist')
+
+        self.client.post(url, {'action': 'purge_users', '_selected_action': [self.user.id]})
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(Job.objects.get().task, 'users.purge')
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core import bulk
+from core.models import Recipe, RecipeBand, Tag, Ingredient, Change, Job
+
+
+def sample_user(email='test@gmail.com'):
+    return get_user_model().objects.create_user(email, 'password')
+
+
+def sample_recipes(user, count, image=''):
+    tag = Tag.objects.create(user=user, name='Vegan')
+    ingredient = Ingredient.objects.create(user=user, name='Salt')
+    recipes = []
+    for i in range(count):
+        recipe = Recipe.objects.create(user=user, title=f'Recipe {i}', time_minutes=5, price=2, image=image)
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        recipes.append(recipe)
+    return recipes
+
+
+class PurgeUserTests(TestCase):
+    """Test deleting a user with set-based deletes"""
+
+    def test_purge_user_deletes_owned_data(self):
+        """Test the user's rows are all gone and other users keep theirs"""
+        user = sample_user()
+        sample_recipes(user, 3, image='uploads/images/ab/shared.jpg')
+        other = sample_user('other@gmail.com')
+        kept = sample_recipes(other, 1, image='uploads/images/ab/shared.jpg')[0]
+
+        bulk.purge_user(user, chunk_size=2)
+
+        self.assertFalse(get_user_model().objects.filter(pk=user.pk).exists())
+        for model in (Recipe, Tag, Ingredient, RecipeBand, Change):
+            self.assertFalse(model.objects.filter(user_id=user.pk).exists())
+        self.assertFalse(Recipe.tags.through.objects.exclude(recipe=kept).exists())
+        kept.refresh_from_db()
+        self.assertEqual(kept.tags.get().recipe_count, 1)
+        # the image goes through the background cleanup, which finds it still in use
+        self.assertTrue(Job.objects.filter(task='images.delete_unreferenced').exists())
+
+    def test_purge_user_unlinks_other_users_recipes(self):
+        """Test recipes of other users linked to the purged tags and ingredients lose the links"""
+        user = sample_user()
+        recipe = sample_recipes(user, 1)[0]
+        other = sample_user('other@gmail.com')
+        theirs = Recipe.objects.create(user=other, title='Theirs', time_minutes=5, price=2)
+        theirs.tags.add(*recipe.tags.all())
+        theirs.ingredients.add(*recipe.ingredients.all())
+        Change.objects.filter(user=other).delete()
+
+        bulk.purge_user(user)
+
+        self.assertFalse(theirs.tags.exists())
+        self.assertFalse(theirs.ingredients.exists())
+        feed = Change.objects.filter(user=other, kind=Change.KIND_RECIPE)
+        self.assertEqual(list(feed.values_list('object_id', flat=True)), [theirs.id])
+
+    def test_purge_user_queries_independent_of_size(self):
+        """Test the number of queries depends on chunks, not rows"""
+        small, large = sample_user('small@gmail.com'), sample_user('large@gmail.com')
+        sample_recipes(small, 2)
+        sample_recipes(large, 20)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            bulk.purge_user(small)
+        with CaptureQueriesContext(connection) as large_queries:
+            bulk.purge_user(large)
+
+        self.assertEqual(len(small_queries), len(large_queries))
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core.models import Recipe, Job
+
+
+class GcImagesCommandTests(TestCase):
+    """Test the gc_images management command"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+
+    def make_file(self, name, age_hours, size=10):
+        path = os.path.join(self.media.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'x' * size)
+        mtime = time.time() - age_hours * 3600
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_deletes_old_unreferenced_files(self):
+        """Test only unreferenced files past the grace period are deleted"""
+        referenced = self.make_file('uploads/images/ab/referenced.jpg', age_hours=48)
+        orphan = self.make_file('uploads/images/cd/orphan.jpg', age_hours=48, size=7)
+        recent = self.make_file('uploads/images/recent.jpg', age_hours=1)
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=2, image='uploads/images/ab/referenced.jpg'
+        )
+        out = StringIO()
+
+        call_command('gc_images', '--batch-size=1', stdout=out)
+
+        self.assertTrue(os.path.exists(referenced))
+        self.assertTrue(os.path.exists(recent))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertIn('Deleted 1 unreferenced files, 7 bytes reclaimed', out.getvalue())
+
+    def test_dry_run_deletes_nothing(self):
+        """Test --dry-run only reports"""
+        orphan = self.make_file('uploads/images/cd/orphan.jpg', age_hours=48)
+        out = StringIO()
+
+        call_command('gc_images', '--dry-run', stdout=out)
+
+        self.assertTrue(os.path.exists(orphan))
+        self.assertIn('Would delete uploads/images/cd/orphan.jpg', out.getvalue())
+
+
+class PurgeUserCommandTests(TestCase):
+    """Test the purge_user management command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+        Recipe.objects.create(user=self.user, title='Soup', time_minutes=5, price=2)
+
+    def test_purge_user_by_email(self):
+        """Test the user and their recipes are deleted"""
+        call_command('purge_user', 'test@gmail.com', stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_purge_user_in_background(self):
+        """Test --background deactivates the user and queues the purge"""
+        call_command('purge_user', str(self.user.id), '--background', stdout=StringIO())
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(Job.objects.filter(task='users.purge').exists())
+
+
+class CalibrateHasherCommandTests(TestCase):
+    """Test the calibrate_hasher management command"""
+
+    def test_calibrate_pbkdf2(self):
+        """Test the settings for the target time are printed"""
+        out = StringIO()
+        call_command('calibrate_hasher', '--target-ms=1', stdout=out)
+
+        self.assertIn('PASSWORD_PBKDF2_ITERATIONS = ', out.getvalue())
+
+    def test_calibrate_scrypt(self):
+        """Test scrypt gets a power of two work factor"""
+        out = StringIO()
+        call_command('calibrate_hasher', '--algorithm=scrypt', '--target-ms=1', stdout=out)
+
+        self.assertIn('PASSWORD_SCRYPT_N = 2 ** ', out.getvalue())
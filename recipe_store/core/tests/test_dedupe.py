@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core import dedupe, jobs
+from core.models import Ingredient, Recipe
+
+
+class DedupeTests(TestCase):
+    """Test the duplicate recipe scan"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.egg = Ingredient.objects.create(user=self.user, name='Egg')
+
+    def recipe(self, title, *ingredients):
+        recipe = Recipe.objects.create(user=self.user, title=title, time_minutes=5, price=2)
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def test_normalize_title(self):
+        """Test case, punctuation and whitespace are ignored"""
+        self.assertEqual(dedupe.normalize_title('  Eggs,  Benedict!! '), 'eggs benedict')
+        self.assertEqual(dedupe.normalize_title('eggs-benedict'), 'eggs benedict')
+
+    def test_fingerprint_ignores_ingredient_order(self):
+        self.assertEqual(
+            dedupe.fingerprint('Omelette', ['salt', 'egg']), dedupe.fingerprint('omelette.', ['egg', 'salt'])
+        )
+        self.assertNotEqual(dedupe.fingerprint('Omelette', ['egg']), dedupe.fingerprint('Omelette', ['salt']))
+
+    def test_scan_finds_duplicate_groups(self):
+        """Test recipes with the same normalized title and ingredients are grouped"""
+        first = self.recipe('Omelette', self.egg, self.salt)
+        second = self.recipe('omelette!', self.salt, self.egg)
+        self.recipe('Omelette', self.egg)
+        other_egg = Ingredient.objects.create(user=self.user, name='egg ')
+        third = self.recipe('OMELETTE', other_egg, self.salt)
+
+        jobs.enqueue('recipes.find_duplicates', user_id=self.user.id)
+        jobs.run_pending()
+
+        self.assertEqual(dedupe.duplicate_groups(self.user.id), [[first.id, second.id, third.id]])
+
+    def test_recipes_edited_since_scan_dropped(self):
+        """Test a recipe changed after the scan is not reported with its old group"""
+        first = self.recipe('Omelette', self.egg)
+        second = self.recipe('Omelette', self.egg)
+        dedupe.find_duplicates(self.user.id)
+
+        second.ingredients.add(self.salt)
+
+        self.assertEqual(dedupe.duplicate_groups(self.user.id), [])
+        first.ingredients.add(self.salt)
+        self.assertEqual(dedupe.duplicate_groups(self.user.id), [])
+
+    def test_scan_is_scoped_to_user(self):
+        """Test recipes of other users are not duplicates of the user's"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'password')
+        self.recipe('Soup')
+        Recipe.objects.create(user=other, title='Soup', time_minutes=5, price=2)
+
+        dedupe.find_duplicates(self.user.id)
+        dedupe.find_duplicates(other.id)
+
+        self.assertEqual(dedupe.duplicate_groups(self.user.id), [])
@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('tests.fail')
+def fail():
+    raise ValueError('boom')
+
+
+class JobQueueTests(TestCase):
+    """Test the database backed job queue"""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_by_priority_and_deleted(self):
+        """Test higher priority jobs run first and finished jobs are removed"""
+        jobs.enqueue('tests.record', value='low')
+        jobs.enqueue('tests.record', priority=5, value='high')
+
+        self.assertEqual(jobs.run_pending(), 2)
+
+        self.assertEqual(calls, ['high', 'low'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_delayed_job_not_claimed(self):
+        """Test a job is not claimed before its run_at"""
+        jobs.enqueue('tests.record', delay=60, value='later')
+
+        self.assertIsNone(jobs.claim('worker-1'))
+
+    def test_claimed_job_not_claimed_twice(self):
+        """Test a job held by one worker is not handed to another one"""
+        jobs.enqueue('tests.record', value='once')
+
+        job = jobs.claim('worker-1')
+
+        self.assertEqual(job.locked_by, 'worker-1')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(jobs.claim('worker-2'))
+
+    def test_expired_lease_reclaimed(self):
+        """Test the job of a worker that went away is claimed again"""
+        jobs.enqueue('tests.record', value='again')
+        job = jobs.claim('worker-1')
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = jobs.claim('worker-2')
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+        # the first worker lost the lease, its late result is ignored
+        jobs.run(job)
+        self.assertTrue(Job.objects.filter(pk=job.pk).exists())
+        jobs.run(reclaimed)
+        self.assertFalse(Job.objects.filter(pk=job.pk).exists())
+
+    @override_settings(JOBS_RETRY_BASE_DELAY=10, JOBS_RETRY_MAX_DELAY=15)
+    def test_failed_job_retried_with_backoff(self):
+        """Test failures are retried later, then kept as failed"""
+        job = jobs.enqueue('tests.fail', max_attempts=2)
+
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertIn('boom', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(jobs.backoff(3), 15)
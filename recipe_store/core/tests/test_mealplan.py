@@ -0,0 +1,93 @@
+import itertools
+import time
+from io import StringIO
+
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from core import mealplan
+
+
+def brute_force(price, minutes, weight, bits, count, budget, max_time):
+    """Best score of all combinations, -1 when none fits"""
+    best = -1
+    for combo in itertools.combinations(range(len(price)), count):
+        rows = list(combo)
+        if price[rows].sum() > budget or minutes[rows].sum() > max_time:
+            continue
+        if bits is not None:
+            score = bin(int.from_bytes(np.bitwise_or.reduce(bits[rows]).tobytes(), 'little')).count('1')
+        else:
+            score = int(weight[rows].sum())
+        best = max(best, score)
+    return best
+
+
+class MealPlanSolverTests(SimpleTestCase):
+    """Test the meal plan branch and bound"""
+
+    def test_matches_brute_force(self):
+        """Test the plans found are feasible and as good as the best combination"""
+        rng = np.random.RandomState(0)
+        for _ in range(100):
+            n, count = rng.randint(3, 11), rng.randint(1, 4)
+            price = rng.randint(100, 2000, n).astype(np.int64)
+            minutes = rng.randint(5, 120, n).astype(np.int64)
+            budget, max_time = int(rng.randint(500, 5000)), int(rng.randint(30, 300))
+            bits = mealplan._tag_bits(rng.randint(0, n, 3 * n), rng.randint(0, 10, 3 * n), n)
+            weight = rng.randint(0, 4, n).astype(np.int64)
+            for objective_bits in (bits, None):
+                rows, score, optimal = mealplan.solve(
+                    price, minutes, weight, objective_bits, count, budget, max_time, 10
+                )
+                best = brute_force(price, minutes, weight, objective_bits, count, budget, max_time)
+
+                self.assertTrue(optimal)
+                if best < 0:
+                    self.assertEqual(rows, [])
+                    continue
+                self.assertEqual(len(set(rows)), count)
+                self.assertLessEqual(price[rows].sum(), budget)
+                self.assertLessEqual(minutes[rows].sum(), max_time)
+                self.assertEqual(score, best)
+
+    def test_time_limit_returns_best_so_far(self):
+        """Test a search cut short still returns a feasible plan, not proven optimal"""
+        rng = np.random.RandomState(1)
+        n = 5000
+        price = rng.randint(200, 3000, n).astype(np.int64)
+        minutes = rng.randint(5, 180, n).astype(np.int64)
+        rows = np.repeat(np.arange(n), rng.randint(0, 6, n))
+        bits = mealplan._tag_bits(rows, rng.randint(0, 30, len(rows)), n)
+
+        rows, score, optimal = mealplan.solve(price, minutes, None, bits, 7, 2000, 80, 0.001)
+
+        self.assertFalse(optimal)
+        self.assertEqual(len(rows), 7)
+        self.assertLessEqual(price[rows].sum(), 2000)
+        self.assertLessEqual(minutes[rows].sum(), 80)
+
+    def test_time_limit_with_skipped_candidates(self):
+        """Test the time limit holds when nearly every candidate is skipped as too expensive"""
+        n = 100000
+        price = np.full(n, 1000, dtype=np.int64)
+        price[::100] = 1
+        minutes = np.full(n, 10, dtype=np.int64)
+        # the expensive recipes score best, but at most one of them fits the budget
+        weight = np.where(price == 1000, 5, 0).astype(np.int64)
+
+        started = time.perf_counter()
+        rows, score, optimal = mealplan.solve(price, minutes, weight, None, 3, 1002, 1000, 0.05)
+        elapsed = time.perf_counter() - started
+
+        self.assertFalse(optimal)
+        self.assertEqual(score, 5)
+        self.assertLessEqual(price[rows].sum(), 1002)
+        self.assertLess(elapsed, 1)
+
+    def test_bench_mealplan(self):
+        out = StringIO()
+        call_command('bench_mealplan', '--recipes=2000', '--time-limits=10', stdout=out)
+
+        self.assertIn('limit 10 ms: score', out.getvalue())
@@ -0,0 +1,26 @@
+from django.test import SimpleTestCase
+
+from core import minhash
+
+
+class MinHashTests(SimpleTestCase):
+
+    def test_signature_estimates_jaccard(self):
+        """Test the agreement of two signatures approximates Jaccard similarity"""
+        # |A & B| = 60, |A | B| = 140 -> Jaccard 0.43
+        set_a = list(range(0, 100))
+        set_b = list(range(40, 140))
+        sigs = minhash.signatures([set_a, set_b, set_a])
+
+        estimate = minhash.estimate_similarity(sigs[0], sigs[1:])
+
+        self.assertAlmostEqual(estimate[0], 60 / 140, delta=0.15)
+        self.assertEqual(estimate[1], 1.0)
+
+    def test_equal_sets_share_all_band_buckets(self):
+        """Test identical token sets land in the same bucket for every band"""
+        buckets = minhash.band_buckets(minhash.signatures([[1, 2, 3], [3, 2, 1], [7, 8, 9]]))
+
+        self.assertEqual(buckets.shape, (3, minhash.BANDS))
+        self.assertTrue((buckets[0] == buckets[1]).all())
+        self.assertFalse((buckets[0] == buckets[2]).all())
@@ -87,3 +87,47 @@ class ModelTests(TestCase):
         expected_path = f'uploads/images/{uuid}.jpg'
 
         self.assertEqual(file_path, expected_path)
+
+    def test_tag_recipe_count_follows_recipe_tags(self):
+        """Test recipe_count is kept in sync on add, remove, clear and delete"""
+        user = sample_user()
+        tag1 = models.Tag.objects.create(user=user, name='Vegan')
+        tag2 = models.Tag.objects.create(user=user, name='Dessert')
+        recipe1 = models.Recipe.objects.create(user=user, title='Cake', time_minutes=30, price=5.00)
+        recipe2 = models.Recipe.objects.create(user=user, title='Pie', time_minutes=40, price=6.00)
+
+        recipe1.tags.add(tag1, tag2)
+        # adding an already linked tag must not count twice
+        recipe1.tags.add(tag1)
+        # reverse side of the relation is counted as well
+        tag1.recipe_set.add(recipe2)
+        tag1.refresh_from_db()
+        tag2.refresh_from_db()
+        self.assertEqual(tag1.recipe_count, 2)
+        self.assertEqual(tag2.recipe_count, 1)
+
+        recipe1.tags.remove(tag2)
+        recipe2.tags.clear()
+        tag1.refresh_from_db()
+        tag2.refresh_from_db()
+        self.assertEqual(tag1.recipe_count, 1)
+        self.assertEqual(tag2.recipe_count, 0)
+
+        recipe1.delete()
+        tag1.refresh_from_db()
+        self.assertEqual(tag1.recipe_count, 0)
+
+    def test_ingredient_recipe_count_follows_recipe_ingredients(self):
+        """Test recipe_count of ingredients is updated by set() on a recipe"""
+        user = sample_user()
+        ingredient1 = models.Ingredient.objects.create(user=user, name='Salt')
+        ingredient2 = models.Ingredient.objects.create(user=user, name='Sugar')
+        recipe = models.Recipe.objects.create(user=user, title='Cookies', time_minutes=20, price=3.00)
+
+        recipe.ingredients.set([ingredient1])
+        recipe.ingredients.set([ingredient2])
+        ingredient1.refresh_from_db()
+        ingredient2.refresh_from_db()
+
+        self.assertEqual(ingredient1.recipe_count, 0)
+        self.assertEqual(ingredient2.recipe_count, 1)
@@ -0,0 +1,141 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import metrics, ratelimit
+
+RECIPES_URL = reverse('recipe_app:recipe-list')
+TAGS_URL = reverse('recipe_app:tag-list')
+
+# a burst of 3 requests, then one every 100 seconds
+RULES = {'recipe_app:recipe-list': (0.01, 3), 'recipe_app': (100, 100)}
+
+
+@override_settings(RATELIMIT_RULES=RULES)
+class RateLimitTests(TestCase):
+    """Test the token bucket throttle"""
+
+    def setUp(self):
+        ratelimit.reset()
+        metrics.reset()
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_burst_then_throttled(self):
+        """Test requests past the burst get a 429 with Retry-After"""
+        for _ in range(3):
+            self.assertEqual(self.client.get(RECIPES_URL).status_code, status.HTTP_200_OK)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(res['Retry-After']), 90)
+        self.assertEqual(metrics.snapshot()['counters']['ratelimit_rejected_total'], 1)
+
+    def test_buckets_per_user_and_view(self):
+        """Test a throttled client leaves other users and other views alone"""
+        for _ in range(4):
+            self.client.get(RECIPES_URL)
+
+        self.assertEqual(self.client.get(TAGS_URL).status_code, status.HTTP_200_OK)
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user('other@gmail.com', 'password'))
+        self.assertEqual(other.get(RECIPES_URL).status_code, status.HTTP_200_OK)
+
+    def test_tokens_refill(self):
+        """Test the bucket refills with time"""
+        with mock.patch('time.monotonic', return_value=1000.0):
+            for _ in range(4):
+                self.client.get(RECIPES_URL)
+        with mock.patch('time.monotonic', return_value=1100.0):
+            self.assertEqual(self.client.get(RECIPES_URL).status_code, status.HTTP_200_OK)
+
+    @override_settings(RATELIMIT_BACKEND='cache')
+    def test_cache_backend(self):
+        """Test the shared backend limits as well"""
+        statuses = [self.client.get(RECIPES_URL).status_code for _ in range(4)]
+
+        self.assertEqual(statuses[:3], [status.HTTP_200_OK] * 3)
+        self.assertEqual(statuses[3], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_unlisted_views_not_limited(self):
+        """Test views matching no rule are never throttled"""
+        with override_settings(RATELIMIT_RULES={}):
+            for _ in range(10):
+                self.assertEqual(self.client.get(RECIPES_URL).status_code, status.HTTP_200_OK)
+
+    @mock.patch('core.ratelimit.LOCK_STRIPES', 1)
+    def test_idle_buckets_pruned(self):
+        """Test the least recently used buckets are dropped once there are too many"""
+        buckets = ratelimit.LocalBuckets()
+        with override_settings(RATELIMIT_MAX_KEYS=2):
+            buckets.take('recipe_app:tag-list|user:1', 100, 100)
+            buckets.take('recipe_app:tag-list|user:2', 100, 100)
+            # user 1 is the most recent again
+            buckets.take('recipe_app:tag-list|user:1', 100, 100)
+            with mock.patch('time.monotonic', return_value=10 ** 6):
+                buckets.take('recipe_app:tag-list|user:3', 100, 100)
+
+        self.assertEqual(
+            list(buckets.buckets[0]), ['recipe_app:tag-list|user:1', 'recipe_app:tag-list|user:3']
+        )
+
+    @mock.patch('core.ratelimit.LOCK_STRIPES', 1)
+    def test_prune_with_no_idle_bucket(self):
+        """Test the buckets stay bounded when none of them has refilled"""
+        buckets = ratelimit.LocalBuckets()
+        with override_settings(RATELIMIT_MAX_KEYS=100), mock.patch('time.monotonic', return_value=1000.0):
+            for i in range(1000):
+                # empty buckets: none refills before the next request
+                for _ in range(3):
+                    buckets.take(f'recipe_app:recipe-list|user:{i}', 0.01, 3)
+
+        self.assertEqual(len(buckets.buckets[0]), 100)
+        self.assertEqual(next(iter(buckets.buckets[0])), 'recipe_app:recipe-list|user:900')
+
+    def test_buckets_bounded_per_stripe(self):
+        """Test every stripe keeps its share of the keys"""
+        buckets = ratelimit.LocalBuckets()
+        with override_settings(RATELIMIT_MAX_KEYS=10 * ratelimit.LOCK_STRIPES):
+            for i in range(5000):
+                buckets.take(f'recipe_app:recipe-list|user:{i}', 1, 1)
+
+        self.assertEqual([len(stripe) for stripe in buckets.buckets], [10] * ratelimit.LOCK_STRIPES)
+
+
+class InFlightLimitTests(TestCase):
+    """Test the in-flight request limit"""
+
+    def test_busy_worker_sheds(self):
+        """Test requests past the limit get a 503 at once"""
+        metrics.reset()
+        with override_settings(MAX_IN_FLIGHT_REQUESTS=0):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
+        self.assertEqual(metrics.snapshot()['counters']['requests_shed_total'], 1)
+
+    def test_requests_counted_while_served(self):
+        """Test the in-flight count goes back down after a response"""
+        metrics.reset()
+        self.client.get(RECIPES_URL)
+
+        self.assertEqual(metrics.snapshot()['gauges']['requests_in_flight'], 0)
+
+
+class BenchRateLimitCommandTests(TestCase):
+    """Test the bench_ratelimit management command"""
+
+    def test_bench_ratelimit(self):
+        out = StringIO()
+        call_command('bench_ratelimit', '--checks=100', '--clients=10', '--threads=2', stdout=out)
+
+        self.assertIn('us per check', out.getvalue())
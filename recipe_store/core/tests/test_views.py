@@ -0,0 +1,106 @@
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from core import metrics
+
+HASH = 'ab' * 32
+
+
+class ServeMediaTests(TestCase):
+    """Test the media file view"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name, MEDIA_SENDFILE=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.name = f'uploads/images/ab/{HASH}.jpg'
+        os.makedirs(os.path.join(self.media.name, 'uploads/images/ab'))
+        with open(os.path.join(self.media.name, self.name), 'wb') as file:
+            file.write(b'0123456789')
+        self.url = f'/media/{self.name}'
+
+    def test_serve_file_with_cache_headers(self):
+        """Test content addressed files are served immutable with the hash as ETag"""
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), b'0123456789')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['ETag'], f'"{HASH}"')
+        self.assertEqual(res['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+
+    def test_if_none_match_not_modified(self):
+        """Test a matching ETag gets a 304 without body"""
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{HASH}"')
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_range_requests(self):
+        """Test byte ranges are served as partial content"""
+        res = self.client.get(self.url, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), b'234')
+        self.assertEqual(res['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(res['Content-Length'], '3')
+
+        res = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(res.streaming_content), b'789')
+
+        res = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], 'bytes */10')
+
+        # If-Range of another version: the whole file
+        res = self.client.get(self.url, HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"other"')
+        self.assertEqual(res.status_code, 200)
+
+    def test_sendfile_offload(self):
+        """Test offload modes hand the file over to the web server"""
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            res = self.client.get(self.url)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(res.content, b'')
+
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            res = self.client.get(self.url)
+        self.assertEqual(res['X-Sendfile'], os.path.join(self.media.name, self.name))
+        self.assertEqual(res['ETag'], f'"{HASH}"')
+
+    def test_missing_or_outside_files_not_found(self):
+        """Test missing files and paths escaping MEDIA_ROOT are 404"""
+        self.assertEqual(self.client.get('/media/uploads/images/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/uploads/images').status_code, 404)
+
+
+class MetricsViewTests(TestCase):
+    """Test the metrics endpoint"""
+
+    def setUp(self):
+        metrics.reset()
+        metrics.incr('login_success_total', 3)
+        metrics.observe('login_seconds', 0.02)
+
+    def test_metrics_from_allowed_ip(self):
+        """Test the metrics are readable from METRICS_ALLOWED_IPS"""
+        res = self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1')
+
+        self.assertEqual(res.status_code, 200)
+        body = res.content.decode()
+        self.assertIn('login_success_total 3', body)
+        self.assertIn('login_seconds_bucket{le="0.025"} 1', body)
+        self.assertIn('login_seconds_count 1', body)
+
+    def test_metrics_hidden_from_others(self):
+        """Test other hosts get a 404, unless logged in as staff"""
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+        staff = get_user_model().objects.create_superuser('admin@gmail.com', 'password')
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 200)
@@ -0,0 +1,70 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadhandler import (
+    FileUploadHandler, MemoryFileUploadHandler, TemporaryFileUploadHandler,
+)
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Upload handlers that check and hash uploaded files while they stream in.
+# The digest ends up on the uploaded file as .content_hash, where recipe_image_file_path
+# picks it up to name the stored file - no second pass over the bytes.
+
+
+class FileTooLarge(RequestDataTooBig, APIException):
+    """An uploaded file went over FILE_UPLOAD_MAX_SIZE
+    API views answer 413 (APIException), other views 400 (SuspiciousOperation)"""
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file too large.'
+    default_code = 'file_too_large'
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """Abort the upload as soon as a file goes over FILE_UPLOAD_MAX_SIZE
+    First in FILE_UPLOAD_HANDLERS: it only counts and passes the chunks on"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.FILE_UPLOAD_MAX_SIZE:
+            # the rest of the body is never read
+            raise FileTooLarge(f'Uploaded file larger than {settings.FILE_UPLOAD_MAX_SIZE} bytes.')
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class ContentHashMixin:
+    """Compute the sha256 of the chunks this handler stores"""
+
+    def new_file(self, *args, **kwargs):
+        # set before super(): the memory handler raises StopFutureHandlers once it takes the file
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        chunk = super().receive_data_chunk(raw_data, start)
+        if chunk is None:
+            # the chunk was consumed (stored) by this handler
+            self.hasher.update(raw_data)
+        return chunk
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    """Small uploads kept in memory"""
+
+
+class HashingTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    """Large uploads streamed to a temporary file"""
@@ -0,0 +1,145 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from core import metrics as core_metrics
+
+# Media files (recipe images) served with validators, cache headers and byte ranges.
+# With MEDIA_SENDFILE set, the response only carries the headers and tells the web server
+# which file to send (X-Sendfile for Apache/lighttpd, X-Accel-Redirect for nginx), so no
+# image byte goes through Python.
+
+# uploads/images/ab/<sha256>.<ext> - content addressed, see core.storage
+CONTENT_ADDRESSED = re.compile(r'(?:^|/)([0-9a-f]{64})\.[^/]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(path, st):
+    """Strong ETag: the content hash in the name, or the file's identity on disk"""
+    match = CONTENT_ADDRESSED.search(path)
+    if match:
+        return quote_etag(match.group(1))
+    return quote_etag(f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}')
+
+
+def parse_range(header, size):
+    """(start, end) of a single "bytes=" range, end included
+    None when the header is not a single byte range, ValueError when it cannot be satisfied"""
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # malformed, or several ranges: served as a whole, which RFC 7233 allows
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def read_range(file, start, length):
+    """Yield length bytes of file from start, in chunks"""
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file below MEDIA_ROOT"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('File not found')
+
+    etag = file_etag(path, st)
+    immutable = CONTENT_ADDRESSED.search(path) is not None
+    if immutable:
+        # the name changes with the content: cache forever, never revalidate
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+    def add_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(st.st_mtime)
+        response['Cache-Control'] = cache_control
+        return response
+
+    # If-None-Match / If-Modified-Since: 304, If-Match / If-Unmodified-Since: 412
+    response = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if response is not None:
+        return add_headers(response)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if settings.MEDIA_SENDFILE:
+        # the web server sends the bytes, and answers Range requests itself
+        response = HttpResponse(content_type=content_type)
+        if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+        else:
+            response['X-Sendfile'] = full_path
+        return add_headers(response)
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    # If-Range: a range of a different version of the file would be garbage, send it whole
+    if range_header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, st.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{st.st_size}'
+            return add_headers(response)
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        # FileResponse lets the WSGI server use its file wrapper (sendfile) when it has one
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = st.st_size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(file, start, end - start + 1), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Length'] = end - start + 1
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    return add_headers(response)
+
+
+@require_safe
+def metrics(request):
+    """Metrics of this process in the Prometheus text format, for staff or METRICS_ALLOWED_IPS"""
+    user = getattr(request, 'user', None)
+    if not (user and user.is_staff) and request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(core_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
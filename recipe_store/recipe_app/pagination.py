@@ -0,0 +1,104 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Keyset (seek) pagination over the queryset's ordering
+    The cursor holds the ordering values of the last row sent, the next page is
+    "rows after those values" - an index range scan, no OFFSET to skip over.
+    Only used when ?limit= or ?cursor= is given, otherwise the full list is returned."""
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    default_limit = 20
+    max_limit = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def _encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def _decode_cursor(self, cursor):
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _coerce(self, model, ordering, values):
+        """Cursor values as the types of their fields, NotFound for anything else"""
+        coerced = []
+        for field, value in zip(ordering, values):
+            # JSON scalars only, no lists/objects/null; bool is an int to Python
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = model._meta.get_field(field.lstrip('-')).to_python(value)
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            # beyond what the database compares: SQLite integers are 64 bit
+            if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                raise NotFound(self.invalid_cursor_message)
+            if isinstance(value, Decimal) and not value.is_finite():
+                raise NotFound(self.invalid_cursor_message)
+            coerced.append(value)
+        return coerced
+
+    def _after(self, ordering, values):
+        """Q for rows coming after values in the lexicographic ordering
+        (a > x) OR (a = x AND b > y) OR ... for ascending fields, < for descending ones"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = request.query_params.get(self.limit_query_param)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if limit is None and cursor is None:
+            return None
+        try:
+            self.limit = min(max(int(limit or self.default_limit), 1), self.max_limit)
+        except ValueError:
+            self.limit = self.default_limit
+        self.request = request
+        # the view orders by (field, id) so the ordering identifies a row
+        self.ordering = list(queryset.query.order_by)
+        if cursor:
+            values = self._decode_cursor(cursor)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise NotFound(self.invalid_cursor_message)
+            values = self._coerce(queryset.model, self.ordering, values)
+            queryset = queryset.filter(self._after(self.ordering, values))
+        # one extra row tells us whether there is a next page
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = []
+        for field in self.ordering:
+            value = getattr(last, field.lstrip('-'))
+            # Decimal and friends go into the cursor as strings
+            values.append(value if isinstance(value, (int, str)) else str(value))
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self._encode_cursor(values))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -1,6 +1,15 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.translation import ugettext_lazy as _
+from PIL import Image
 from rest_framework import serializers
 from core.models import Tag, Ingredient, Recipe
 
+logger = logging.getLogger(__name__)
+
 # Create a ModelSerializer link this to our model Tag
 
 
@@ -8,34 +17,131 @@ class TagSerializer(serializers.ModelSerializer):
     """Serializer for Tag objects"""
     class Meta:
         model = Tag
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
 
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Serializer for Ingredient Objects"""
     class Meta:
         model = Ingredient
-        fields = ('id', 'name',)
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = ('id', 'recipe_count')
+
+
+class RelatedIdsField(serializers.ManyRelatedField):
+    """List of related ids that also accepts {"add": [...], "remove": [...]}
+    The operation form lets a client change a few links without sending the full list.
+    All ids are resolved with one id__in query limited to the requesting user's rows."""
+    default_error_messages = {
+        'invalid_operation': _('Expected a list of ids or an object with "add" and/or "remove" lists.'),
+        'does_not_exist': _('Invalid pk(s) "{pk_value}" - object does not exist.'),
+    }
+    operations = ('add', 'remove')
+
+    def get_attribute(self, instance):
+        # links just written from a full list are already known, no query needed
+        resolved = instance.__dict__.get('_resolved_related', {}).get(self.field_name)
+        if resolved is not None:
+            return resolved
+        return super().get_attribute(instance)
+
+    def get_queryset(self):
+        """Related objects the request may link to: only the user's own tags/ingredients"""
+        queryset = self.child_relation.get_queryset()
+        request = self.context.get('request')
+        if request is not None:
+            queryset = queryset.filter(user=request.user)
+        return queryset
+
+    def _resolve(self, pks):
+        """Fetch all referenced objects with a single id__in query
+        Ids that do not exist or belong to another user are reported together"""
+        queryset = self.get_queryset()
+        pk_field = queryset.model._meta.pk
+        resolved = []
+        for pk in pks:
+            # to_python() passes None through
+            if pk is None:
+                self.child_relation.fail('null')
+            try:
+                resolved.append(pk_field.to_python(pk))
+            except DjangoValidationError:
+                self.child_relation.fail('incorrect_type', data_type=type(pk).__name__)
+        pks = resolved
+        objects = queryset.in_bulk(set(pks))
+        missing = sorted(set(pk for pk in pks if pk not in objects))
+        if missing:
+            self.fail('does_not_exist', pk_value=', '.join(str(pk) for pk in missing))
+        return pks, objects
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            if not data or set(data) - set(self.operations) or \
+                    not all(isinstance(value, list) for value in data.values()):
+                self.fail('invalid_operation')
+            pks, objects = self._resolve(data.get('add', []) + data.get('remove', []))
+            added = len(data.get('add', []))
+            return {
+                'add': [objects[pk] for pk in pks[:added]],
+                'remove': [objects[pk] for pk in pks[added:]],
+            }
+        # same checks as ManyRelatedField, without its query per id
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pks, objects = self._resolve(data)
+        # de-duplicated, in the order sent
+        return [objects[pk] for pk in dict.fromkeys(pks)]
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for Recipe objects"""
     # Define the PK related fields within our fields for recipe
     # Lists the ingreditents with PK ID and not all details only id
-    ingredients = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Ingredient.objects.all()
+    ingredients = RelatedIdsField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all()
+    tags = RelatedIdsField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all())
     )
+    related_fields = ('ingredients', 'tags')
 
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes', 'price', 'link',)
         read_only_fields = ('id',)
 
+    def _pop_related(self, validated_data):
+        return {name: validated_data.pop(name) for name in self.related_fields if name in validated_data}
+
+    def _save_related(self, recipe, related):
+        """Write tag/ingredient links with the minimal inserts and deletes"""
+        for name, value in related.items():
+            manager = getattr(recipe, name)
+            if isinstance(value, dict):
+                # one DELETE for the removed ids, one INSERT for the ids not linked yet
+                manager.remove(*value['remove'])
+                manager.add(*value['add'])
+            else:
+                # set() diffs against the current links, it does not clear and re-insert
+                manager.set(value)
+                # the resolved objects are the new links: reuse them for the response
+                recipe.__dict__.setdefault('_resolved_related', {})[name] = value
+
+    def create(self, validated_data):
+        related = self._pop_related(validated_data)
+        recipe = super().create(validated_data)
+        self._save_related(recipe, related)
+        return recipe
+
+    def update(self, instance, validated_data):
+        related = self._pop_related(validated_data)
+        recipe = super().update(instance, validated_data)
+        self._save_related(recipe, related)
+        return recipe
+
 
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer a Recipe details"""
@@ -45,10 +151,72 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+class ProbedImageField(serializers.ImageField):
+    """Image field validated from the image header only
+    Django's ImageField has Pillow go through the whole file; format, dimensions and pixel
+    count are all in the header, so a decompression bomb is rejected before it is decoded."""
+    default_error_messages = {
+        'format': _('Unsupported image format {format}, use one of {allowed}.'),
+        'dimensions': _('Image dimensions {width}x{height} exceed {limit} pixels per side.'),
+        'pixels': _('Image has {pixels} pixels, at most {limit} are allowed.'),
+    }
+
+    def to_internal_value(self, data):
+        # FileField checks: an uploaded file, with a name, not empty
+        file_object = serializers.FileField.to_internal_value(self, data)
+        started = time.perf_counter()
+        try:
+            # lazy: reads the header, the pixel data is left alone
+            image = Image.open(file_object)
+            image_format, (width, height) = image.format, image.size
+        except (IOError, SyntaxError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        finally:
+            file_object.seek(0)
+        if image_format not in settings.IMAGE_ALLOWED_FORMATS:
+            self.fail('format', format=image_format, allowed=', '.join(settings.IMAGE_ALLOWED_FORMATS))
+        if max(width, height) > settings.IMAGE_MAX_DIMENSION:
+            self.fail('dimensions', width=width, height=height, limit=settings.IMAGE_MAX_DIMENSION)
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            self.fail('pixels', pixels=width * height, limit=settings.IMAGE_MAX_PIXELS)
+        file_object.image = image
+        file_object.content_type = Image.MIME.get(image_format)
+        logger.info(
+            'Validated %s image %dx%d (%d bytes) in %.2f ms',
+            image_format, width, height, file_object.size, (time.perf_counter() - started) * 1000,
+        )
+        return file_object
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """serializer for uploading images to recipe"""
+    image = ProbedImageField(required=False, allow_null=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class BulkRecipeSerializer(serializers.Serializer):
+    """Recipes a bulk action applies to: the given ids, or without ids the request's filters"""
+    # larger selections go through the filters
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=500
+    )
+
+
+class BulkTagSerializer(BulkRecipeSerializer):
+    """Tags to add to / remove from many recipes: {"tags": {"add": [...], "remove": [...]}}"""
+    tags = RelatedIdsField(child_relation=serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all()))
+
+    def validate_tags(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError(_('Expected {"add": [...], "remove": [...]}.'))
+        return value
+
+
+class MergeRecipesSerializer(serializers.Serializer):
+    """Recipes to merge into the recipe "keep": {"keep": 1, "ids": [2, 3]}"""
+    keep = serializers.IntegerField()
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Recipe, Tag
+
+CHANGES_URL = reverse('recipe_app:change-list')
+
+
+class PublicChangesApiTests(TestCase):
+    """Test the change feed without authentication"""
+
+    def test_login_required(self):
+        res = APIClient().get(CHANGES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateChangesApiTests(TestCase):
+    """Test the change feed of an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com', 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_changes_since_token(self):
+        """Test only objects changed after the token are returned"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.get(CHANGES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([(c['kind'], c['id']) for c in res.data['changes']], [('tag', tag.id)])
+        token = res.data['next']
+
+        recipe = Recipe.objects.create(user=self.user, title='Salad', time_minutes=5, price=4)
+        recipe.tags.add(tag)
+        res = self.client.get(CHANGES_URL, {'since': token})
+
+        changes = {(c['kind'], c['id']): c for c in res.data['changes']}
+        self.assertEqual(set(changes), {('recipe', recipe.id), ('tag', tag.id)})
+        self.assertEqual(changes[('recipe', recipe.id)]['data']['tags'], [tag.id])
+        self.assertEqual(changes[('tag', tag.id)]['data']['recipe_count'], 1)
+
+        res = self.client.get(CHANGES_URL, {'since': res.data['next']})
+        self.assertEqual(res.data['changes'], [])
+
+    def test_deleted_objects_leave_tombstones(self):
+        """Test deletions are reported once per object, without data"""
+        recipe = Recipe.objects.create(user=self.user, title='Salad', time_minutes=5, price=4)
+        recipe.title = 'Green salad'
+        recipe.save()
+        recipe_id = recipe.id
+        recipe.delete()
+
+        res = self.client.get(CHANGES_URL)
+
+        self.assertEqual(res.data['changes'], [
+            {'seq': res.data['changes'][0]['seq'], 'kind': 'recipe', 'id': recipe_id, 'deleted': True}
+        ])
+
+    def test_changes_paginated(self):
+        """Test the feed is read in pages through the next token"""
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+        Tag.objects.create(user=get_user_model().objects.create_user('other@gmail.com', 'pass'), name='Other')
+
+        seen = []
+        params = {'limit': 2}
+        while True:
+            res = self.client.get(CHANGES_URL, params)
+            seen.extend(c['id'] for c in res.data['changes'])
+            if not res.data['has_more']:
+                break
+            params = {'limit': 2, 'since': res.data['next']}
+
+        expected = Tag.objects.filter(user=self.user).order_by('id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_invalid_params(self):
+        """Test a malformed token and a malformed limit are each reported under their own name"""
+        res = self.client.get(CHANGES_URL, {'limit': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(res.data), ['limit'])
+
+        res = self.client.get(CHANGES_URL, {'since': 'x', 'limit': 'y'})
+        self.assertEqual(set(res.data), {'since', 'limit'})
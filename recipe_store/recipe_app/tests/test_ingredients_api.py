@@ -93,6 +93,8 @@ class PrivateIngredientAPITests(TestCase):
             user=self.user
         )
         recipe1.ingredients.add(ingredient1)
+        # recipe_count is updated in the DB by the m2m signal - reload it
+        ingredient1.refresh_from_db()
 
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
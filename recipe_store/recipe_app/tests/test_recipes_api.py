@@ -1,19 +1,31 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from core.models import Recipe, Ingredient, Tag
+from core import jobs, pantry
+from core.models import Recipe, Ingredient, Tag, Change
 from recipe_app.serializers import RecipeSerializer, RecipeDetailSerializer  # , IngredientSerializer
 # image library for python - let's us create test images to upload to api
 from PIL import Image
 # python function allows us to generate temporary files on the system
 import tempfile
+import hashlib
 import os
+import base64
+import json
 
 RECIPES_URL = reverse('recipe_app:recipe-list')
+COOKABLE_URL = reverse('recipe_app:recipe-cookable')
+BULK_DELETE_URL = reverse('recipe_app:recipe-bulk-delete')
+BULK_TAG_URL = reverse('recipe_app:recipe-bulk-tag')
+MEAL_PLAN_URL = reverse('recipe_app:recipe-meal-plan')
+DUPLICATES_URL = reverse('recipe_app:recipe-duplicates')
+MERGE_URL = reverse('recipe_app:recipe-merge')
 
 
 def image_upload_url(recipe_id):
@@ -29,6 +41,11 @@ def recipe_detail_url(recipe_id):
     return reverse('recipe_app:recipe-detail', args=[recipe_id, ])
 
 
+def similar_url(recipe_id):
+    """Return URL for the recipes similar to a recipe"""
+    return reverse('recipe_app:recipe-similar', args=[recipe_id, ])
+
+
 def sample_ingredient(user, name='Chilli Sauce'):
     return Ingredient.objects.create(user=user, name=name)
 
@@ -82,6 +99,8 @@ class PrivateRecipeAPITests(TestCase):
         )
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        # ids are reused once a test is rolled back, indexes of this process would be too
+        pantry.reset()
 
     def test_retrieve_recipe_list_ordered_by_title(self):
         """Test retrieving recipe list ordered by ID for authenticated user only"""
@@ -129,6 +148,41 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
 
+    def test_retrieve_recipes_by_ids(self):
+        """Test ?ids= returns recipe details in the requested order"""
+        new_user = get_user_model().objects.create_user(
+            email='new_user@gmail.com', password='new_user'
+        )
+        recipes = [sample_recipe(user=self.user, title=f'Recipe {i}') for i in range(3)]
+        for recipe in recipes:
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {recipe.id}'))
+            recipe.ingredients.add(sample_ingredient(user=self.user))
+        foreign = sample_recipe(user=new_user)
+        ids = [recipes[2].id, foreign.id, recipes[0].id]
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPES_URL, {'ids': ','.join(str(pk) for pk in ids)})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        serializer = RecipeDetailSerializer([recipes[2], recipes[0]], many=True)
+        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(len(queries), 3)
+
+    def test_retrieve_recipes_by_ids_limit(self):
+        """Test asking for more ids than the cap is a bad request"""
+        with self.settings(RECIPE_BATCH_MAX_IDS=2):
+            res = self.client.get(RECIPES_URL, {'ids': '1,2,3'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_recipes_by_invalid_ids(self):
+        """Test empty, non numeric and out of range ids are a bad request"""
+        for ids in ('', 'a', '1,,2', '99999999999999999999999'):
+            res = self.client.get(RECIPES_URL, {'ids': ids})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, ids)
+            self.assertIn('ids', res.data)
+
     def test_create_basic_recipe(self):
         """Create a basic recipe with required parameters"""
         payload = {
@@ -185,6 +239,39 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(ingredient1, ingreditents)
         self.assertIn(ingredient2, ingreditents)
 
+    def test_create_recipe_with_other_users_tags_fails(self):
+        """Test every foreign or missing tag id is reported in one error"""
+        new_user = get_user_model().objects.create_user(
+            email='new_user@gmail.com', password='new_user'
+        )
+        own_tag = sample_tag(user=self.user)
+        foreign_tag = sample_tag(user=new_user)
+        payload = {
+            'title': 'Cheese Cake',
+            'tags': [own_tag.id, foreign_tag.id, 9999],
+            'time_minutes': 20,
+            'price': 10,
+        }
+
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(f'{foreign_tag.id}, 9999', str(res.data['tags']))
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_tag_queries_do_not_grow_with_tags(self):
+        """Test tag ids are validated and linked with a fixed number of queries"""
+        tags = [sample_tag(user=self.user, name=f'Tag {i}') for i in range(8)]
+
+        def create_with(tag_list):
+            payload = {'title': 'Soup', 'time_minutes': 5, 'price': 2, 'tags': [t.id for t in tag_list]}
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(RECIPES_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(create_with(tags[:2]), create_with(tags))
+
     # PATCH used to update fields that are provided in the payload
     # PUT
     def test_partial_update_recipe(self):
@@ -210,6 +297,41 @@ class PrivateRecipeAPITests(TestCase):
         # Check the new_tag is an entry in the recipe's tags queryset
         self.assertIn(new_tag, tags)
 
+    def test_partial_update_recipe_tag_operations(self):
+        """Test PATCH can add and remove single tags without sending the full list"""
+        recipe = sample_recipe(user=self.user)
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        tag3 = sample_tag(user=self.user, name='Tag 3')
+        ingredient = sample_ingredient(user=self.user)
+        recipe.tags.add(tag1, tag2)
+        recipe.ingredients.add(ingredient)
+        payload = {'tags': {'add': [tag3.id], 'remove': [tag1.id]}}
+
+        res = self.client.patch(recipe_detail_url(recipe.id), payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(recipe.tags.all()), {tag2, tag3})
+        self.assertEqual(sorted(res.data['tags']), sorted([tag2.id, tag3.id]))
+        # fields that were not sent are left alone
+        self.assertEqual(list(recipe.ingredients.all()), [ingredient])
+
+    def test_partial_update_recipe_invalid_operation(self):
+        """Test unknown operations and unknown ids are rejected"""
+        recipe = sample_recipe(user=self.user)
+        url = recipe_detail_url(recipe.id)
+
+        res = self.client.patch(url, {'tags': {'replace': [1]}}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.patch(url, {'tags': {'add': [9999]}}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # not an id at all: rejected before the lookup
+        for bad in (None, 'x', [1]):
+            res = self.client.patch(url, {'tags': [bad, 99999]}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_full_recipe_update(self):
         """Test updating a recipe with PUT request"""
         # Expected: Replace the old recipe obj with new recipe obj
@@ -232,9 +354,308 @@ class PrivateRecipeAPITests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_similar_recipes(self):
+        """Test similar recipes are ranked by shared ingredients and tags"""
+        ingredients = [sample_ingredient(user=self.user, name=f'Ingredient {i}') for i in range(6)]
+        tag = sample_tag(user=self.user)
+        recipe = sample_recipe(user=self.user, title='Pasta')
+        recipe.ingredients.add(*ingredients[:4])
+        recipe.tags.add(tag)
+        close = sample_recipe(user=self.user, title='Pasta again')
+        close.ingredients.add(*ingredients[:4])
+        close.tags.add(tag)
+        partial = sample_recipe(user=self.user, title='Other pasta')
+        partial.ingredients.add(*ingredients[:3], ingredients[4])
+        unrelated = sample_recipe(user=self.user, title='Salad')
+        unrelated.ingredients.add(ingredients[5])
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in res.data]
+        self.assertEqual(ids[0], close.id)
+        self.assertEqual(res.data[0]['similarity'], 1.0)
+        self.assertIn(partial.id, ids)
+        self.assertNotIn(unrelated.id, ids)
+        self.assertNotIn(recipe.id, ids)
+
+    def test_similar_recipes_limit(self):
+        """Test ?limit= must be a number and is at least 1"""
+        ingredient = sample_ingredient(user=self.user)
+        recipe = sample_recipe(user=self.user)
+        for _ in range(3):
+            sample_recipe(user=self.user).ingredients.add(ingredient)
+        recipe.ingredients.add(ingredient)
+
+        res = self.client.get(similar_url(recipe.id), {'limit': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('limit', res.data)
+
+        res = self.client.get(similar_url(recipe.id), {'limit': -1})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+
+    def test_similar_recipes_other_user_not_returned(self):
+        """Test recipes of other users are never returned as similar"""
+        new_user = get_user_model().objects.create_user(
+            email='new_user@gmail.com', password='new_user'
+        )
+        ingredient = sample_ingredient(user=self.user)
+        recipe = sample_recipe(user=self.user)
+        recipe.ingredients.add(ingredient)
+        other = sample_recipe(user=new_user)
+        other.ingredients.add(ingredient)
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [])
+
+    def test_cookable_recipes_with_pantry(self):
+        """Test recipes are matched against the pantry and ranked by missing ingredients"""
+        salt = sample_ingredient(user=self.user, name='Salt')
+        pasta = sample_ingredient(user=self.user, name='Pasta')
+        cheese = sample_ingredient(user=self.user, name='Cheese')
+        eggs = sample_ingredient(user=self.user, name='Eggs')
+        recipe1 = sample_recipe(user=self.user, title='Plain pasta')
+        recipe1.ingredients.add(salt, pasta)
+        recipe2 = sample_recipe(user=self.user, title='Cheesy pasta')
+        recipe2.ingredients.add(salt, pasta, cheese)
+        recipe3 = sample_recipe(user=self.user, title='Omelette')
+        recipe3.ingredients.add(cheese, eggs)
+
+        res = self.client.get(COOKABLE_URL, {'pantry': f'{salt.id},{pasta.id}'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [recipe1.id])
+
+        res = self.client.get(COOKABLE_URL, {'pantry': f'{salt.id},{pasta.id}', 'max_missing': 1})
+        self.assertEqual(
+            [(item['id'], item['missing']) for item in res.data],
+            [(recipe1.id, 0), (recipe2.id, 1)]
+        )
+
+    def test_cookable_recipes_invalid_params(self):
+        """Test non-numeric max_missing and limit are a 400"""
+        for params in ({'max_missing': 'x'}, {'limit': 'x'}):
+            res = self.client.get(COOKABLE_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(next(iter(params)), res.data)
+
+    def test_filter_recipes_by_price_and_time_ordered(self):
+        """Test range filters on price/time_minutes combined with ?ordering="""
+        cheap = sample_recipe(user=self.user, title='Cheap', price=4.00, time_minutes=10)
+        cheaper = sample_recipe(user=self.user, title='Cheaper', price=2.00, time_minutes=20)
+        sample_recipe(user=self.user, title='Expensive', price=25.00, time_minutes=10)
+        sample_recipe(user=self.user, title='Slow', price=3.00, time_minutes=90)
+
+        res = self.client.get(RECIPES_URL, {
+            'price__lte': '10', 'time_minutes__lte': 30, 'ordering': 'price'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [cheaper.id, cheap.id])
+
+    def test_filter_recipes_invalid_number(self):
+        """Test a non numeric range filter is a bad request"""
+        res = self.client.get(RECIPES_URL, {'price__lte': 'cheap'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recipes_keyset_pagination(self):
+        """Test ?limit= pages follow the ordering without gaps or repeats"""
+        tag = sample_tag(user=self.user)
+        recipes = []
+        for i, price in enumerate([5, 1, 3, 3, 2]):
+            recipe = sample_recipe(user=self.user, title=f'Recipe {i}', price=price)
+            recipe.tags.add(tag)
+            recipes.append(recipe)
+        expected = [r.id for r in sorted(recipes, key=lambda r: (r.price, r.id))]
+
+        seen = []
+        url = RECIPES_URL
+        params = {'ordering': 'price', 'tags': f'{tag.id}', 'limit': 2}
+        while url:
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen.extend(item['id'] for item in res.data['results'])
+            url, params = res.data['next'], None
+
+        self.assertEqual(seen, expected)
+
+    def test_recipes_invalid_cursor(self):
+        """Test cursors with values of the wrong type are a 404, not a server error"""
+        sample_recipe(user=self.user)
+
+        def cursor(values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        for params in (
+            {'cursor': cursor(['x'])},
+            {'cursor': cursor([{'a': 1}])},
+            {'cursor': cursor([None])},
+            {'cursor': cursor([10 ** 23])},
+            {'cursor': cursor(['abc', 1]), 'ordering': 'price'},
+            {'cursor': cursor(['NaN', 1]), 'ordering': 'price'},
+        ):
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND, params)
+
+    def test_bulk_delete_recipes_by_ids(self):
+        """Test only the user's recipes among the ids are deleted, counters follow"""
+        tag = sample_tag(user=self.user)
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe3 = sample_recipe(user=self.user)
+        for recipe in (recipe1, recipe2, recipe3):
+            recipe.tags.add(tag)
+        other_user = get_user_model().objects.create_user('other@gmail.com', 'password')
+        other = sample_recipe(user=other_user)
+
+        res = self.client.post(BULK_DELETE_URL, {'ids': [recipe1.id, recipe2.id, other.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'deleted': 2})
+        self.assertEqual(list(Recipe.objects.filter(user=self.user)), [recipe3])
+        self.assertTrue(Recipe.objects.filter(pk=other.id).exists())
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 1)
+
+    def test_bulk_delete_recipes_by_filter(self):
+        """Test the list filters select the recipes to delete, and are required without ids"""
+        tag = sample_tag(user=self.user)
+        tagged = sample_recipe(user=self.user)
+        tagged.tags.add(tag)
+        untagged = sample_recipe(user=self.user)
+
+        res = self.client.post(BULK_DELETE_URL, {}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(f'{BULK_DELETE_URL}?tags={tag.id}', {}, format='json')
+        self.assertEqual(res.data, {'deleted': 1})
+        self.assertEqual(list(Recipe.objects.all()), [untagged])
+
+    def test_bulk_tag_recipes(self):
+        """Test tags are added and removed on many recipes, with the counts returned"""
+        vegan = sample_tag(user=self.user, name='Vegan')
+        quick = sample_tag(user=self.user, name='Quick')
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe1.tags.add(vegan, quick)
+
+        res = self.client.post(BULK_TAG_URL, {
+            'ids': [recipe1.id, recipe2.id],
+            'tags': {'add': [vegan.id], 'remove': [quick.id]},
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'added': 1, 'removed': 1, 'recipes': 2})
+        self.assertEqual(list(recipe1.tags.all()), [vegan])
+        self.assertEqual(list(recipe2.tags.all()), [vegan])
+        vegan.refresh_from_db()
+        quick.refresh_from_db()
+        self.assertEqual((vegan.recipe_count, quick.recipe_count), (2, 0))
+
+    def test_bulk_tag_duplicate_tags(self):
+        """Test a tag given twice is added once, and only the tags changed go to the change feed"""
+        vegan = sample_tag(user=self.user, name='Vegan')
+        quick = sample_tag(user=self.user, name='Quick')
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(quick)
+        Change.objects.all().delete()
+
+        res = self.client.post(BULK_TAG_URL, {
+            'ids': [recipe.id, recipe.id],
+            'tags': {'add': [vegan.id, vegan.id, quick.id]},
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'added': 1, 'removed': 0, 'recipes': 1})
+        vegan.refresh_from_db()
+        self.assertEqual(vegan.recipe_count, 1)
+        tag_changes = Change.objects.filter(kind=Change.KIND_TAG).values_list('object_id', flat=True)
+        self.assertEqual(list(tag_changes), [vegan.id])
+
+    def test_bulk_tag_too_many_ids(self):
+        """Test more than 500 ids are rejected"""
+        tag = sample_tag(user=self.user)
+
+        res = self.client.post(BULK_TAG_URL, {
+            'ids': list(range(1, 502)), 'tags': {'add': [tag.id]},
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', res.data)
+
+    def test_bulk_tag_other_users_tag_rejected(self):
+        """Test tags of another user cannot be added"""
+        other_user = get_user_model().objects.create_user('other@gmail.com', 'password')
+        tag = sample_tag(user=other_user)
+        recipe = sample_recipe(user=self.user)
+
+        res = self.client.post(BULK_TAG_URL, {'ids': [recipe.id], 'tags': {'add': [tag.id]}}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(recipe.tags.exists())
+
+
+class CookableRecipesCommitTests(TransactionTestCase):
+    """Test the pantry index follows committed changes - TestCase never commits"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='testrecipe@gmail.com',
+            password='testrecipe',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        pantry.reset()
+
+    def test_cookable_recipes_follow_recipe_changes(self):
+        """Test the pantry index picks up ingredient changes and deletions"""
+        salt = sample_ingredient(user=self.user, name='Salt')
+        pepper = sample_ingredient(user=self.user, name='Pepper')
+        recipe1 = sample_recipe(user=self.user, title='Recipe 1')
+        recipe1.ingredients.add(salt)
+        recipe2 = sample_recipe(user=self.user, title='Recipe 2')
+        recipe2.ingredients.add(salt)
+        params = {'pantry': f'{salt.id}'}
+        res = self.client.get(COOKABLE_URL, params)
+        self.assertEqual(len(res.data), 2)
+
+        recipe1.ingredients.add(pepper)
+        recipe2.delete()
+        res = self.client.get(COOKABLE_URL, params)
+
+        self.assertEqual(res.data, [])
+
+    def test_cookable_recipes_invalidated_on_commit(self):
+        """Test a change marks the index dirty only once it is committed"""
+        salt = sample_ingredient(user=self.user, name='Salt')
+        pepper = sample_ingredient(user=self.user, name='Pepper')
+        recipe = sample_recipe(user=self.user)
+        recipe.ingredients.add(salt)
+        params = {'pantry': f'{salt.id}'}
+        self.assertEqual(len(self.client.get(COOKABLE_URL, params).data), 1)
+        index = pantry.get_index(self.user.pk)
+
+        with transaction.atomic():
+            recipe.ingredients.add(pepper)
+            # a refresh here, by another request, reads the rows before the change
+            self.assertEqual(index.dirty, set())
+        self.assertEqual(index.dirty, {recipe.pk})
+
+        self.assertEqual(self.client.get(COOKABLE_URL, params).data, [])
+
 
 class RecipeImageUploadTests(TestCase):
     def setUp(self):
+        # uploads go to a directory of their own, removed with the files left in it
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             email='testrecipeimage@gmail.com',
@@ -274,6 +695,36 @@ class RecipeImageUploadTests(TestCase):
         res = self.client.post(url, {'image': 'notimage'}, format='multipart')
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def post_image(self, size=(10, 10), image_format='JPEG'):
+        with tempfile.NamedTemporaryFile(suffix='.img') as ntf:
+            Image.new('RGB', size).save(ntf, format=image_format)
+            ntf.seek(0)
+            return self.client.post(image_upload_url(self.recipe.id), {'image': ntf}, format='multipart')
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=100)
+    def test_upload_image_too_large(self):
+        """Test files over the upload size limit are rejected while streaming"""
+        res = self.post_image(size=(100, 100), image_format='PNG')
+
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(IMAGE_MAX_PIXELS=50)
+    def test_upload_image_too_many_pixels(self):
+        """Test images are rejected on the pixel count of their header"""
+        res = self.post_image()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('100 pixels', res.data['image'][0])
+
+    def test_upload_image_unsupported_format(self):
+        """Test images in formats outside IMAGE_ALLOWED_FORMATS are rejected"""
+        res = self.post_image(image_format='BMP')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('BMP', res.data['image'][0])
+
     def test_filter_recipes_by_tags(self):
         """Test returning recieps with specific tags"""
         recipe1 = sample_recipe(user=self.user, title="Recipe 1")
@@ -318,3 +769,224 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+
+class RecipeImageStorageTests(TestCase):
+    """Content addressed image storage"""
+
+    def setUp(self):
+        # uploads go to a directory of their own, removed with the files left in it
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('testimagestore@gmail.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, recipe, color):
+        with tempfile.NamedTemporaryFile(suffix='.JPG') as ntf:
+            Image.new('RGB', (10, 10), color).save(ntf, format='JPEG')
+            ntf.seek(0)
+            content_hash = hashlib.sha256(ntf.read()).hexdigest()
+            ntf.seek(0)
+            res = self.client.post(image_upload_url(recipe.id), {'image': ntf}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        return content_hash
+
+    def test_same_image_stored_once(self):
+        """Test the same picture uploaded for two recipes shares one file named by its hash"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+
+        content_hash = self.upload(recipe1, 'red')
+        self.upload(recipe2, 'red')
+
+        self.assertEqual(recipe1.image.name, f'uploads/images/{content_hash[:2]}/{content_hash}.jpg')
+        self.assertEqual(recipe2.image.name, recipe1.image.name)
+        self.assertTrue(os.path.exists(recipe1.image.path))
+        path = recipe1.image.path
+        self.assertEqual(os.listdir(os.path.dirname(path)).count(os.path.basename(path)), 1)
+
+        # the file goes with the last recipe referring to it
+        recipe1.delete()
+        jobs.run_pending()
+        self.assertTrue(os.path.exists(path))
+        recipe2.delete()
+        jobs.run_pending()
+        self.assertFalse(os.path.exists(path))
+
+    def test_image_saved_again_after_release_kept(self):
+        """Test a file saved again after its release survives the delete job
+        The recipe of the new upload may not be committed when the job runs"""
+        recipe = sample_recipe(user=self.user)
+        self.upload(recipe, 'red')
+        name, path = recipe.image.name, recipe.image.path
+        recipe.delete()
+
+        with open(path, 'rb') as file:
+            recipe.image.storage.save(name, file)
+        jobs.run_pending()
+
+        self.assertTrue(os.path.exists(path))
+
+    def test_replaced_image_released(self):
+        """Test uploading a new image deletes the old file when nothing else uses it"""
+        recipe = sample_recipe(user=self.user)
+        self.upload(recipe, 'green')
+        old_path = recipe.image.path
+
+        self.upload(recipe, 'blue')
+        # files are deleted by a background job
+        jobs.run_pending()
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+
+class MealPlanApiTests(TestCase):
+    """Test the meal plan action"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.vegan = sample_tag(self.user, 'Vegan')
+        self.quick = sample_tag(self.user, 'Quick')
+        self.spicy = sample_tag(self.user, 'Spicy')
+
+    def recipe(self, title, price, time_minutes, *tags):
+        recipe = sample_recipe(self.user, title=title, price=price, time_minutes=time_minutes)
+        recipe.tags.add(*tags)
+        return recipe
+
+    def test_plan_maximizes_tag_diversity(self):
+        """Test the plan covering the most tags within budget and time is picked"""
+        self.recipe('Salad', 5, 10, self.vegan, self.quick)
+        self.recipe('Vegan curry', 6, 40, self.vegan)
+        self.recipe('Chilli', 7, 30, self.spicy)
+        self.recipe('Lobster', 50, 30, self.spicy, self.quick, self.vegan)
+
+        res = self.client.get(MEAL_PLAN_URL, {'count': 2, 'budget': 15, 'max_time': 60})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(recipe['title'] for recipe in res.data['recipes']), ['Chilli', 'Salad'])
+        self.assertEqual(res.data['score'], 3)
+        self.assertEqual(res.data['total_price'], '12.00')
+        self.assertEqual(res.data['total_time_minutes'], 40)
+        self.assertTrue(res.data['optimal'])
+
+    def test_plan_with_preferred_tags(self):
+        """Test ?prefer= maximizes the recipes with the preferred tags instead"""
+        self.recipe('Salad', 5, 10, self.vegan, self.quick)
+        self.recipe('Vegan curry', 6, 40, self.vegan)
+        self.recipe('Chilli', 7, 30, self.spicy)
+
+        res = self.client.get(MEAL_PLAN_URL, {
+            'count': 2, 'budget': 15, 'max_time': 60, 'prefer': f'{self.vegan.id}',
+        })
+
+        self.assertEqual(sorted(recipe['title'] for recipe in res.data['recipes']), ['Salad', 'Vegan curry'])
+        self.assertEqual(res.data['score'], 2)
+
+    def test_no_plan_fits(self):
+        """Test an empty plan when no recipes fit the budget"""
+        self.recipe('Lobster', 50, 30, self.spicy)
+
+        res = self.client.get(MEAL_PLAN_URL, {'count': 1, 'budget': 10, 'max_time': 60})
+
+        self.assertEqual(res.data['recipes'], [])
+        self.assertTrue(res.data['optimal'])
+
+    def test_other_users_recipes_not_planned(self):
+        """Test only the user's own recipes are picked"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'password')
+        sample_recipe(other, title='Theirs', price=1, time_minutes=1)
+
+        res = self.client.get(MEAL_PLAN_URL, {'count': 1, 'budget': 10, 'max_time': 60})
+
+        self.assertEqual(res.data['recipes'], [])
+
+    def test_invalid_params(self):
+        """Test missing or malformed parameters are a 400"""
+        invalid = (
+            {'budget': 10}, {'budget': 'x', 'max_time': 10}, {'budget': 10, 'max_time': 10, 'count': 0},
+            {'budget': 'NaN', 'max_time': 10}, {'budget': 'Infinity', 'max_time': 10},
+            {'budget': -1, 'max_time': 10}, {'budget': 10, 'max_time': -1},
+        )
+        for params in invalid:
+            res = self.client.get(MEAL_PLAN_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_huge_budget_and_time(self):
+        """Test limits far beyond any recipe box still plan"""
+        self.recipe('Salad', 5, 10, self.vegan)
+
+        res = self.client.get(MEAL_PLAN_URL, {'count': 1, 'budget': '1e30', 'max_time': 10 ** 30})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['total_price'], '5.00')
+
+
+class DuplicateRecipesApiTests(TestCase):
+    """Test finding and merging duplicate recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.egg = sample_ingredient(self.user, 'Egg')
+        self.salt = sample_ingredient(self.user, 'Salt')
+        self.breakfast = sample_tag(self.user, 'Breakfast')
+        self.quick = sample_tag(self.user, 'Quick')
+
+    def test_scan_and_list_duplicates(self):
+        """Test POST queues the scan and GET lists the groups it found"""
+        first = sample_recipe(self.user, title='Omelette')
+        second = sample_recipe(self.user, title='omelette.')
+        sample_recipe(self.user, title='Pancakes')
+
+        res = self.client.post(DUPLICATES_URL)
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        jobs.run_pending()
+
+        res = self.client.get(DUPLICATES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([[recipe['id'] for recipe in group] for group in res.data['groups']],
+                         [[first.id, second.id]])
+
+    def test_merge_moves_links_and_deletes(self):
+        """Test the links of the merged recipes move to the kept one"""
+        keep = sample_recipe(self.user, title='Omelette')
+        keep.tags.add(self.breakfast)
+        keep.ingredients.add(self.egg)
+        duplicate = sample_recipe(self.user, title='Omelette')
+        duplicate.tags.add(self.breakfast, self.quick)
+        duplicate.ingredients.add(self.egg, self.salt)
+
+        res = self.client.post(MERGE_URL, {'keep': keep.id, 'ids': [duplicate.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'merged': 1, 'tags_added': 1, 'ingredients_added': 1})
+        self.assertFalse(Recipe.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(set(keep.tags.all()), {self.breakfast, self.quick})
+        self.assertEqual(set(keep.ingredients.all()), {self.egg, self.salt})
+        # recipe counters follow the links
+        for attr, count in ((self.breakfast, 1), (self.quick, 1), (self.egg, 1), (self.salt, 1)):
+            attr.refresh_from_db()
+            self.assertEqual(attr.recipe_count, count)
+
+    def test_merge_other_users_recipes_rejected(self):
+        """Test recipes of other users are neither kept nor merged"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'password')
+        theirs = sample_recipe(other, title='Omelette')
+        mine = sample_recipe(self.user, title='Omelette')
+
+        res = self.client.post(MERGE_URL, {'keep': theirs.id, 'ids': [mine.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(MERGE_URL, {'keep': mine.id, 'ids': [theirs.id]}, format='json')
+        self.assertEqual(res.data['merged'], 0)
+        self.assertTrue(Recipe.objects.filter(pk=theirs.pk).exists())
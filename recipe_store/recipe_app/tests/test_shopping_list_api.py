@@ -0,0 +1,111 @@
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import shopping
+from core.models import Ingredient, Recipe
+
+SHOPPING_LIST_URL = reverse('recipe_app:shopping-list-list')
+
+
+def shopping_list_url(recipes):
+    return f'{SHOPPING_LIST_URL}?recipes={",".join(str(recipe.id) for recipe in recipes)}'
+
+
+class PublicShoppingListApiTests(TestCase):
+    """Test the unauthenticated shopping list API"""
+
+    def test_login_required(self):
+        res = APIClient().get(SHOPPING_LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateShoppingListApiTests(TestCase):
+    """Test the shopping list of the authenticated user's recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@gmail.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.egg = Ingredient.objects.create(user=self.user, name='Egg')
+        self.flour = Ingredient.objects.create(user=self.user, name='Flour')
+
+    def recipe(self, *ingredients, user=None):
+        recipe = Recipe.objects.create(user=user or self.user, title='Recipe', time_minutes=5, price=2)
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def test_ingredients_merged_with_counts(self):
+        """Test every ingredient is listed once, with the number of recipes using it"""
+        omelette = self.recipe(self.egg, self.salt)
+        bread = self.recipe(self.flour, self.salt)
+        self.recipe(self.egg)  # not asked for
+
+        with self.assertNumQueries(1):
+            res = self.client.get(shopping_list_url([omelette, bread]))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['ingredients'], [
+            {'id': self.egg.id, 'name': 'Egg', 'recipes': 1},
+            {'id': self.flour.id, 'name': 'Flour', 'recipes': 1},
+            {'id': self.salt.id, 'name': 'Salt', 'recipes': 2},
+        ])
+
+    def test_other_users_recipes_ignored(self):
+        """Test recipes of other users add nothing"""
+        other = get_user_model().objects.create_user('other@gmail.com', 'password')
+        theirs = self.recipe(Ingredient.objects.create(user=other, name='Caviar'), user=other)
+        mine = self.recipe(self.egg)
+
+        res = self.client.get(shopping_list_url([mine, theirs]))
+
+        self.assertEqual([item['name'] for item in res.data['ingredients']], ['Egg'])
+
+    def test_invalid_recipes_param(self):
+        """Test a missing or malformed ?recipes= is a 400"""
+        self.assertEqual(self.client.get(SHOPPING_LIST_URL).status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(f'{SHOPPING_LIST_URL}?recipes=1,x')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        # past the 64 bit ids of the database
+        res = self.client.get(f'{SHOPPING_LIST_URL}?recipes=99999999999999999999999')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('recipes', res.data)
+
+    @override_settings(SHOPPING_LIST_STREAM_AFTER=1)
+    def test_large_selection_streamed(self):
+        """Test a large selection is streamed with the same content"""
+        recipes = [self.recipe(self.egg, self.salt), self.recipe(self.salt)]
+
+        res = self.client.get(shopping_list_url(recipes))
+
+        self.assertTrue(res.streaming)
+        data = json.loads(b''.join(res.streaming_content))
+        self.assertEqual(data['ingredients'], [
+            {'id': self.egg.id, 'name': 'Egg', 'recipes': 1},
+            {'id': self.salt.id, 'name': 'Salt', 'recipes': 2},
+        ])
+
+    def test_counts_merged_across_chunks(self):
+        """Test selections above one query's worth of ids add up the chunks"""
+        # a second ingredient named Salt stays apart from the first
+        other_salt = Ingredient.objects.create(user=self.user, name='Salt')
+        recipes = [
+            self.recipe(self.salt), self.recipe(self.salt, self.egg), self.recipe(self.egg, other_salt),
+            self.recipe(self.flour), self.recipe(other_salt),
+        ]
+        ids = [recipe.id for recipe in recipes]
+        expected = list(shopping.ingredient_counts(self.user.id, ids))
+
+        with mock.patch.object(shopping, 'CHUNK_SIZE', 2):
+            self.assertEqual(list(shopping.ingredient_counts(self.user.id, ids)), expected)
+        self.assertEqual(expected, [
+            (self.egg.id, 'Egg', 2), (self.flour.id, 'Flour', 1),
+            (self.salt.id, 'Salt', 2), (other_salt.id, 'Salt', 2),
+        ])
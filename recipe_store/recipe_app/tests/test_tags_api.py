@@ -1,12 +1,13 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 from core.models import Tag, Recipe
 from recipe_app.serializers import TagSerializer
 
 TAGS_URL = reverse('recipe_app:tag-list')
+AUTOCOMPLETE_URL = reverse('recipe_app:tag-autocomplete')
 
 
 class PublicTagsApiTests(TestCase):
@@ -96,6 +97,8 @@ class PrivateTagsApiTests(TestCase):
         )
 
         recipe.tags.add(tag1)
+        # recipe_count is updated in the DB by the m2m signal - reload it
+        tag1.refresh_from_db()
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
@@ -126,3 +129,75 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
         self.assertEqual(len(res.data), 1)
+
+    def test_retrieve_tags_ordered_by_recipe_count(self):
+        """Test ordering tags by popularity with ?ordering=-recipe_count"""
+        tag1 = Tag.objects.create(user=self.user, name='Rare')
+        tag2 = Tag.objects.create(user=self.user, name='Popular')
+        for title in ('Recipe 1', 'Recipe 2'):
+            recipe = Recipe.objects.create(
+                title=title,
+                time_minutes=5,
+                price=5.00,
+                user=self.user
+            )
+            recipe.tags.add(tag2)
+        recipe.tags.add(tag1)
+
+        res = self.client.get(TAGS_URL, {'ordering': '-recipe_count'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag['id'] for tag in res.data], [tag2.id, tag1.id])
+        self.assertEqual(res.data[0]['recipe_count'], 2)
+
+    def test_autocomplete_tags_by_prefix(self):
+        """Test autocomplete matches the prefix case-insensitively, most used first"""
+        Tag.objects.create(user=self.user, name='Vegetarian')
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        recipe = Recipe.objects.create(
+            title='Recipe 1',
+            time_minutes=5,
+            price=5.00,
+            user=self.user
+        )
+        recipe.tags.add(vegan)
+        new_user = get_user_model().objects.create_user(
+            'new_user@gmail.com', 'new_password',
+        )
+        Tag.objects.create(user=new_user, name='Vegan Dessert')
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'VEG'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag['name'] for tag in res.data], ['Vegan', 'Vegetarian'])
+
+    def test_autocomplete_tags_limit(self):
+        """Test autocomplete returns at most limit names"""
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'tag', 'limit': 3})
+
+        self.assertEqual(len(res.data), 3)
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'tag', 'limit': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['limit'], ['A valid number is required.'])
+
+    @override_settings(AUTOCOMPLETE_CANDIDATES=2)
+    def test_autocomplete_ranks_first_candidates(self):
+        """Test only the first names with the prefix are ranked, all names without one"""
+        Tag.objects.create(user=self.user, name='Veg A')
+        tag_b = Tag.objects.create(user=self.user, name='Veg B')
+        tag_c = Tag.objects.create(user=self.user, name='Veg C')
+        recipe = Recipe.objects.create(title='Recipe 1', time_minutes=5, price=5.00, user=self.user)
+        recipe.tags.add(tag_b, tag_c)
+        recipe = Recipe.objects.create(title='Recipe 2', time_minutes=5, price=5.00, user=self.user)
+        recipe.tags.add(tag_c)
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'veg'})
+        self.assertEqual([tag['name'] for tag in res.data], ['Veg B', 'Veg A'])
+
+        res = self.client.get(AUTOCOMPLETE_URL)
+        self.assertEqual([tag['name'] for tag in res.data], ['Veg C', 'Veg B', 'Veg A'])
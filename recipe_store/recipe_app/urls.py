@@ -9,6 +9,8 @@ router = DefaultRouter()
 router.register('tags', views.TagViewSet)  # Register TagViewSetas tags with router
 router.register('ingredients', views.IngredientViewSet)
 router.register('recipes', views.RecipeViewSet)
+router.register('changes', views.ChangeFeedViewSet, basename='change')
+router.register('shopping-list', views.ShoppingListViewSet, basename='shopping-list')
 
 app_name = 'recipe_app'
 
@@ -1,8 +1,17 @@
+import json
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import ValidationError
+from user.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from core.models import Tag, Ingredient, Recipe
+from core.models import Tag, Ingredient, Recipe, Change
+from core import bulk, dedupe, jobs, mealplan, minhash, pantry, shopping
 from recipe_app import serializers
+from recipe_app.pagination import KeysetPagination
 # add custome action to viewset
 from rest_framework.decorators import action
 # to return custom response
@@ -10,12 +19,33 @@ from rest_framework.response import Response
 # Mixis help customise the List/Create fucnionality available with viewsets
 
 
+# _before_function_name(): intended to be private
+def _params_to_ints(qs):
+    """Convert a comma separated list of string IDs to a list of Integers"""
+    # int('') fails too: empty items are a ValueError
+    ids = [int(str_id) for str_id in qs.split(',')]
+    # the database stores 64 bit integers, SQLite cannot even compare bigger ones
+    if any(not -2 ** 63 <= pk < 2 ** 63 for pk in ids):
+        raise ValueError('id out of range')
+    return ids
+
+
+def _param_to_number(name, value, cast):
+    """Parse a numeric query parameter, a bad value is a 400 not a 500"""
+    try:
+        return cast(value)
+    except (ValueError, InvalidOperation):
+        raise ValidationError({name: ['A valid number is required.']})
+
+
 class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     """Base ViewSet for user owned recipe attributes: Tag and Ingredient"""
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    # ?ordering= values accepted, anything else falls back to the default '-name'
+    ordering_fields = ('name', '-name', 'recipe_count', '-recipe_count')
 
     def get_queryset(self):
         """Return tags for current authenticated user only
@@ -24,15 +54,39 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
-        queryset = self.queryset
+        ordering = self.request.query_params.get('ordering', '-name')
+        if ordering not in self.ordering_fields:
+            ordering = '-name'
+        queryset = self.queryset.filter(user=self.request.user)
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            # recipe_count is kept up to date by core.signals - no join on the recipe table needed
+            queryset = queryset.filter(recipe_count__gt=0)
 
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()
+        return queryset.order_by(ordering, '-name')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    # USE url recipe/tags/autocomplete/?prefix=ve&limit=10
+    @action(methods=['GET'], detail=False, url_path='autocomplete')
+    def autocomplete(self, request):
+        """Return the most used names starting with ?prefix=, case-insensitive"""
+        limit = min(max(_param_to_number('limit', request.query_params.get('limit', 10), int), 1), 50)
+        prefix = request.query_params.get('prefix', '')
+        queryset = self.queryset.filter(user=request.user)
+        if prefix:
+            # The (user, search_name) index finds the names with the prefix in name order, not
+            # in recipe_count order: only the first AUTOCOMPLETE_CANDIDATES of them are ranked,
+            # whatever the number of names of the user. A popular name further down is missed
+            # for a short prefix and found as the user types on.
+            candidates = queryset.prefix(prefix).order_by('search_name')[:settings.AUTOCOMPLETE_CANDIDATES]
+            queryset = sorted(candidates, key=lambda attr: (-attr.recipe_count, attr.search_name))[:limit]
+        else:
+            # in (user, -recipe_count) index order
+            queryset = queryset.order_by('-recipe_count', 'search_name')[:limit]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """Manage tags in the database"""
@@ -51,31 +105,77 @@ class RecipeViewSet(viewsets.ModelViewSet, mixins.ListModelMixin):
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.RecipeSerializer
+    # keyset pages with ?limit=&cursor=, plain list without them
+    pagination_class = KeysetPagination
 
     queryset = Recipe.objects.all()
+    # ?ordering= values accepted (prefix with - for descending), each backed by a (user, field, id) index
+    ordering_fields = ('id', 'title', 'time_minutes', 'price')
+    # ?<field>__lte= and ?<field>__gte= filters with the type their value is parsed as
+    range_filters = {'time_minutes': int, 'price': Decimal}
 
-    # _before_function_name(): intended to be private
-    def _params_to_ints(self, qs):
-        """Convert a comma separated list of string IDs to a list of Integers"""
-        return [int(str_id) for str_id in qs.split(',')]
+    def _get_ordering(self):
+        """Return order_by() fields for ?ordering=, always ending with the id tie breaker"""
+        ordering = self.request.query_params.get('ordering', '-id')
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            return ('-id',)
+        if field == 'id':
+            return (ordering,)
+        # tie breaker in the same direction - one range scan of the (user, field, id) index
+        return (ordering, '-id' if ordering.startswith('-') else 'id')
 
     def get_queryset(self):
         """Retrieve the recipes for the authenticated user"""
         # Retrieve get parameters from request is query_params dictionary
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
-        queryset = self.queryset
+        queryset = self.queryset.filter(user=self.request.user)
         # if tags list is not null, then convert the list to IDs
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            # tags__id__in : __ django syntax for filtering foreign key objects
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            tag_ids = _params_to_ints(tags)
+            # id IN (subquery on the through table) instead of a join: no duplicates,
+            # so no DISTINCT, and the ordering index stays usable
+            queryset = queryset.filter(
+                id__in=Recipe.tags.through.objects.filter(tag_id__in=tag_ids).values('recipe_id')
+            )
 
         if ingredients:
-            ingredients_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredients_ids)
-        # adding. distinct() to return unique recipes only
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+            ingredients_ids = _params_to_ints(ingredients)
+            queryset = queryset.filter(
+                id__in=Recipe.ingredients.through.objects.filter(
+                    ingredient_id__in=ingredients_ids
+                ).values('recipe_id')
+            )
+
+        for field, cast in self.range_filters.items():
+            for lookup in ('lte', 'gte'):
+                name = f'{field}__{lookup}'
+                value = self.request.query_params.get(name)
+                if value:
+                    queryset = queryset.filter(**{name: _param_to_number(name, value, cast)})
+
+        if self.action == 'list':
+            # one query each for all tags and ingredients of the page, not one per recipe
+            queryset = queryset.prefetch_related('tags', 'ingredients')
+        return queryset.order_by(*self._get_ordering())
+
+    def list(self, request, *args, **kwargs):
+        """List recipes, or with ?ids=1,5,9 the details of those recipes in that order"""
+        ids = request.query_params.get('ids')
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+        recipe_ids = _param_to_number('ids', ids, _params_to_ints)
+        if len(recipe_ids) > settings.RECIPE_BATCH_MAX_IDS:
+            raise ValidationError({'ids': [f'At most {settings.RECIPE_BATCH_MAX_IDS} ids per request.']})
+        # three queries whatever the number of ids: recipes, their tags, their ingredients
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        # requested order, duplicates and unknown/foreign ids dropped
+        found = [recipes[pk] for pk in dict.fromkeys(recipe_ids) if pk in recipes]
+        serializer = serializers.RecipeDetailSerializer(
+            found, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
@@ -116,6 +216,248 @@ class RecipeViewSet(viewsets.ModelViewSet, mixins.ListModelMixin):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    # USE url recipe/{id}/similar/?limit=10
+    @action(methods=['GET'], detail=True, url_path='similar')
+    def similar(self, request, pk=None):
+        """List the user's recipes most similar to this one by ingredients and tags"""
+        recipe = self.get_object()
+        limit = _param_to_number('limit', request.query_params.get('limit', 10), int)
+        limit = min(max(limit, 1), 100)
+        # LSH candidates ranked by estimated Jaccard similarity, see core.minhash
+        ranked = minhash.similar_recipes(recipe, limit)
+        recipes = Recipe.objects.filter(user=request.user, pk__in=[pk for pk, _ in ranked]).in_bulk()
+        data = []
+        for recipe_id, similarity in ranked:
+            if recipe_id in recipes:
+                item = self.get_serializer(recipes[recipe_id]).data
+                item['similarity'] = round(similarity, 3)
+                data.append(item)
+        return Response(data)
+
+    def _bulk_recipe_ids(self, serializer):
+        """Ids of the recipes a bulk action applies to: the ids given, or the filtered recipes"""
+        ids = serializer.validated_data.get('ids')
+        if ids is not None:
+            # scoped to request.user by the bulk helpers
+            return ids
+        filters = ['tags', 'ingredients'] + [f'{field}__{lookup}' for field in self.range_filters
+                                             for lookup in ('lte', 'gte')]
+        if not any(self.request.query_params.get(name) for name in filters):
+            # an unfiltered bulk action would hit the whole recipe box
+            raise ValidationError({'ids': ['Give recipe ids, or filters such as ?tags= or ?ingredients=.']})
+        return list(self.get_queryset().values_list('pk', flat=True))
+
+    # USE url recipe/recipes/bulk-delete/ with {"ids": [1, 2]}, or recipe/recipes/bulk-delete/?tags=3
+    @action(methods=['POST'], detail=False, url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """Delete many recipes in one transaction, answers with the number deleted"""
+        serializer = serializers.BulkRecipeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # set-based DELETEs, see core.bulk
+        deleted = bulk.delete_recipes(request.user.id, self._bulk_recipe_ids(serializer))
+        return Response({'deleted': deleted})
+
+    # USE url recipe/recipes/bulk-tag/ with {"ids": [1, 2], "tags": {"add": [4], "remove": [5]}}
+    @action(methods=['POST'], detail=False, url_path='bulk-tag')
+    def bulk_tag(self, request):
+        """Add/remove tags on many recipes in one transaction, answers with the counts"""
+        serializer = serializers.BulkTagSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        tags = serializer.validated_data['tags']
+        added, removed, changed = bulk.retag_recipes(
+            request.user.id,
+            self._bulk_recipe_ids(serializer),
+            add=[tag.pk for tag in tags.get('add', [])],
+            remove=[tag.pk for tag in tags.get('remove', [])],
+        )
+        return Response({'added': added, 'removed': removed, 'recipes': len(changed)})
+
+    # USE url recipe/recipes/cookable/?pantry=1,2,3&max_missing=1
+    @action(methods=['GET'], detail=False, url_path='cookable')
+    def cookable(self, request):
+        """List recipes that can be cooked with the given ingredients, fewest missing first"""
+        pantry_param = request.query_params.get('pantry')
+        ingredient_ids = _params_to_ints(pantry_param) if pantry_param else []
+        max_missing = _param_to_number('max_missing', request.query_params.get('max_missing', 0), int)
+        max_missing = max(max_missing, 0)
+        limit = _param_to_number('limit', request.query_params.get('limit', 50), int)
+        limit = min(max(limit, 1), 200)
+        # answered from the user's packed ingredient bitsets, see core.pantry
+        ranked = pantry.cookable_recipes(request.user.id, ingredient_ids, max_missing)[:limit]
+        recipes = Recipe.objects.filter(user=request.user, pk__in=[pk for pk, _ in ranked]).in_bulk()
+        data = []
+        for recipe_id, missing in ranked:
+            if recipe_id in recipes:
+                item = self.get_serializer(recipes[recipe_id]).data
+                item['missing'] = missing
+                data.append(item)
+        return Response(data)
+
+    # USE url recipe/recipes/meal-plan/?count=7&budget=60&max_time=300, add &prefer=1,2 to maximize
+    # recipes with the tags 1 and 2 instead of the number of distinct tags
+    @action(methods=['GET'], detail=False, url_path='meal-plan')
+    def meal_plan(self, request):
+        """Pick ?count= recipes within a total ?budget= and ?max_time=, see core.mealplan"""
+        params = request.query_params
+        for name in ('budget', 'max_time'):
+            if not params.get(name):
+                raise ValidationError({name: ['This parameter is required.']})
+        count = _param_to_number('count', params.get('count', 7), int)
+        if not 1 <= count <= settings.MEAL_PLAN_MAX_RECIPES:
+            raise ValidationError({'count': [f'Between 1 and {settings.MEAL_PLAN_MAX_RECIPES}.']})
+        budget = _param_to_number('budget', params['budget'], Decimal)
+        # Decimal takes NaN and Infinity
+        if not budget.is_finite() or budget < 0:
+            raise ValidationError({'budget': ['A positive number is required.']})
+        max_time = _param_to_number('max_time', params['max_time'], int)
+        if max_time < 0:
+            raise ValidationError({'max_time': ['A positive number is required.']})
+        # no plan of MEAL_PLAN_MAX_RECIPES recipes comes near these, and the sums stay within int64
+        budget, max_time = min(budget, Decimal(10 ** 9)), min(max_time, 2 ** 40)
+        prefer = None
+        if params.get('prefer'):
+            prefer = _param_to_number('prefer', params['prefer'], _params_to_ints)[:500]
+        # anytime search: the best plan found within the limit, "optimal" says if it is proven best
+        time_limit = _param_to_number(
+            'time_limit_ms', params.get('time_limit_ms', settings.MEAL_PLAN_TIME_LIMIT_MS), int
+        )
+        time_limit = min(max(time_limit, 1), settings.MEAL_PLAN_MAX_TIME_LIMIT_MS) / 1000
+        result = mealplan.plan(request.user.id, count, budget, max_time, prefer, time_limit)
+        recipes = Recipe.objects.filter(user=request.user).prefetch_related('tags', 'ingredients') \
+            .in_bulk(result.recipe_ids)
+        return Response({
+            'recipes': [self.get_serializer(recipes[pk]).data for pk in result.recipe_ids],
+            # two decimals like every price of the API
+            'total_price': str((Decimal(result.price_cents) / 100).quantize(Decimal('0.01'))),
+            'total_time_minutes': result.minutes,
+            'score': result.score,
+            'optimal': result.optimal,
+        })
+
+    # USE url recipe/recipes/duplicates/: GET lists the groups found by the last scan,
+    # POST queues a new scan
+    @action(methods=['GET', 'POST'], detail=False, url_path='duplicates')
+    def duplicates(self, request):
+        """Groups of near-identical recipes: same title up to case and punctuation, same ingredients"""
+        if request.method == 'POST':
+            # the scan hashes the whole recipe box, see core.dedupe
+            jobs.enqueue('recipes.find_duplicates', user_id=request.user.id)
+            return Response({'queued': True}, status=status.HTTP_202_ACCEPTED)
+        groups = dedupe.duplicate_groups(request.user.id)
+        recipes = Recipe.objects.filter(user=request.user).prefetch_related('tags', 'ingredients') \
+            .in_bulk([pk for group in groups for pk in group])
+        return Response({'groups': [
+            [self.get_serializer(recipes[pk]).data for pk in group if pk in recipes] for group in groups
+        ]})
+
+    # USE url recipe/recipes/merge/ with {"keep": 1, "ids": [2, 3]}
+    @action(methods=['POST'], detail=False, url_path='merge')
+    def merge(self, request):
+        """Merge recipes into one: their tags and ingredients move to "keep", they are deleted"""
+        serializer = serializers.MergeRecipesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            merged, tags_added, ingredients_added = bulk.merge_recipes(
+                request.user.id, serializer.validated_data['keep'], serializer.validated_data['ids']
+            )
+        except Recipe.DoesNotExist:
+            raise ValidationError({'keep': ['No such recipe.']})
+        return Response({'merged': merged, 'tags_added': tags_added, 'ingredients_added': ingredients_added})
+
+
+class ChangeFeedViewSet(viewsets.ViewSet):
+    """Delta sync: what changed in the user's recipe box since a ?since= token
+    Start with since=0, then pass the returned "next" token until has_more is false"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    default_limit = 100
+    max_limit = 500
+    # Change.kind -> model and serializer of the objects in the feed
+    kinds = {
+        Change.KIND_RECIPE: (Recipe, serializers.RecipeSerializer),
+        Change.KIND_TAG: (Tag, serializers.TagSerializer),
+        Change.KIND_INGREDIENT: (Ingredient, serializers.IngredientSerializer),
+    }
+
+    def list(self, request):
+        errors = {}
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            errors['since'] = ['Invalid token.']
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            errors['limit'] = ['A valid integer is required.']
+        if errors:
+            raise ValidationError(errors)
+        limit = min(max(limit, 1), self.max_limit)
+        # (user, seq) unique index: the page is a range scan after the token
+        entries = list(
+            Change.objects.filter(user=request.user, seq__gt=since).order_by('seq')[:limit + 1]
+        )
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        # current state of the changed objects, one query per kind
+        changed_ids = defaultdict(list)
+        for entry in entries:
+            if not entry.deleted:
+                changed_ids[entry.kind].append(entry.object_id)
+        objects = {}
+        for kind, ids in changed_ids.items():
+            queryset = self.kinds[kind][0].objects.filter(user=request.user)
+            if kind == Change.KIND_RECIPE:
+                queryset = queryset.prefetch_related('tags', 'ingredients')
+            objects[kind] = queryset.in_bulk(ids)
+
+        data = []
+        for entry in entries:
+            item = {'seq': entry.seq, 'kind': entry.kind, 'id': entry.object_id, 'deleted': entry.deleted}
+            if not entry.deleted:
+                obj = objects[entry.kind].get(entry.object_id)
+                if obj is None:
+                    # deleted since, its tombstone comes later in the feed
+                    continue
+                item['data'] = self.kinds[entry.kind][1](obj).data
+            data.append(item)
+        return Response({
+            'changes': data,
+            'next': str(entries[-1].seq if entries else since),
+            'has_more': has_more,
+        })
+
+
+class ShoppingListViewSet(viewsets.ViewSet):
+    """Ingredients of the ?recipes= given, each listed once with the number of recipes using it
+    USE url recipe/shopping-list/?recipes=1,2,3"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def list(self, request):
+        try:
+            recipe_ids = set(_params_to_ints(request.query_params.get('recipes', '')))
+        except ValueError:
+            raise ValidationError({'recipes': ['Give a comma separated list of recipe ids.']})
+        if len(recipe_ids) > settings.SHOPPING_LIST_MAX_RECIPES:
+            raise ValidationError({'recipes': [f'At most {settings.SHOPPING_LIST_MAX_RECIPES} recipes.']})
+        # grouped by the database, see core.shopping
+        rows = shopping.ingredient_counts(request.user.id, recipe_ids)
+        if len(recipe_ids) <= settings.SHOPPING_LIST_STREAM_AFTER:
+            return Response({'ingredients': [
+                {'id': ingredient_id, 'name': name, 'recipes': count} for ingredient_id, name, count in rows
+            ]})
+        # large selections: the same JSON, written out while the rows are read
+        return StreamingHttpResponse(self._stream(rows), content_type='application/json')
+
+    def _stream(self, rows):
+        yield '{"ingredients": ['
+        separator = ''
+        for ingredient_id, name, count in rows:
+            yield separator + json.dumps({'id': ingredient_id, 'name': name, 'recipes': count})
+            separator = ', '
+        yield ']}'
+
 
 # class TagViewSet(viewsets.GenericViewSet,
 #                  mixins.ListModelMixin,
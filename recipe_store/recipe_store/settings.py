@@ -42,9 +42,11 @@ INSTALLED_APPS = [
     'core.apps.CoreConfig',
     'user',
     'recipe_app',
+    'batch',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InFlightLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,6 +95,29 @@ DATABASES = {
 #     'PASSWORD': os.environ.get('DB_PASSWORD'),
 # }
 
+# Cache
+# The default cache carries state between worker processes: the pantry index versions
+# (core.pantry), the cached /user/me/ responses (user.profile) and, with
+# RATELIMIT_BACKEND = 'cache', the rate limit counters. Deployments running more than one
+# process set CACHE_LOCATION to a memcached server (python-memcached must be installed).
+# Without it each process has a local memory cache of its own, right for a single process
+# only: the other processes would not see a pantry change until they restart, and would
+# serve a changed profile for up to USER_PROFILE_CACHE_TIMEOUT seconds.
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION')
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -138,3 +163,119 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 AUTH_USER_MODEL = 'core.User'
+
+# Recipe box tuning
+
+# Users whose "what can I cook" ingredient bitsets are kept in memory per process (LRU)
+PANTRY_INDEX_MAX_USERS = 256
+
+# Maximum number of recipes fetched by one /recipe/recipes/?ids= request
+RECIPE_BATCH_MAX_IDS = 100
+
+# Tag and ingredient names starting with an autocomplete ?prefix= that are ranked by use
+AUTOCOMPLETE_CANDIDATES = 500
+
+# /batch/: most sub-requests per call, and threads used for ?parallel reads
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+
+# uploads are size checked and hashed while they stream in, see core.uploadhandlers
+FILE_UPLOAD_HANDLERS = [
+    'core.uploadhandlers.MaxSizeUploadHandler',
+    'core.uploadhandlers.HashingMemoryFileUploadHandler',
+    'core.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# Background jobs (core.jobs): seconds a worker holds a claimed job,
+# and the exponential retry backoff of failed attempts
+JOBS_LEASE_SECONDS = 300
+JOBS_RETRY_BASE_DELAY = 10
+JOBS_RETRY_MAX_DELAY = 3600
+
+# Media serving (core.views.serve_media): max-age of files whose name is not a content hash,
+# and the web server offload - None (Python streams the file), 'x-sendfile' or 'x-accel-redirect'.
+# For nginx, MEDIA_ACCEL_REDIRECT_PREFIX is an internal location aliased to MEDIA_ROOT.
+MEDIA_CACHE_MAX_AGE = 86400
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Upload limits: bytes per uploaded file (checked while streaming), and what an image
+# may declare in its header - checked before any pixel is decoded, see recipe_app.serializers
+FILE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+IMAGE_MAX_DIMENSION = 8000
+IMAGE_MAX_PIXELS = 40000000
+
+# Admin changelists count at most this many rows, see core.admin.EstimatedCountPaginator
+ADMIN_COUNT_LIMIT = 10000
+
+# API tokens: 'db' (rest_framework.authtoken, one lookup per request) or 'signed' (user.tokens,
+# HMAC signed access tokens checked without the database, and refresh tokens)
+AUTH_TOKEN_MODE = os.environ.get('AUTH_TOKEN_MODE', 'db')
+ACCESS_TOKEN_LIFETIME = 15 * 60
+REFRESH_TOKEN_LIFETIME = 30 * 24 * 3600
+# seconds a process may use its copy of the token revocation list
+TOKEN_REVOCATION_REFRESH = 5
+
+# Password hashing policy: PASSWORD_HASHER picks the hasher of new hashes, stored hashes
+# of the other ones (or with other parameters) are upgraded at login - see user.hashers.
+# The parameters are meant to be tuned on the production hardware: manage.py calibrate_hasher
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = 120000
+PASSWORD_SCRYPT_N = 2 ** 14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_HASHERS = [
+    'user.hashers.TunedPBKDF2PasswordHasher',
+    'user.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+if PASSWORD_HASHER == 'scrypt':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+# Login password checks run on a bounded pool (user.hashing): threads hashing at once, logins
+# allowed to wait for a thread - past that they get a 503 - and seconds a login may wait
+LOGIN_HASH_WORKERS = 4
+LOGIN_HASH_QUEUE = 16
+LOGIN_HASH_TIMEOUT = 10
+
+# Hosts allowed to read /metrics/ without a staff session, see core.metrics
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+# seconds a /user/me/ response stays cached - saving the user drops it earlier, see user.profile
+USER_PROFILE_CACHE_TIMEOUT = 300
+
+# Requests a worker process handles at once, the ones past that get a 503 (core.middleware)
+MAX_IN_FLIGHT_REQUESTS = 64
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': ('core.ratelimit.TokenBucketThrottle',),
+}
+# Token bucket limits per client and view, see core.ratelimit:
+# view name or app namespace -> (requests a second on average, burst)
+RATELIMIT_RULES = {
+    'user:token': (1, 10),
+    'user:token-refresh': (1, 10),
+    'user:create': (0.2, 5),
+    'user': (10, 50),
+    'recipe_app': (20, 100),
+    'batch': (5, 20),
+}
+# 'local': buckets in each worker process, 'cache': shared through the default cache (see CACHES)
+RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'local')
+# buckets kept by a process before the least recently used ones are dropped, split evenly
+# between the lock stripes of core.ratelimit
+RATELIMIT_MAX_KEYS = 100000
+
+# /recipe/shopping-list/: recipes one request may ask for, and past how many the response
+# is streamed instead of built in memory
+SHOPPING_LIST_MAX_RECIPES = 5000
+SHOPPING_LIST_STREAM_AFTER = 200
+
+# /recipe/recipes/meal-plan/: recipes per plan, and milliseconds the search may take by
+# default / at most - past that the best plan found so far is returned, see core.mealplan
+MEAL_PLAN_MAX_RECIPES = 50
+MEAL_PLAN_TIME_LIMIT_MS = 200
+MEAL_PLAN_MAX_TIME_LIMIT_MS = 2000
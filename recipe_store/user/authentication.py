@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework import authentication, exceptions
+
+from user import tokens
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """'Authorization: Token <key>' for database tokens and, with AUTH_TOKEN_MODE = 'signed',
+    for signed access tokens as well - those are checked without touching the database"""
+
+    def authenticate_credentials(self, key):
+        # database tokens are 40 hex digits, signed ones payload.signature
+        if settings.AUTH_TOKEN_MODE == 'signed' and '.' in key:
+            try:
+                claims = tokens.verify(key, tokens.ACCESS)
+            except tokens.InvalidToken as exc:
+                raise exceptions.AuthenticationFailed(str(exc))
+            # no is_active check: deactivating a user revokes their tokens, on save()
+            # (core.signals) and in bulk.lock_out - a plain QuerySet.update() does not
+            return tokens.token_user(claims), claims
+        # existing database tokens keep working after switching to signed tokens
+        return super().authenticate_credentials(key)
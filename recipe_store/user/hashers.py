@@ -0,0 +1,72 @@
+import base64
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.hashers import BasePasswordHasher, PBKDF2PasswordHasher, mask_hash
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+# Password hashers whose cost comes from settings (tune with manage.py calibrate_hasher).
+# A stored hash made with other parameters, or with a hasher that is not the first of
+# PASSWORD_HASHERS, is replaced by a hash with the current ones at the next login.
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with PASSWORD_PBKDF2_ITERATIONS - same algorithm name, reads Django's hashes"""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    """scrypt (memory hard) from hashlib, cost PASSWORD_SCRYPT_N/R/P
+    Format: scrypt$n$r$p$salt$hash"""
+    algorithm = 'scrypt'
+    dklen = 64
+
+    def _params(self):
+        return settings.PASSWORD_SCRYPT_N, settings.PASSWORD_SCRYPT_R, settings.PASSWORD_SCRYPT_P
+
+    def _hash(self, password, salt, n, r, p):
+        # 128 * n * r bytes of memory, plus headroom
+        derived = hashlib.scrypt(
+            password.encode(), salt=salt.encode(), n=n, r=r, p=p, dklen=self.dklen,
+            maxmem=256 * n * r + 1024 * 1024,
+        )
+        return base64.b64encode(derived).decode('ascii').strip()
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        default_n, default_r, default_p = self._params()
+        n, r, p = n or default_n, r or default_r, p or default_p
+        return f'{self.algorithm}${n}${r}${p}${salt}${self._hash(password, salt, n, r, p)}'
+
+    def _decode(self, encoded):
+        algorithm, n, r, p, salt, hash = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return int(n), int(r), int(p), salt, hash
+
+    def verify(self, password, encoded):
+        n, r, p, salt, hash = self._decode(encoded)
+        return constant_time_compare(encoded, self.encode(password, salt, n, r, p))
+
+    def safe_summary(self, encoded):
+        n, r, p, salt, hash = self._decode(encoded)
+        return OrderedDict([
+            (_('algorithm'), self.algorithm),
+            (_('work factor'), n),
+            (_('block size'), r),
+            (_('parallelism'), p),
+            (_('salt'), mask_hash(salt)),
+            (_('hash'), mask_hash(hash)),
+        ])
+
+    def must_update(self, encoded):
+        return self._decode(encoded)[:3] != self._params()
+
+    def harden_runtime(self, password, encoded):
+        # the cost is all in one call, nothing to even out
+        pass
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, user_login_failed
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core import metrics
+
+# Login password checks off the request thread, on a bounded pool.
+# PBKDF2/scrypt in hashlib release the GIL, so LOGIN_HASH_WORKERS threads hash in parallel
+# while the other request threads keep serving reads. At most LOGIN_HASH_QUEUE more logins
+# may wait for a thread; any login past that is refused at once with a 503 instead of
+# piling up behind the hashes. The pool only hashes: users are read and saved on the request
+# thread, with its own database connection and transaction.
+# This stands in for django.contrib.auth.authenticate() with the default ModelBackend rules
+# (password and is_active), AUTHENTICATION_BACKENDS is not consulted. Failures still send
+# user_login_failed, for the receivers that audit or lock out on it.
+
+
+class LoginOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, retry shortly.'
+    default_code = 'login_overloaded'
+    # sent as Retry-After by DRF's exception handler
+    wait = 1
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.LOGIN_HASH_WORKERS, thread_name_prefix='login-hash'
+            )
+            # running + waiting checks
+            _slots = threading.BoundedSemaphore(settings.LOGIN_HASH_WORKERS + settings.LOGIN_HASH_QUEUE)
+        return _pool, _slots
+
+
+def _check(password, encoded):
+    """Return (valid, new hash or None) - run on the pool"""
+    if encoded is None:
+        # unknown user: hash anyway, the response time must not tell which emails exist
+        make_password(password)
+        return False, None
+    valid = check_password(password, encoded)
+    if not valid:
+        return False, None
+    # transparent upgrade: stored with an older hasher or older parameters
+    preferred = get_hasher('default')
+    hasher = identify_hasher(encoded)
+    if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+        return True, make_password(password, hasher=preferred)
+    return True, None
+
+
+def run_check(password, encoded):
+    """Run _check on the pool, raising LoginOverloaded when it is full"""
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        metrics.incr('login_shed_total')
+        raise LoginOverloaded()
+    future = pool.submit(_check, password, encoded)
+    # the slot is free once the hash is done, even if this request gave up waiting for it
+    future.add_done_callback(lambda future: slots.release())
+    try:
+        return future.result(timeout=settings.LOGIN_HASH_TIMEOUT)
+    except TimeoutError:
+        metrics.incr('login_shed_total')
+        raise LoginOverloaded()
+
+
+def authenticate(email, password, request=None):
+    """Return the active user with these credentials, or None"""
+    started = time.perf_counter()
+    User = get_user_model()
+    user = User._default_manager.filter(**{User.USERNAME_FIELD: email}).first()
+    valid, new_hash = run_check(password, user.password if user is not None else None)
+    if valid and new_hash:
+        user.password = new_hash
+        user.save(update_fields=['password'])
+        metrics.incr('password_rehash_total')
+    metrics.observe('login_seconds', time.perf_counter() - started)
+    if valid and user.is_active:
+        metrics.incr('login_success_total')
+        return user
+    metrics.incr('login_failure_total')
+    # the password masked, as django.contrib.auth.authenticate() sends it
+    credentials = {'email': email, 'password': '********************'}
+    user_login_failed.send(sender=__name__, credentials=credentials, request=request)
+    return None
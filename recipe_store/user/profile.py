@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Cached /user/me/ representation, one cache entry per user.
+# Saving or deleting a user drops the entry (core.signals), so profile edits and password
+# changes show up at once, whatever made them: the API, the admin or a shell - in every
+# worker when the cache is shared (see CACHES in the settings), else in this process only.
+
+
+def _key(user_id):
+    return f'user.profile.{user_id}'
+
+
+def get(user, serialize):
+    """Cached representation of user, serialize(user) computes it on a miss"""
+    key = _key(user.pk)
+    data = cache.get(key)
+    if data is None:
+        data = dict(serialize(user))
+        cache.set(key, data, settings.USER_PROFILE_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate(user_id):
+    """Drop the cached representation of a user"""
+    cache.delete(_key(user_id))
+    # a read between the save and the commit may have cached the old row again
+    transaction.on_commit(lambda: cache.delete(_key(user_id)))
@@ -1,8 +1,10 @@
-from django.contrib.auth import get_user_model, authenticate
+from django.contrib.auth import get_user_model
 # while outputting msgs to the screen for langage conversion
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
+from user import hashing, tokens
+
 
 class UserSerializer(serializers.ModelSerializer):
     """serializer for the user objects"""
@@ -45,11 +47,8 @@ class AuthTokenSerializer(serializers.Serializer):
         email = attrs.get('email')
         password = attrs.get('password')
 
-        user = authenticate(
-            request=self.context.get('request'),
-            username=email,
-            password=password
-        )
+        # the hash runs on the login pool, a full pool answers 503 (hashing.LoginOverloaded)
+        user = hashing.authenticate(email, password, request=self.context.get('request'))
 
         if not user:
             # _ used: convert into any other language if need be in future
@@ -59,3 +58,20 @@ class AuthTokenSerializer(serializers.Serializer):
 
         attrs['user'] = user
         return attrs
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    """serializer for exchanging a signed refresh token for a new access token"""
+    refresh = serializers.CharField()
+
+    def validate_refresh(self, value):
+        try:
+            claims = tokens.verify(value, tokens.REFRESH)
+        except tokens.InvalidToken as exc:
+            raise serializers.ValidationError(str(exc), code='authentication')
+        # the only database hit of the signed token flow: the user may be gone or inactive
+        user = get_user_model().objects.filter(pk=claims['uid'], is_active=True).first()
+        if user is None:
+            raise serializers.ValidationError(_('User inactive or deleted.'), code='authentication')
+        self.claims, self.user = claims, user
+        return value
@@ -0,0 +1,112 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model, user_login_failed
+from django.contrib.auth.hashers import check_password, identify_hasher
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import metrics, ratelimit
+from user import hashing
+
+TOKEN_URL = reverse('user:token')
+
+# cheap parameters, the tests hash a lot
+FAST_HASHING = {'PASSWORD_PBKDF2_ITERATIONS': 1000, 'PASSWORD_SCRYPT_N': 2 ** 8}
+SCRYPT_FIRST = [
+    'user.hashers.ScryptPasswordHasher',
+    'user.hashers.TunedPBKDF2PasswordHasher',
+]
+
+
+@override_settings(**FAST_HASHING)
+class LoginHashingTests(TestCase):
+    """Test logins checked on the hashing pool"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@gmail.com', password='testpass')
+        metrics.reset()
+        ratelimit.reset()
+
+    def login(self, password='testpass'):
+        return self.client.post(TOKEN_URL, {'email': 'test@gmail.com', 'password': password})
+
+    def stored_hash(self):
+        return get_user_model().objects.values_list('password', flat=True).get(pk=self.user.pk)
+
+    def test_login_counts_and_times(self):
+        """Test logins are counted and their latency recorded"""
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.login('wrong').status_code, status.HTTP_400_BAD_REQUEST)
+
+        values = metrics.snapshot()
+        self.assertEqual(values['counters']['login_success_total'], 1)
+        self.assertEqual(values['counters']['login_failure_total'], 1)
+        self.assertEqual(values['histograms']['login_seconds']['count'], 2)
+
+    def test_rehash_when_iterations_change(self):
+        """Test a hash with other iterations is replaced at the next login"""
+        old_hash = self.stored_hash()
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+            new_hash = self.stored_hash()
+            self.assertNotEqual(new_hash, old_hash)
+            self.assertTrue(new_hash.startswith('pbkdf2_sha256$2000$'))
+            # no second upgrade
+            self.login()
+            self.assertEqual(self.stored_hash(), new_hash)
+        self.assertEqual(metrics.snapshot()['counters']['password_rehash_total'], 1)
+
+    def test_rehash_to_preferred_hasher(self):
+        """Test a PBKDF2 hash is upgraded to scrypt once scrypt is preferred"""
+        with override_settings(PASSWORD_HASHERS=SCRYPT_FIRST):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+            new_hash = self.stored_hash()
+            self.assertEqual(identify_hasher(new_hash).algorithm, 'scrypt')
+            self.assertTrue(check_password('testpass', new_hash))
+            self.assertFalse(check_password('wrong', new_hash))
+
+    def test_no_rehash_on_failed_login(self):
+        """Test a wrong password leaves the stored hash alone"""
+        old_hash = self.stored_hash()
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.login('wrong')
+        self.assertEqual(self.stored_hash(), old_hash)
+
+    def test_inactive_user_rejected(self):
+        """Test an inactive user cannot log in with the right password"""
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.login().status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_login_signal(self):
+        """Test a failed login sends user_login_failed, without the password"""
+        received = []
+
+        def receiver(sender, credentials, request, **kwargs):
+            received.append((credentials, request))
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+
+        self.login()
+        self.assertEqual(received, [])
+        self.login('wrong')
+
+        self.assertEqual(len(received), 1)
+        credentials, request = received[0]
+        self.assertEqual(credentials['email'], 'test@gmail.com')
+        self.assertNotIn('wrong', credentials['password'])
+        self.assertIsNotNone(request)
+
+    def test_overloaded_pool_sheds(self):
+        """Test logins are refused with a 503 when the pool is full"""
+        _pool, slots = hashing._get_pool()
+        with mock.patch.object(slots, 'acquire', return_value=False):
+            res = self.login()
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
+        self.assertEqual(metrics.snapshot()['counters']['login_shed_total'], 1)
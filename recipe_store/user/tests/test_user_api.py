@@ -1,16 +1,26 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 # rest framework helper tools for testing
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core import bulk, ratelimit
+from core.models import TokenRevocation
+from user import tokens
+
 # Caps is naming convention for variables u dont expect to change
 CREATE_USER_URL = reverse('user:create')
 # url for the http request to generate our token
 TOKEN_URL = reverse('user:token')
 # endpoint to update and view a specific user details who is already authenticated and logged in
 ME_URL = reverse('user:me')
+REFRESH_URL = reverse('user:token-refresh')
+REVOKE_URL = reverse('user:token-revoke')
+RECIPES_URL = reverse('recipe_app:recipe-list')
 
 # Helper function to create a user every time user is needed for test
 
@@ -25,6 +35,8 @@ class PublicUserApiTests(TestCase):
     """Test the public users API"""
 
     def setUp(self):
+        # every test logs in from the same address
+        ratelimit.reset()
         self.client = APIClient()
 
     def test_create_valid_user_success(self):
@@ -104,6 +116,8 @@ class PrivateUserApiTests(TestCase):
     # User needs to be created and authenticated before every test
 
     def setUp(self):
+        # cached profiles of earlier tests may be keyed by a user id used again
+        cache.clear()
         self.user = create_user(
             email='test@gmail.com',
             password='testpassword',
@@ -134,3 +148,120 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_profile_served_from_cache(self):
+        """Test a profile read again runs no query"""
+        self.client.get(ME_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.data, {'name': 'test name', 'email': 'test@gmail.com'})
+
+    def test_cached_profile_dropped_on_update(self):
+        """Test the profile reads the new values after an update, from the API or not"""
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'name': 'Updated name'})
+
+        self.assertEqual(self.client.get(ME_URL).data['name'], 'Updated name')
+
+        self.user.name = 'Admin edit'
+        self.user.save()
+        self.assertEqual(self.client.get(ME_URL).data['name'], 'Admin edit')
+
+
+@override_settings(AUTH_TOKEN_MODE='signed')
+class SignedTokenApiTests(TestCase):
+    """Tests for signed access/refresh tokens"""
+
+    def setUp(self):
+        # revocations of earlier tests may be cached for a user id used again
+        tokens.revocations.changed()
+        cache.clear()
+        ratelimit.reset()
+        self.user = create_user(email='test@gmail.com', password='testpassword', name='test name')
+        self.client = APIClient()
+        res = self.client.post(TOKEN_URL, {'email': 'test@gmail.com', 'password': 'testpassword'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.access, self.refresh = res.data['token'], res.data['refresh']
+
+    def get(self, url, token):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Token {token}')
+
+    def test_access_token_checked_without_database(self):
+        """Test requests are authenticated with no token or user lookup"""
+        self.get(RECIPES_URL, self.access)  # loads the revocation list
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.get(RECIPES_URL, self.access)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('authtoken_token', sql)
+        self.assertNotIn('core_user', sql)
+
+    def test_profile_without_queries(self):
+        """Test a cached profile is served with a signed token without any query"""
+        self.get(ME_URL, self.access)
+
+        with self.assertNumQueries(0):
+            res = self.get(ME_URL, self.access)
+        self.assertEqual(res.data, {'name': 'test name', 'email': 'test@gmail.com'})
+
+    def test_profile_with_access_token(self):
+        """Test the profile view works unchanged with a signed token"""
+        res = self.get(ME_URL, self.access)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'name': 'test name', 'email': 'test@gmail.com'})
+
+    def test_refresh_token(self):
+        """Test a refresh token gets a new access token, and is no access token itself"""
+        res = self.client.post(REFRESH_URL, {'refresh': self.refresh})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(ME_URL, res.data['token']).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.get(ME_URL, self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+        res = self.client.post(REFRESH_URL, {'refresh': self.access})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revoked_tokens_rejected(self):
+        """Test logging out revokes the access and refresh tokens"""
+        auth = f'Token {self.access}'
+        res = self.client.post(REVOKE_URL, {'refresh': self.refresh}, HTTP_AUTHORIZATION=auth)
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self.get(ME_URL, self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+        res = self.client.post(REFRESH_URL, {'refresh': self.refresh})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_locked_out_user_rejected(self):
+        """Test deactivating a user revokes their signed tokens"""
+        bulk.lock_out([self.user.id])
+
+        self.assertEqual(self.get(ME_URL, self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        """Test saving a user as inactive, as the admin does, revokes their signed tokens"""
+        user = get_user_model().objects.get(pk=self.user.id)
+        user.is_active = False
+        user.save()
+
+        self.assertEqual(self.get(ME_URL, self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+        # saved again while inactive: revoked already
+        user.name = 'other name'
+        user.save()
+        self.assertEqual(TokenRevocation.objects.filter(user_id=user.id).count(), 1)
+
+    def test_tampered_or_expired_token_rejected(self):
+        """Test tokens with a bad signature or past their expiry are rejected"""
+        payload, signature = self.access.split('.')
+        self.assertEqual(self.get(ME_URL, f'{payload}.{signature[::-1]}').status_code, 401)
+
+        with override_settings(ACCESS_TOKEN_LIFETIME=-1):
+            expired = tokens.issue(self.user, tokens.ACCESS)
+        self.assertEqual(self.get(ME_URL, expired).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_signed_tokens_rejected_in_db_mode(self):
+        """Test signed tokens only work in the signed mode"""
+        with override_settings(AUTH_TOKEN_MODE='db'):
+            self.assertEqual(self.get(ME_URL, self.access).status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.translation import ugettext_lazy as _
+
+from core.models import TokenRevocation
+
+# Signed tokens (AUTH_TOKEN_MODE = 'signed'): a short lived access token authenticates
+# requests without any database lookup, a long lived refresh token gets new access tokens.
+# A token is base64url(json payload) "." base64url(HMAC-SHA256 of the payload), keyed with a
+# key derived from SECRET_KEY per token type, so a refresh token is never a valid access token.
+# Revoked tokens are listed in core.TokenRevocation until they expire; each process keeps
+# that (small) list in memory and reloads it every TOKEN_REVOCATION_REFRESH seconds.
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _key(token_type):
+    """Signing key of a token type, derived from SECRET_KEY"""
+    purpose = f'user.tokens.{token_type}'.encode()
+    return hmac.new(force_bytes(settings.SECRET_KEY), purpose, hashlib.sha256).digest()
+
+
+def _signature(token_type, payload):
+    return hmac.new(_key(token_type), payload, hashlib.sha256).digest()
+
+
+def issue(user, token_type):
+    """Return a new signed token of the given type for user"""
+    lifetime = settings.ACCESS_TOKEN_LIFETIME if token_type == ACCESS else settings.REFRESH_TOKEN_LIFETIME
+    # milliseconds: a token issued right after a revoke_user() is not caught by it
+    now = round(time.time(), 3)
+    payload = json.dumps(
+        {'uid': user.pk, 'iat': now, 'exp': int(now) + lifetime, 'jti': secrets.token_hex(8)},
+        separators=(',', ':'),
+    ).encode()
+    return f'{_b64encode(payload)}.{_b64encode(_signature(token_type, payload))}'
+
+
+def verify(token, token_type):
+    """Return the payload of a valid, unexpired and unrevoked token, or raise InvalidToken"""
+    try:
+        encoded_payload, encoded_signature = token.split('.')
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (ValueError, TypeError):
+        raise InvalidToken(_('Malformed token.'))
+    if not hmac.compare_digest(signature, _signature(token_type, payload)):
+        raise InvalidToken(_('Invalid signature.'))
+    claims = json.loads(payload.decode())
+    if claims['exp'] <= time.time():
+        raise InvalidToken(_('Token expired.'))
+    if revocations.is_revoked(claims):
+        raise InvalidToken(_('Token revoked.'))
+    return claims
+
+
+def token_user(claims):
+    """User of a verified token, with only its pk loaded - the other fields load on first use"""
+    User = get_user_model()
+    return User.from_db(None, [User._meta.pk.attname], [claims['uid']])
+
+
+def _expires_at(claims):
+    # aware or naive like timezone.now(), depending on USE_TZ
+    return timezone.now() + timedelta(seconds=claims['exp'] - time.time())
+
+
+def _add_revocation(**fields):
+    now = timezone.now()
+    # expired rows are dead weight, dropped on the way
+    TokenRevocation.objects.filter(expires_at__lte=now).delete()
+    TokenRevocation.objects.create(revoked_at=now, **fields)
+    revocations.changed()
+
+
+def revoke(claims):
+    """Revoke one token"""
+    _add_revocation(user_id=claims['uid'], jti=claims['jti'], expires_at=_expires_at(claims))
+
+
+def revoke_user(user_id):
+    """Revoke every token issued to a user so far"""
+    _add_revocation(
+        user_id=user_id, expires_at=timezone.now() + timedelta(seconds=settings.REFRESH_TOKEN_LIFETIME)
+    )
+
+
+class RevocationList:
+    """In-process copy of the unexpired revocations"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.jtis = frozenset()
+        # user id -> tokens issued before this timestamp are revoked
+        self.not_before = {}
+
+    def changed(self):
+        """Reload on next use - revoked here, or the tables were reset"""
+        self.loaded_at = None
+
+    def _load(self):
+        jtis, not_before = set(), {}
+        rows = TokenRevocation.objects.filter(expires_at__gt=timezone.now())
+        for user_id, jti, revoked_at in rows.values_list('user_id', 'jti', 'revoked_at'):
+            if jti:
+                jtis.add(jti)
+            else:
+                not_before[user_id] = max(not_before.get(user_id, 0), revoked_at.timestamp())
+        self.jtis, self.not_before = frozenset(jtis), not_before
+
+    def is_revoked(self, claims):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at >= settings.TOKEN_REVOCATION_REFRESH:
+            with self.lock:
+                if self.loaded_at is None or now - self.loaded_at >= settings.TOKEN_REVOCATION_REFRESH:
+                    self._load()
+                    self.loaded_at = now
+        return claims['jti'] in self.jtis or claims['iat'] < self.not_before.get(claims['uid'], 0)
+
+
+revocations = RevocationList()
@@ -1,5 +1,10 @@
-from rest_framework import generics, authentication, permissions
-from user.serializers import UserSerializer, AuthTokenSerializer
+from django.conf import settings
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from user import authentication, profile, tokens
+from user.serializers import UserSerializer, AuthTokenSerializer, RefreshTokenSerializer
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 # Create your views here.
@@ -11,11 +16,65 @@ class CreateUserView(generics.CreateAPIView):
 
 
 class CreateTokenView(ObtainAuthToken):
-    """Creates a new auth token for user"""
+    """Creates a new auth token for user
+    With AUTH_TOKEN_MODE = 'signed': a signed access token, plus a refresh token"""
     serializer_class = AuthTokenSerializer
+    # ObtainAuthToken turns throttling off, logins are the first thing to limit
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
     # set the renderer class, so that we can view the endpoint in browser
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        if settings.AUTH_TOKEN_MODE != 'signed':
+            return super().post(request, *args, **kwargs)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        return Response({
+            'token': tokens.issue(user, tokens.ACCESS),
+            'refresh': tokens.issue(user, tokens.REFRESH),
+            'expires_in': settings.ACCESS_TOKEN_LIFETIME,
+        })
+
+
+class RefreshTokenView(APIView):
+    """Exchanges a signed refresh token for a new access token"""
+    authentication_classes = ()
+    permission_classes = ()
+
+    def post(self, request):
+        if settings.AUTH_TOKEN_MODE != 'signed':
+            raise NotFound()
+        serializer = RefreshTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({
+            'token': tokens.issue(serializer.user, tokens.ACCESS),
+            'expires_in': settings.ACCESS_TOKEN_LIFETIME,
+        })
+
+
+class RevokeTokenView(APIView):
+    """Logs out: revokes the token of the request, and the refresh token given if any"""
+    authentication_classes = (authentication.TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        if isinstance(request.auth, dict):
+            # signed access token: its claims
+            tokens.revoke(request.auth)
+            refresh = request.data.get('refresh')
+            if refresh:
+                try:
+                    claims = tokens.verify(refresh, tokens.REFRESH)
+                except tokens.InvalidToken:
+                    claims = None
+                if claims and claims['uid'] == request.user.pk:
+                    tokens.revoke(claims)
+        else:
+            # database token
+            request.auth.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """Manages view/update for authenticated user"""
@@ -29,4 +88,10 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
 
     def get_object(self):
         """Retrieve and return authenticated user"""
+        # the instance authentication loaded: the permission checks and the serializer
+        # use it as well, nothing is fetched again
         return self.request.user
+
+    def retrieve(self, request, *args, **kwargs):
+        # served from the cache, dropped whenever the user is saved (see user.profile)
+        return Response(profile.get(self.get_object(), lambda user: self.get_serializer(user).data))